@@ -3,19 +3,31 @@ import { query, run } from '@/lib/db';
 import { v4 as uuidv4 } from 'uuid';
 import { readFile, writeFile, mkdir } from 'fs/promises';
 import path from 'path';
+import {
+	TtsServiceBusyError,
+	TtsServiceError,
+	getVoiceSampleId,
+	isVoiceNotRegistered,
+	registerVoiceSample,
+} from '@/lib/tts';
+import { getTtsServiceUrl } from '@/lib/tts/config';
 
 // Specify Node.js runtime
 export const runtime = 'nodejs';
 
 // Service configuration
-const ttsServiceUrl = process.env.TTS_SERVICE_URL || 'http://libreva-tts:3100';
+const ttsServiceUrl = getTtsServiceUrl();
 
 type TtsRequest = {
 	text: string;
 	voice: 'default' | 'custom';
 	voice_sample?: string;
+	voice_id?: string;
 	exaggeration: number;
 	temperature: number;
+	format: 'wav16';
+	seed?: number;
+	incremental?: boolean;
 };
 
 class VoiceNotFoundError extends Error {
@@ -25,24 +37,50 @@ class VoiceNotFoundError extends Error {
 	}
 }
 
-class TtsServiceError extends Error {
-	constructor(message: string) {
-		super(message);
-		this.name = 'TtsServiceError';
-	}
+// Who the TTS service queues a request for; it lets every client only take a share of its queue
+function getClientId(request: NextRequest): string {
+	return request.headers.get('x-forwarded-for')?.split(',')[0].trim() || 'web';
 }
 
+async function requestSpeech(
+	requestBody: TtsRequest,
+	clientId: string,
+	signal: AbortSignal
+): Promise<Response> {
+	return fetch(`${ttsServiceUrl}/tts`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/json', 'X-Client-Id': clientId },
+		body: JSON.stringify(requestBody),
+		// Closing the tab aborts the request, and the TTS service stops generating
+		signal,
+	});
+}
+
+type GeneratedSpeech = {
+	audio: ArrayBuffer;
+	// ID under which the TTS service keeps the waveform of the speech for a while
+	waveformId: string | null;
+};
+
 async function generateSpeech(
 	text: string,
 	voiceId: string | null,
 	exaggeration: number,
-	temperature: number
-): Promise<ArrayBuffer> {
+	temperature: number,
+	seed: number | null,
+	clientId: string,
+	signal: AbortSignal
+): Promise<GeneratedSpeech> {
+	// With a seed, edits of a line only regenerate the sentences that changed
+	const reuse = seed === null ? {} : { seed, incremental: true };
 	let requestBody: TtsRequest = {
 		text,
 		voice: 'default',
 		exaggeration,
 		temperature,
+		// 16-bit PCM halves the size of stored outputs compared to the model's float samples
+		format: 'wav16',
+		...reuse,
 	};
 
 	if (!voiceId || voiceId === 'default') {
@@ -57,46 +95,65 @@ async function generateSpeech(
 			throw new VoiceNotFoundError(voiceId);
 		}
 
-		// Read voice file
-		const voicesDir = process.env.VOICES_DIR || path.join(process.cwd(), 'data', 'voices');
-		const voicePath = path.join(voicesDir, `${voiceId}.wav`);
-		const voiceBuffer = await readFile(voicePath);
-
+		// Refer to the voice sample by its content hash instead of sending it along
 		requestBody = {
 			text,
 			voice: 'custom',
-			voice_sample: voiceBuffer.toString('base64'),
+			voice_id: await getVoiceSampleId(voiceId),
 			exaggeration,
 			temperature,
+			format: 'wav16',
+			...reuse,
 		};
 	}
 
-	const response = await fetch(`${ttsServiceUrl}/tts`, {
-		method: 'POST',
-		headers: { 'Content-Type': 'application/json' },
-		body: JSON.stringify(requestBody),
-	});
+	let response = await requestSpeech(requestBody, clientId, signal);
+
+	// Register the voice sample once if the TTS service doesn't know it yet, then retry
+	if (requestBody.voice_id && (await isVoiceNotRegistered(response))) {
+		await registerVoiceSample(voiceId as string);
+		response = await requestSpeech(requestBody, clientId, signal);
+	}
+
+	if (response.status === 429) {
+		throw new TtsServiceBusyError(response.headers.get('Retry-After'));
+	}
 
 	if (!response.ok) {
 		throw new TtsServiceError('Failed to generate speech');
 	}
 
-	return response.arrayBuffer();
+	return {
+		audio: await response.arrayBuffer(),
+		waveformId: response.headers.get('X-Waveform-Id'),
+	};
 }
 
-async function generateWaveform(audioPath: string, waveformPath: string): Promise<void> {
-	// Create form data with the audio file
-	const formData = new FormData();
-	formData.append(
-		'file',
-		new Blob([await readFile(audioPath)], { type: 'audio/wav' }),
-		path.basename(audioPath)
-	);
+async function generateWaveform(
+	audioPath: string,
+	waveformPath: string,
+	waveformId: string | null
+): Promise<void> {
+	// The TTS service keeps the waveform of speech it just generated, so the audio only
+	// has to be uploaded if the waveform is gone
+	let waveformResponse = waveformId
+		? await fetch(`${ttsServiceUrl}/waveform/${waveformId}`)
+		: null;
 
-	const waveformResponse = await fetch(`${ttsServiceUrl}/generate-waveform`, {
-		method: 'POST',
-		body: formData,
-	});
+	if (!waveformResponse?.ok) {
+		// Create form data with the audio file
+		const formData = new FormData();
+		formData.append(
+			'file',
+			new Blob([await readFile(audioPath)], { type: 'audio/wav' }),
+			path.basename(audioPath)
+		);
+
+		waveformResponse = await fetch(`${ttsServiceUrl}/generate-waveform`, {
+			method: 'POST',
+			body: formData,
+		});
+	}
 
 	if (!waveformResponse.ok) {
 		throw new Error('Failed to generate waveform');
@@ -108,7 +165,7 @@ async function generateWaveform(audioPath: string, waveformPath: string): Promis
 
 export async function POST(request: NextRequest) {
 	try {
-		const { text, voiceId, projectId, exaggeration, temperature } = await request.json();
+		const { text, voiceId, projectId, exaggeration, temperature, seed } = await request.json();
 
 		if (!text?.trim()) {
 			return NextResponse.json({ error: 'Text is required' }, { status: 400 });
@@ -133,8 +190,23 @@ export async function POST(request: NextRequest) {
 			);
 		}
 
+		if (seed != null && (!Number.isInteger(seed) || seed < 0 || seed >= 2 ** 32)) {
+			return NextResponse.json(
+				{ error: 'Seed must be an integer between 0 and 4294967295' },
+				{ status: 400 }
+			);
+		}
+
 		// Generate speech
-		const audioBuffer = await generateSpeech(text, voiceId, exaggeration, temperature);
+		const { audio: audioBuffer, waveformId } = await generateSpeech(
+			text,
+			voiceId,
+			exaggeration,
+			temperature,
+			seed ?? null,
+			getClientId(request),
+			request.signal
+		);
 
 		// Generate a unique ID for the output
 		const outputId = uuidv4();
@@ -150,7 +222,7 @@ export async function POST(request: NextRequest) {
 
 		// Generate and save waveform in the same project directory
 		const waveformPath = path.join(projectDir, `${outputId}.png`);
-		await generateWaveform(outputPath, waveformPath);
+		await generateWaveform(outputPath, waveformPath, waveformId);
 
 		// Store output in database
 		await run(
@@ -170,6 +242,12 @@ export async function POST(request: NextRequest) {
 		if (error instanceof VoiceNotFoundError) {
 			return NextResponse.json({ error: error.message }, { status: 400 });
 		}
+		if (error instanceof TtsServiceBusyError) {
+			return NextResponse.json(
+				{ error: error.message },
+				{ status: 429, headers: error.retryAfter ? { 'Retry-After': error.retryAfter } : {} }
+			);
+		}
 		if (error instanceof TtsServiceError) {
 			return NextResponse.json({ error: error.message }, { status: 500 });
 		}
@@ -0,0 +1,21 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { precomputeVoices } from '@/lib/tts';
+
+// Specify Node.js runtime
+export const runtime = 'nodejs';
+
+export async function POST(request: NextRequest) {
+	try {
+		const { voiceIds } = await request.json();
+
+		if (!Array.isArray(voiceIds) || voiceIds.length === 0) {
+			return NextResponse.json({ error: 'Voice IDs are required' }, { status: 400 });
+		}
+
+		const results = await precomputeVoices(voiceIds);
+		return NextResponse.json({ results });
+	} catch (error) {
+		console.error('Error precomputing voices:', error);
+		return NextResponse.json({ error: 'Failed to precompute voices' }, { status: 500 });
+	}
+}
@@ -36,6 +36,8 @@ export default function TtsConverter({ projectId, onOutputCreated }: TtsConverte
 	const [isLoading, setIsLoading] = useState(false);
 	const [exaggeration, setExaggeration] = useState(0.5);
 	const [temperature, setTemperature] = useState(0.5);
+	// Empty for a new take each time; with a seed, edits only regenerate changed sentences
+	const [seed, setSeed] = useState('');
 	const { toast } = useToast();
 
 	useEffect(() => {
@@ -84,9 +86,26 @@ export default function TtsConverter({ projectId, onOutputCreated }: TtsConverte
 				headers: {
 					'Content-Type': 'application/json',
 				},
-				body: JSON.stringify({ text, voiceId, projectId, exaggeration, temperature }),
+				body: JSON.stringify({
+					text,
+					voiceId,
+					projectId,
+					exaggeration,
+					temperature,
+					seed: seed === '' ? null : Number(seed),
+				}),
 			});
 
+			if (response.status === 429) {
+				const retryAfter = response.headers.get('Retry-After');
+				toast({
+					title: 'Busy',
+					description: `The speech service is busy. Please try again${retryAfter ? ` in ${retryAfter} seconds` : ' shortly'}.`,
+					variant: 'destructive',
+				});
+				return;
+			}
+
 			if (!response.ok) {
 				throw new Error('Failed to generate speech');
 			}
@@ -172,6 +191,22 @@ export default function TtsConverter({ projectId, onOutputCreated }: TtsConverte
 								}
 							/>
 						</div>
+						<div className="w-32">
+							<Label htmlFor="seed">Seed</Label>
+							<Input
+								id="seed"
+								type="number"
+								min="0"
+								step="1"
+								placeholder="Random"
+								value={seed}
+								onChange={(e) => {
+									if (/^\d*$/.test(e.target.value)) {
+										setSeed(e.target.value);
+									}
+								}}
+							/>
+						</div>
 					</div>
 
 					<div className="flex flex-col gap-2">
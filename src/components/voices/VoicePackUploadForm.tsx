@@ -204,6 +204,15 @@ export default function VoicePackUploadForm({
 			});
 		}
 
+		// Warm up the TTS service for the imported voices without holding up the dialog
+		if (newVoices.length > 0) {
+			fetch(getApiUrl('/api/voices/precompute'), {
+				method: 'POST',
+				headers: { 'Content-Type': 'application/json' },
+				body: JSON.stringify({ voiceIds: newVoices.map((voice) => voice.id) }),
+			}).catch((err) => console.error('Failed to precompute voices:', err));
+		}
+
 		setStatus('done');
 		onVoicesAdded(newVoices);
 	};
@@ -0,0 +1,3 @@
+export const getTtsServiceUrl = () => {
+	return process.env.TTS_SERVICE_URL || 'http://libreva-tts:3100';
+};
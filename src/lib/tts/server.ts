@@ -0,0 +1,95 @@
+import { readFile } from 'fs/promises';
+import { createHash } from 'crypto';
+import path from 'path';
+import { getTtsServiceUrl } from './config';
+import { getVoicesDir } from '../voices/config';
+
+export class TtsServiceError extends Error {
+	constructor(message: string) {
+		super(message);
+		this.name = 'TtsServiceError';
+	}
+}
+
+// The TTS service turned the request away because its queue is full
+export class TtsServiceBusyError extends TtsServiceError {
+	constructor(public retryAfter: string | null) {
+		super('TTS service is busy');
+		this.name = 'TtsServiceBusyError';
+	}
+}
+
+// Content hashes of voice samples, keyed by voice ID. The TTS service identifies registered
+// samples by their SHA-256, so the hash only has to be computed once per voice.
+const voiceSampleIds = new Map<string, string>();
+
+function getVoicePath(voiceId: string): string {
+	return path.join(getVoicesDir(), `${voiceId}.wav`);
+}
+
+export async function getVoiceSampleId(voiceId: string): Promise<string> {
+	let sampleId = voiceSampleIds.get(voiceId);
+	if (!sampleId) {
+		const voiceBuffer = await readFile(getVoicePath(voiceId));
+		sampleId = createHash('sha256').update(voiceBuffer).digest('hex');
+		voiceSampleIds.set(voiceId, sampleId);
+	}
+	return sampleId;
+}
+
+export async function registerVoiceSample(voiceId: string): Promise<string> {
+	const formData = new FormData();
+	formData.append(
+		'file',
+		new Blob([await readFile(getVoicePath(voiceId))], { type: 'audio/wav' }),
+		`${voiceId}.wav`
+	);
+
+	const response = await fetch(`${getTtsServiceUrl()}/voices`, {
+		method: 'POST',
+		body: formData,
+	});
+
+	if (!response.ok) {
+		throw new TtsServiceError('Failed to register voice sample');
+	}
+
+	const { voice_id: sampleId } = await response.json();
+	voiceSampleIds.set(voiceId, sampleId);
+	return sampleId;
+}
+
+export async function isVoiceNotRegistered(response: Response): Promise<boolean> {
+	if (response.status !== 404) {
+		return false;
+	}
+	try {
+		const body = await response.json();
+		return body?.detail?.status === 'voice_not_registered';
+	} catch {
+		return false;
+	}
+}
+
+export async function precomputeVoices(voiceIds: string[]): Promise<Record<string, string>> {
+	// Registering is idempotent, and freshly imported voices are unknown to the service anyway
+	const sampleIds = new Map<string, string>();
+	for (const voiceId of voiceIds) {
+		sampleIds.set(await registerVoiceSample(voiceId), voiceId);
+	}
+
+	const response = await fetch(`${getTtsServiceUrl()}/voices/precompute`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/json' },
+		body: JSON.stringify({ voice_ids: [...sampleIds.keys()] }),
+	});
+
+	if (!response.ok) {
+		throw new TtsServiceError('Failed to precompute voices');
+	}
+
+	const { results } = (await response.json()) as { results: Record<string, string> };
+	return Object.fromEntries(
+		Object.entries(results).map(([sampleId, result]) => [sampleIds.get(sampleId), result])
+	);
+}
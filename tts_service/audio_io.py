@@ -0,0 +1,103 @@
+import io
+import struct
+from typing import BinaryIO, Optional
+
+import soundfile as sf
+import torch
+
+# Media types of the formats /tts/stream can produce
+STREAM_MEDIA_TYPES = {
+    "wav": "audio/wav",
+    # Raw 16-bit little-endian mono PCM; the sample rate is sent in the X-Sample-Rate header
+    "pcm": "application/octet-stream",
+}
+
+class OutputFormat:
+    """
+    An audio format /tts can return, with the libsndfile format and subtype that encode it.
+    """
+
+    def __init__(self, media_type: str, extension: str, container: str, subtype: str):
+        self.media_type = media_type
+        self.extension = extension
+        self.container = container
+        self.subtype = subtype
+
+OUTPUT_FORMATS = {
+    # 32-bit float WAV, the model's native output
+    "wav": OutputFormat("audio/wav", "wav", "WAV", "FLOAT"),
+    "wav16": OutputFormat("audio/wav", "wav", "WAV", "PCM_16"),
+    "flac": OutputFormat("audio/flac", "flac", "FLAC", "PCM_16"),
+    "opus": OutputFormat("audio/ogg", "ogg", "OGG", "OPUS"),
+}
+
+# Opus bitrates in kbps per channel; libsndfile maps its compression level linearly onto this range
+OPUS_MIN_BITRATE = 6
+OPUS_MAX_BITRATE = 256
+
+def check_output_format(output_format: str, bitrate: Optional[int] = None) -> None:
+    """
+    Raise ValueError if the format is unknown or the bitrate doesn't apply to it.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format {output_format}, use one of {', '.join(OUTPUT_FORMATS)}")
+    if bitrate is None:
+        return
+    if output_format != "opus":
+        raise ValueError("A bitrate can only be set for the opus format")
+    if not OPUS_MIN_BITRATE <= bitrate <= OPUS_MAX_BITRATE:
+        raise ValueError(f"Opus bitrate must be between {OPUS_MIN_BITRATE} and {OPUS_MAX_BITRATE} kbps")
+
+def write_audio(target: BinaryIO, audio: torch.Tensor, sample_rate: int, output_format: str = "wav", bitrate: Optional[int] = None) -> None:
+    """
+    Encode audio into a binary file object in one of the OUTPUT_FORMATS.
+    """
+    spec = OUTPUT_FORMATS[output_format]
+    # soundfile expects (frames, channels)
+    samples = audio.detach().to("cpu", torch.float32).numpy().T
+    options = {}
+    if bitrate is not None:
+        # soundfile sets the bitrate of compressed formats as a compression level from 0 to 1
+        options["compression_level"] = (OPUS_MAX_BITRATE - bitrate) / (OPUS_MAX_BITRATE - OPUS_MIN_BITRATE)
+    sf.write(target, samples, sample_rate, format=spec.container, subtype=spec.subtype, **options)
+
+def encode_audio(audio: torch.Tensor, sample_rate: int, output_format: str = "wav", bitrate: Optional[int] = None) -> bytes:
+    """
+    Encode audio in memory in one of the OUTPUT_FORMATS.
+    """
+    buffer = io.BytesIO()
+    write_audio(buffer, audio, sample_rate, output_format, bitrate)
+    return buffer.getvalue()
+
+# RIFF and data chunk sizes announced by a streamed WAV whose length is unknown upfront
+UNKNOWN_WAV_SIZE = 0xFFFFFFFF
+
+def pcm16_bytes(audio: torch.Tensor) -> bytes:
+    """
+    Convert a float audio tensor in [-1, 1] to 16-bit little-endian PCM, interleaving channels.
+    """
+    samples = audio.detach().to("cpu", torch.float32).clamp(-1.0, 1.0)
+    samples = (samples * 32767.0).round().to(torch.int16)
+    # Tensors are (channels, frames); PCM interleaves channels per frame
+    return samples.t().contiguous().numpy().astype("<i2", copy=False).tobytes()
+
+def wav_header(sample_rate: int, data_size: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    Build the 44-byte header of a PCM WAV file with the given data size in bytes.
+    """
+    block_align = channels * bits_per_sample // 8
+    byte_rate = sample_rate * block_align
+    riff_size = UNKNOWN_WAV_SIZE if data_size == UNKNOWN_WAV_SIZE else 36 + data_size
+    return (
+        struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+        + struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + struct.pack('<4sI', b'data', data_size)
+    )
+
+def streaming_wav_header(sample_rate: int, channels: int = 1) -> bytes:
+    """
+    Build a 16-bit PCM WAV header for a stream of unknown length.
+
+    Browsers and common decoders treat the maximum sizes as "read until the end".
+    """
+    return wav_header(sample_rate, UNKNOWN_WAV_SIZE, channels=channels)
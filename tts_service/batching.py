@@ -0,0 +1,349 @@
+import contextvars
+import functools
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, Hashable, List, Optional
+
+import torch
+
+from memory import MAX_OUT_OF_MEMORY_RETRIES, MIN_SPLIT_CHARS, MemoryLimits, is_out_of_memory
+from stats import RollingStats, ThroughputMeter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_BATCH_WAIT_MS = 5.0
+
+class GenerationCancelled(Exception):
+    """Raised when generation stops because nobody waits for its result anymore."""
+
+# Tells whether every chunk of the batch being generated was cancelled
+_batch_cancelled: contextvars.ContextVar = contextvars.ContextVar("batch_cancelled", default=None)
+
+def check_cancelled() -> None:
+    """
+    Raise `GenerationCancelled` if all chunks of the batch being generated were cancelled.
+    Engines call this between decoding steps.
+    """
+    batch_cancelled = _batch_cancelled.get()
+    if batch_cancelled is not None and batch_cancelled():
+        raise GenerationCancelled("All requests of the batch were cancelled")
+
+class ChunkItem:
+    """
+    One chunk of text waiting to be synthesized, with everything needed to batch it.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        conds,
+        conds_key: Hashable,
+        exaggeration: float,
+        temperature: float,
+        priority: int,
+        seed: Optional[int] = None,
+        cancelled: Optional[threading.Event] = None
+    ):
+        self.text = text
+        self.conds = conds
+        self.exaggeration = exaggeration
+        self.temperature = temperature
+        self.priority = priority
+        # Seed of the random generator for deterministic output, None for random sampling
+        self.seed = seed
+        # Set when the chunk's request was given up, e.g. because its client disconnected
+        self.cancelled = cancelled
+        # Chunks can only share a forward pass if conditioning and exaggeration match; each
+        # samples with its own temperature and seed
+        self.key = (conds_key, round(float(exaggeration), 4))
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        # Times the chunk, or the chunk it was split from, ran out of memory
+        self.attempt = 0
+
+    @property
+    def length(self) -> int:
+        return len(self.text)
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self.cancelled is not None and self.cancelled.is_set()
+
+class BatchScheduler:
+    """
+    Thread that owns the model and feeds it batches of chunks from concurrent requests.
+
+    Pending chunks are gathered for up to `max_wait_ms` after the first one arrives,
+    grouped by conditioning and exaggeration, and the group of the most urgent chunk
+    runs as one batch of at most `max_batch_size` chunks with similar lengths, which keeps
+    padding low. Results are scattered back through each chunk's future. `generate_batch`
+    may return futures for chunks it finishes asynchronously, and the scheduler moves on
+    to the next batch while they complete.
+
+    Chunks of cancelled requests are dropped before they run, and a batch whose chunks were
+    all cancelled while it runs stops at the next `check_cancelled` of the engine.
+
+    With `limits`, batches stay within the chunks and characters learned to fit into memory
+    and longer chunks are `split` before they run. A batch that runs out of memory anyway
+    is retried chunk by chunk, and a chunk that runs out of memory on its own is split into
+    pieces whose audio is joined again, so requests don't fail for lack of memory.
+
+    Any other error while a batch is scheduled fails the chunks of that batch, and the
+    scheduler goes on with the next one.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[List[str], object, float, List[float], List[Optional[int]]], List],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_BATCH_WAIT_MS,
+        name: str = "batch-scheduler",
+        limits: Optional[MemoryLimits] = None,
+        split: Optional[Callable[[str], List[str]]] = None
+    ):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self.limits = limits
+        self.split = split or (lambda text: [text])
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self.batch_sizes = RollingStats()
+        self.queue_wait = RollingStats()
+        self.chunk_throughput = ThroughputMeter()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(
+        self,
+        text: str,
+        conds,
+        conds_key: Hashable,
+        exaggeration: float,
+        temperature: float,
+        priority: int,
+        seed: Optional[int] = None,
+        cancelled: Optional[threading.Event] = None
+    ) -> Future:
+        """
+        Queue a chunk for synthesis and return a future resolving to its audio tensor.
+        The chunk is dropped if `cancelled` is set before it has been generated.
+        """
+        item = ChunkItem(text, conds, conds_key, exaggeration, temperature, priority, seed, cancelled)
+        self._queue.put((priority, next(self._sequence), item))
+        return item.future
+
+    def _collect(self) -> List[tuple]:
+        """
+        Block for the first pending chunk, then gather whatever else arrives within the wait window.
+        """
+        entries = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                entries.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def _select_batch(self, entries: List[tuple]) -> List[tuple]:
+        """
+        Pick the batch for the most urgent chunk and put everything else back in the queue.
+        """
+        entries.sort(key=lambda entry: entry[:2])
+        anchor = entries[0]
+        group = sorted((entry for entry in entries if entry[2].key == anchor[2].key), key=lambda entry: entry[2].length)
+
+        # Among windows of compatible chunks that contain the anchor, take the one with
+        # the smallest length spread
+        size = min(self.max_batch_size, len(group))
+        if self.limits is not None and self.limits.max_batch_size is not None:
+            size = min(size, self.limits.max_batch_size)
+        anchor_index = group.index(anchor)
+        best_start = max(0, anchor_index - size + 1)
+        best_spread = None
+        for start in range(max(0, anchor_index - size + 1), min(anchor_index, len(group) - size) + 1):
+            spread = group[start + size - 1][2].length - group[start][2].length
+            if best_spread is None or spread < best_spread:
+                best_start, best_spread = start, spread
+        batch = group[best_start:best_start + size]
+
+        # Keep to the characters known to fit into memory, dropping the longest chunks but the anchor
+        max_chars = self.limits.max_batch_chars if self.limits is not None else None
+        if max_chars is not None:
+            while len(batch) > 1 and sum(entry[2].length for entry in batch) > max_chars:
+                batch.remove(batch[-1] if batch[-1] is not anchor else batch[0])
+
+        selected = set(id(entry) for entry in batch)
+        for entry in entries:
+            if id(entry) not in selected:
+                self._queue.put(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            entries = self._collect()
+            # Until the batch is selected, an error concerns every collected chunk
+            batch = [entry[2] for entry in entries]
+            try:
+                batch = [entry[2] for entry in self._select_batch(entries)]
+                self._run_batch(batch)
+            except Exception as e:
+                # The scheduler thread must outlive any error, or every chunk would wait forever
+                logger.error(f"Error scheduling batch of {len(batch)} chunks: {str(e)}", exc_info=True)
+                for item in batch:
+                    self._fail(item, e)
+
+    def _run_batch(self, batch: List[ChunkItem]) -> None:
+        # Skip chunks whose requests no longer wait for them
+        for item in batch:
+            if item.is_cancelled:
+                item.future.cancel()
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        # Chunks longer than what fits into memory run as pieces
+        max_chunk_chars = self.limits.max_chunk_chars if self.limits is not None else None
+        if max_chunk_chars is not None:
+            for item in [item for item in batch if item.length > max_chunk_chars]:
+                pieces = self.split(item.text)
+                if len(pieces) > 1:
+                    batch.remove(item)
+                    self._retry(item, pieces)
+        if not batch:
+            return
+
+        now = time.monotonic()
+        for item in batch:
+            self.queue_wait.add(now - item.enqueued_at)
+        self.batch_sizes.add(len(batch))
+
+        first = batch[0]
+        token = _batch_cancelled.set(lambda batch=batch: all(item.is_cancelled for item in batch))
+        try:
+            results = self.generate_batch(
+                [item.text for item in batch], first.conds, first.exaggeration,
+                [item.temperature for item in batch], [item.seed for item in batch]
+            )
+        except GenerationCancelled as e:
+            logger.info(f"Stopped generating batch of {len(batch)} cancelled chunks")
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        except Exception as e:
+            if self.limits is not None and is_out_of_memory(e):
+                self._recover(batch, e)
+                return
+            logger.error(f"Error generating batch of {len(batch)} chunks: {str(e)}", exc_info=True)
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        finally:
+            _batch_cancelled.reset(token)
+        for item, result in zip(batch, results):
+            if isinstance(result, Future):
+                # Chunks still being finished elsewhere, such as by a vocoder stage, resolve later
+                result.add_done_callback(functools.partial(self._resolve, item))
+            else:
+                item.future.set_result(result)
+                self.chunk_throughput.record(1)
+
+    def _resolve(self, item: ChunkItem, result: Future) -> None:
+        error = result.exception()
+        try:
+            if error is not None and self.limits is not None and is_out_of_memory(error):
+                self._recover([item], error)
+            elif error is not None:
+                if not isinstance(error, GenerationCancelled):
+                    logger.error(f"Error generating chunk: {str(error)}", exc_info=error)
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(result.result())
+                self.chunk_throughput.record(1)
+        except Exception as e:
+            logger.error(f"Error resolving chunk: {str(e)}", exc_info=True)
+            self._fail(item, e)
+
+    @staticmethod
+    def _fail(item: ChunkItem, error: BaseException) -> None:
+        try:
+            item.future.set_exception(error)
+        except InvalidStateError:
+            # Cancelled or resolved already
+            pass
+
+    def _recover(self, batch: List[ChunkItem], error: BaseException) -> None:
+        """
+        Retry the chunks of a batch that ran out of memory: one by one if they ran together,
+        else in pieces. Chunks that failed too often, or can't be split, fail with the error.
+        """
+        lengths = [item.length for item in batch]
+        self.limits.record_out_of_memory(len(batch), sum(lengths), max(lengths))
+        for item in batch:
+            if item.attempt >= MAX_OUT_OF_MEMORY_RETRIES:
+                item.future.set_exception(error)
+                continue
+            if len(batch) > 1:
+                self._retry(item, [item.text])
+                continue
+            pieces = self.split(item.text) if item.length > MIN_SPLIT_CHARS else [item.text]
+            if len(pieces) < 2:
+                item.future.set_exception(error)
+                continue
+            self._retry(item, pieces)
+
+    def _retry(self, item: ChunkItem, texts: List[str]) -> None:
+        """
+        Queue texts as chunks of their own and resolve the item with their audio joined.
+        """
+        if len(texts) > 1 and self.limits is not None:
+            self.limits.split_chunks += 1
+        pieces = []
+        for index, text in enumerate(texts):
+            piece = ChunkItem(
+                text, item.conds, item.key[0], item.exaggeration, item.temperature, item.priority,
+                item.seed + index if item.seed is not None else None, item.cancelled
+            )
+            piece.attempt = item.attempt + 1
+            pieces.append(piece)
+        remaining = [len(pieces)]
+        lock = threading.Lock()
+
+        def join(_) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            for piece in pieces:
+                if piece.future.cancelled():
+                    item.future.set_exception(GenerationCancelled("Request was cancelled"))
+                    return
+                if piece.future.exception() is not None:
+                    item.future.set_exception(piece.future.exception())
+                    return
+            item.future.set_result(torch.cat([piece.future.result() for piece in pieces], dim=-1))
+
+        for piece in pieces:
+            piece.future.add_done_callback(join)
+            self._queue.put((piece.priority, next(self._sequence), piece))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_seconds * 1000.0,
+            "pending_chunks": self.pending,
+            "batch_size": self.batch_sizes.summary(),
+            "queue_wait_seconds": self.queue_wait.summary(),
+            "chunks_per_second": self.chunk_throughput.rate(),
+        }
@@ -0,0 +1,81 @@
+"""
+Machine-readable benchmark results.
+
+Every benchmark writes one JSON document with the same envelope, so runs can be
+collected in one directory and compared over time:
+
+    {"benchmark": ..., "timestamp": ..., "environment": {...}, "config": {...}, "results": {...}}
+"""
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment() -> Dict[str, object]:
+    result = {
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        result["torch"] = torch.__version__
+        result["cuda"] = torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+    except ImportError:
+        pass
+    return result
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Count, mean, percentiles and extremes of a list of measurements.
+    """
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "min": None, "max": None}
+    ordered = sorted(values)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+def write_results(path: Optional[str], benchmark: str, config: Dict, results: Dict) -> Dict:
+    """
+    Wrap results in the common envelope and write them to the path, or to stdout for "-".
+    """
+    document = {
+        "benchmark": benchmark,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    if path == "-":
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    elif path:
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"Wrote results to {path}")
+    return document
@@ -0,0 +1,119 @@
+"""
+Micro-benchmark of the chunk planner against the previous word-count splitter.
+
+Times both on a generated script and reports how evenly they size chunks, in text tokens
+of the model's tokenizer when one is given and in estimated tokens otherwise.
+
+Usage: python benchmarks/chunking_benchmark.py [--tokenizer data/model/tokenizer.json]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import timeit
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import text_processor
+from text_processor import count_tokens, load_tokenizer, sanitize_text, split_into_chunks
+
+WORDS = (
+    "the a of and to in that it was he for on are as with his they at be this from have or "
+    "by one had not but what all were when we there can an your which their said if do will "
+    "each about how up out them then she many some so these would other into has more her two "
+    "like him see time could no make than first been its who now people my made over did down "
+    "only way find use may water long little very after words called just where most know"
+).split()
+
+def legacy_split_into_chunks(text: str, max_tokens: int = 400) -> List[str]:
+    """
+    The splitter before the chunk planner, which packed sentences greedily by word count.
+    """
+    if not text:
+        return []
+
+    text = sanitize_text(text)
+    sentences = re.split(r'([.!?]+)\s+', text)
+    sentences = [''.join(i) for i in zip(sentences[::2], sentences[1::2] + [''])]
+
+    chunks = []
+    current_chunk = []
+    current_length = 0
+
+    for sentence in sentences:
+        sentence_length = len(sentence.split())
+
+        if current_length + sentence_length > max_tokens:
+            if current_chunk:
+                chunks.append(' '.join(current_chunk))
+                current_chunk = []
+                current_length = 0
+
+            if sentence_length > max_tokens:
+                words = sentence.split()
+                for i in range(0, len(words), max_tokens):
+                    chunks.append(' '.join(words[i:i + max_tokens]))
+            else:
+                current_chunk = [sentence]
+                current_length = sentence_length
+        else:
+            current_chunk.append(sentence)
+            current_length += sentence_length
+
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+
+    return chunks
+
+def make_script(paragraphs: int, seed: int) -> List[str]:
+    """
+    Generate paragraphs of sentences of varying length, some of them with clauses.
+    """
+    rng = random.Random(seed)
+    result = []
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(3, 30)):
+            clauses = [
+                " ".join(rng.choices(WORDS, k=rng.randint(3, 25)))
+                for _ in range(rng.randint(1, 4))
+            ]
+            sentence = rng.choice([", ", "; ", " - "]).join(clauses)
+            sentences.append(sentence.capitalize() + rng.choice(".!?"))
+        result.append(" ".join(sentences))
+    return result
+
+def report(name: str, paragraphs: List[str], split, repeat: int):
+    chunks = [chunk for paragraph in paragraphs for chunk in split(paragraph)]
+    tokens = count_tokens(chunks)
+    seconds = min(timeit.repeat(lambda: [split(p) for p in paragraphs], number=1, repeat=repeat))
+    print(
+        f"{name:<8} {seconds * 1000:9.1f} ms  {len(chunks):6d} chunks  "
+        f"tokens mean {statistics.mean(tokens):6.1f}  stdev {statistics.pstdev(tokens):6.1f}  "
+        f"max {max(tokens):5d}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokenizer", help="Path to the model's tokenizer.json")
+    parser.add_argument("--paragraphs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.tokenizer and not load_tokenizer(args.tokenizer):
+        sys.exit(1)
+
+    paragraphs = make_script(args.paragraphs, args.seed)
+    print(f"{len(paragraphs)} paragraphs, {sum(len(p) for p in paragraphs)} characters, "
+          f"{'tokenizer' if args.tokenizer else 'estimated'} token counts")
+    report("legacy", paragraphs, legacy_split_into_chunks, args.repeat)
+    report("planner", paragraphs, split_into_chunks, args.repeat)
+    print(f"planner limits: target {text_processor.TARGET_TOKENS_PER_CHUNK}, "
+          f"max {text_processor.MAX_TOKENS_PER_CHUNK} tokens")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Quality check of the CPU engine options against plain fp32 on fixed seeds.
+
+Generates the same sentences with the same seeds once in fp32 and once with the given
+options, and measures how far apart both outputs are as the mean distance of their
+MFCC frames after aligning them with dynamic time warping. Sampling diverges as soon as
+a single speech token differs, so the distance is judged against the distance between
+two fp32 generations with different seeds: the options pass if they don't move the
+output further than sampling noise does, within the given tolerance.
+
+Usage: python benchmarks/cpu_quality_check.py --quantize int8 [--bf16 on] [--compile]
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import librosa
+import numpy as np
+
+from cpu_engine import BF16_MODES, QUANTIZE_MODES, CpuEngineOptions, configure_threads, map_checkpoints_to_cpu
+from replicas import ReplicaEngine
+
+SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "She sells seashells by the seashore, and the shells she sells are surely seashells.",
+    "Welcome back! Today we're going to talk about how speech synthesis works under the hood.",
+    "In 1969, three astronauts flew to the moon; two of them walked on its surface.",
+    "Would you like a cup of tea, or would you rather have coffee this morning?",
+]
+
+# Seed offset of the second fp32 run, which measures how far sampling alone moves the output
+NOISE_SEED_OFFSET = 1000
+
+def mfcc_distance(reference: np.ndarray, candidate: np.ndarray, sample_rate: int) -> float:
+    """
+    Mean Euclidean distance between DTW-aligned MFCC frames, without the energy coefficient.
+    """
+    features = [
+        librosa.feature.mfcc(y=audio, sr=sample_rate, n_mfcc=25, n_fft=1024, hop_length=256)[1:]
+        for audio in (reference, candidate)
+    ]
+    cost, path = librosa.sequence.dtw(X=features[0], Y=features[1], metric="euclidean")
+    return float(cost[-1, -1] / len(path))
+
+def generate_all(engine: ReplicaEngine, seeds: List[int]) -> Dict[tuple, Dict]:
+    """
+    Generate every sentence with every seed and time each generation.
+    """
+    results = {}
+    for index, text in enumerate(SENTENCES):
+        for seed in seeds:
+            start = time.perf_counter()
+            audio = engine.generate([text], engine.default_conds, 0.5, [0.5], [seed])[0]
+            seconds = time.perf_counter() - start
+            samples = audio.squeeze(0).numpy()
+            results[(index, seed)] = {
+                "audio": samples,
+                "seconds": seconds,
+                "duration": len(samples) / engine.sample_rate,
+            }
+            print(f"  sentence {index} seed {seed}: {seconds:.2f} s for {len(samples) / engine.sample_rate:.2f} s of audio")
+    return results
+
+def load_engine(model_dir: str, options: CpuEngineOptions) -> ReplicaEngine:
+    with map_checkpoints_to_cpu():
+        return ReplicaEngine.load(model_dir, "cpu", None, 1, options)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model-dir", default="data/model")
+    parser.add_argument("--quantize", choices=QUANTIZE_MODES, default="none")
+    parser.add_argument("--bf16", choices=BF16_MODES, default="off")
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads, 0 keeps torch's default")
+    parser.add_argument("--interop-threads", type=int, default=0)
+    parser.add_argument("--seeds", type=int, default=2, help="Number of seeds per sentence")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Allowed ratio of the options' distance to the sampling noise distance")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    options = CpuEngineOptions(args.quantize, args.bf16, args.threads, args.interop_threads, args.compile)
+    configure_threads(options)
+    seeds = list(range(args.seeds))
+
+    print("Generating with fp32...")
+    engine = load_engine(args.model_dir, CpuEngineOptions(intra_op_threads=args.threads))
+    sample_rate = engine.sample_rate
+    reference = generate_all(engine, seeds)
+    print("Generating with fp32 and other seeds for the sampling noise baseline...")
+    noise = generate_all(engine, [seed + NOISE_SEED_OFFSET for seed in seeds])
+    del engine
+    gc.collect()
+
+    print(f"Generating with {json.dumps(options.to_dict())}...")
+    engine = load_engine(args.model_dir, options)
+    # The first generation pays for compilation, so it doesn't count towards the speed
+    if args.compile:
+        engine.generate([SENTENCES[0]], engine.default_conds, 0.5, [0.5], [0])
+    candidate = generate_all(engine, seeds)
+
+    rows = []
+    for (index, seed), expected in reference.items():
+        actual = candidate[(index, seed)]
+        rows.append({
+            "sentence": index,
+            "seed": seed,
+            "distance": mfcc_distance(expected["audio"], actual["audio"], sample_rate),
+            "noise_distance": mfcc_distance(expected["audio"], noise[(index, seed + NOISE_SEED_OFFSET)]["audio"], sample_rate),
+            "duration_ratio": actual["duration"] / expected["duration"],
+            "fp32_rtf": expected["seconds"] / expected["duration"],
+            "rtf": actual["seconds"] / actual["duration"],
+        })
+
+    print(f"\n{'sentence':>8} {'seed':>4} {'distance':>9} {'noise':>9} {'duration':>9} {'fp32 rtf':>9} {'rtf':>7}")
+    for row in rows:
+        print(
+            f"{row['sentence']:>8} {row['seed']:>4} {row['distance']:>9.2f} {row['noise_distance']:>9.2f} "
+            f"{row['duration_ratio']:>9.2f} {row['fp32_rtf']:>9.2f} {row['rtf']:>7.2f}"
+        )
+
+    summary = {
+        "options": options.to_dict(),
+        "mean_distance": statistics.mean(row["distance"] for row in rows),
+        "mean_noise_distance": statistics.mean(row["noise_distance"] for row in rows),
+        "fp32_seconds": sum(entry["seconds"] for entry in reference.values()),
+        "seconds": sum(entry["seconds"] for entry in candidate.values()),
+    }
+    summary["speedup"] = summary["fp32_seconds"] / summary["seconds"]
+    summary["passed"] = summary["mean_distance"] <= summary["mean_noise_distance"] * args.tolerance
+    print(
+        f"\nmean distance {summary['mean_distance']:.2f} against sampling noise {summary['mean_noise_distance']:.2f}, "
+        f"speedup {summary['speedup']:.2f}x: {'passed' if summary['passed'] else 'FAILED'}"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+    sys.exit(0 if summary["passed"] else 1)
+
+if __name__ == '__main__':
+    main()
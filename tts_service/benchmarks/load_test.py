@@ -0,0 +1,272 @@
+"""
+Load generator for the TTS service.
+
+Drives /tts, /generate-waveform or a mix of both with a fixed number of concurrent
+clients, each sending its next request as soon as the previous one is answered, and
+reports latency percentiles, throughput, errors and, for /tts, seconds of audio produced
+per second. Several concurrency levels can be measured in one run.
+
+The service can be started by the harness itself, with the stub engine by default so
+no weights or GPU are needed, or with the real model (`--engine chatterbox`). Without
+`--start-server` it targets an already running service at `--url`.
+
+Usage: python benchmarks/load_test.py --start-server --concurrency 1,4,16 --requests 50 --output load.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import soundfile as sf
+
+from benchmark_results import summarize, write_results
+from chunking_benchmark import make_script
+
+ENDPOINTS = ("tts", "waveform", "mixed")
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def post(url: str, body: bytes, content_type: str, timeout: float) -> Tuple[int, bytes]:
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def multipart_file(field: str, filename: str, data: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+def synthetic_wav(seconds: float, sample_rate: int = 24000) -> bytes:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = (np.abs(np.sin(2 * np.pi * 2.5 * t)) * rng.standard_normal(len(t)) * 0.3).astype(np.float32)
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="WAV")
+    return buffer.getvalue()
+
+class Workload:
+    """
+    Builds the requests of a run: /tts texts of roughly the given length cut from a
+    generated script, and one audio file uploaded to /generate-waveform.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        script = " ".join(make_script(max(10, args.text_chars // 100), args.seed))
+        self.texts = [script[start:start + args.text_chars] for start in range(0, len(script) - args.text_chars, 97)]
+        if not self.texts:
+            self.texts = [script]
+        if args.waveform_audio:
+            with open(args.waveform_audio, "rb") as f:
+                self.audio = f.read()
+        else:
+            self.audio = synthetic_wav(args.waveform_seconds)
+
+    def next_request(self) -> Tuple[str, str, bytes, str]:
+        """
+        Return (kind, url, body, content type) of the next request.
+        """
+        with self.lock:
+            kind = self.args.endpoint
+            if kind == "mixed":
+                kind = "tts" if self.rng.random() < self.args.tts_share else "waveform"
+            text = self.rng.choice(self.texts)
+        if kind == "waveform":
+            body, content_type = multipart_file("file", "sample.wav", self.audio)
+            return kind, f"{self.args.url}/generate-waveform", body, content_type
+        payload = {"text": text, "format": self.args.format}
+        if self.args.voice_id:
+            payload.update(voice="custom", voice_id=self.args.voice_id)
+        return kind, f"{self.args.url}/tts", json.dumps(payload).encode(), "application/json"
+
+def audio_seconds(data: bytes) -> Optional[float]:
+    try:
+        return sf.info(io.BytesIO(data)).duration
+    except Exception:
+        return None
+
+def run_level(workload: Workload, concurrency: int, requests: int, duration: float, timeout: float) -> Dict:
+    """
+    Run one concurrency level until the request count or the duration is reached.
+    """
+    samples: List[Dict] = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    issued = [0]
+
+    def take() -> bool:
+        with lock:
+            if requests and issued[0] >= requests:
+                return False
+            if duration and time.perf_counter() - started >= duration:
+                return False
+            issued[0] += 1
+            return True
+
+    def client():
+        while take():
+            kind, url, body, content_type = workload.next_request()
+            start = time.perf_counter()
+            try:
+                status, data = post(url, body, content_type, timeout)
+            except Exception as e:
+                status, data = None, str(e).encode()
+            sample = {"kind": kind, "status": status, "seconds": time.perf_counter() - start, "bytes": len(data)}
+            if kind == "tts" and status == 200:
+                sample["audio_seconds"] = audio_seconds(data)
+            with lock:
+                samples.append(sample)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    result = {"concurrency": concurrency, "requests": len(samples), "elapsed_seconds": elapsed}
+    for kind in sorted(set(sample["kind"] for sample in samples)):
+        of_kind = [sample for sample in samples if sample["kind"] == kind]
+        ok = [sample for sample in of_kind if sample["status"] == 200]
+        errors: Dict[str, int] = {}
+        for sample in of_kind:
+            if sample["status"] != 200:
+                errors[str(sample["status"])] = errors.get(str(sample["status"]), 0) + 1
+        entry = {
+            "requests": len(of_kind),
+            "succeeded": len(ok),
+            "errors": errors,
+            "requests_per_second": len(ok) / elapsed,
+            "latency_seconds": summarize([sample["seconds"] for sample in ok]),
+            "response_bytes": summarize([sample["bytes"] for sample in ok]),
+        }
+        if kind == "tts":
+            produced = sum(sample.get("audio_seconds") or 0.0 for sample in ok)
+            entry["audio_seconds_per_second"] = produced / elapsed
+            entry["real_time_factor"] = summarize([
+                sample["seconds"] / sample["audio_seconds"] for sample in ok if sample.get("audio_seconds")
+            ])
+        result[kind] = entry
+    return result
+
+def get_json(url: str) -> Optional[Dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+def wait_until_ready(url: str, timeout: float, process: Optional[subprocess.Popen] = None) -> Dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"TTS service exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=5) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"TTS service at {url} wasn't ready after {timeout:.0f} seconds")
+
+def start_server(engine: str, port: int, log_path: str) -> subprocess.Popen:
+    """
+    Start the service on the port, with the stub engine unless the real model is asked for.
+    Stub settings are taken from TTS_STUB_* variables of the environment.
+    """
+    env = {**os.environ, "TTS_ENGINE": engine}
+    if engine == "stub":
+        env.setdefault("TTS_DEVICE", "cpu")
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "tts_server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVICE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:3100")
+    parser.add_argument("--start-server", action="store_true", help="Start the service for the run and stop it afterwards")
+    parser.add_argument("--engine", choices=("stub", "chatterbox"), default="stub", help="Engine of a started service")
+    parser.add_argument("--port", type=int, default=3199, help="Port of a started service")
+    parser.add_argument("--server-log", default="load_test_server.log")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="tts")
+    parser.add_argument("--tts-share", type=float, default=0.8, help="Share of /tts requests for --endpoint mixed")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per level, 0 for no limit")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds per level, 0 for no limit")
+    parser.add_argument("--text-chars", type=int, default=300, help="Length of /tts texts")
+    parser.add_argument("--format", default="wav")
+    parser.add_argument("--voice-id", help="Registered voice to synthesize with instead of the built-in voice")
+    parser.add_argument("--waveform-audio", help="Audio file uploaded to /generate-waveform")
+    parser.add_argument("--waveform-seconds", type=float, default=30.0, help="Length of the generated upload")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this path, - for stdout")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error("Set --requests, --duration or both")
+
+    process = None
+    if args.start_server:
+        args.url = f"http://127.0.0.1:{args.port}"
+        process = start_server(args.engine, args.port, args.server_log)
+    try:
+        health = wait_until_ready(args.url, args.startup_timeout, process)
+        print(f"Service at {args.url} is {health.get('status')} with {len(health.get('replicas', []))} replicas")
+        workload = Workload(args)
+        levels = []
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            level = run_level(workload, concurrency, args.requests, args.duration, args.timeout)
+            levels.append(level)
+            for kind in ("tts", "waveform"):
+                if kind in level:
+                    entry = level[kind]
+                    latency = entry["latency_seconds"]
+                    line = (
+                        f"concurrency {concurrency:>3} {kind:<8} {entry['succeeded']:>5} ok "
+                        f"{sum(entry['errors'].values()):>4} errors {entry['requests_per_second']:8.2f} req/s"
+                    )
+                    if latency["count"]:
+                        line += f"  p50 {latency['p50']:.3f} s  p90 {latency['p90']:.3f} s  p99 {latency['p99']:.3f} s"
+                    if kind == "tts":
+                        line += f"  {entry['audio_seconds_per_second']:.2f} audio s/s"
+                    print(line)
+        server_stats = get_json(f"{args.url}/stats")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    config = {
+        key: value for key, value in vars(args).items()
+        if key not in ("output", "server_log", "startup_timeout")
+    }
+    if args.start_server:
+        config["server_environment"] = {key: value for key, value in os.environ.items() if key.startswith("TTS_")}
+    write_results(
+        args.output, "load_test", config,
+        {"levels": levels, "health": health, "server_stats": server_stats}
+    )
+
+if __name__ == '__main__':
+    main()
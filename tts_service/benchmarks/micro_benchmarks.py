@@ -0,0 +1,117 @@
+"""
+Micro-benchmarks of the CPU-side stages of the TTS service.
+
+Times marker parsing, chunk splitting and waveform generation on synthetic input of
+several sizes, without loading the model, and reports the time per call.
+
+Usage: python benchmarks/micro_benchmarks.py [--output results.json] [--tokenizer data/model/tokenizer.json]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import timeit
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import soundfile as sf
+
+from benchmark_results import summarize, write_results
+from chunking_benchmark import make_script
+from generate_waveform import WaveformPeaks, generate_waveform
+from text_processor import load_tokenizer, parse_text_with_markers, split_into_chunks
+
+SAMPLE_RATE = 24000
+
+def with_markers(paragraphs: List[str], seed: int) -> str:
+    """
+    Join paragraphs with pause markers and put an occasional setting marker in front.
+    """
+    rng = random.Random(seed)
+    parts = []
+    for paragraph in paragraphs:
+        if rng.random() < 0.2:
+            parts.append(f"<e={rng.choice([0.3, 0.5, 0.8])}>")
+        if rng.random() < 0.1:
+            parts.append(f"<t={rng.choice([0.4, 0.6, 0.8])}>")
+        parts.append(paragraph)
+        parts.append(f"<p={rng.choice([200, 500, 1000])}>")
+    return " ".join(parts)
+
+def synthetic_speech(seconds: float, seed: int) -> np.ndarray:
+    """
+    Noise shaped by a syllable-rate envelope, which has the peak structure of speech.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = np.abs(np.sin(2 * np.pi * 2.5 * t)) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.3 * t))
+    return (envelope * rng.standard_normal(len(t)) * 0.3).astype(np.float32)
+
+def measure(function: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """
+    Time a function, calling it often enough per round to take at least 0.2 seconds, and
+    return the per-call timings of all rounds in milliseconds.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    rounds = timer.repeat(repeat=repeat, number=number)
+    return {**summarize([seconds / number * 1000.0 for seconds in rounds]), "calls_per_round": number}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tokenizer", help="Path to the model's tokenizer.json for token-based chunking")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this path, - for stdout")
+    args = parser.parse_args()
+
+    # Parsing logs at DEBUG level, which must not be part of the measurement
+    logging.basicConfig(level=logging.WARNING)
+    if args.tokenizer and not load_tokenizer(args.tokenizer):
+        sys.exit(1)
+
+    texts = {
+        "short": with_markers(make_script(1, args.seed), args.seed)[:300],
+        "medium": with_markers(make_script(10, args.seed), args.seed),
+        "long": with_markers(make_script(100, args.seed), args.seed),
+    }
+    audio_seconds = {"short": 5.0, "medium": 60.0, "long": 600.0}
+
+    results = {}
+
+    def run(name: str, function: Callable[[], object], **details) -> None:
+        results[name] = {**details, "ms_per_call": measure(function, args.repeat)}
+        print(f"{name:<32} {results[name]['ms_per_call']['p50']:10.3f} ms")
+
+    for size, text in texts.items():
+        run(f"parse_text_with_markers.{size}", lambda text=text: parse_text_with_markers(text), characters=len(text))
+    for size, text in texts.items():
+        parts = [part for part, _ in parse_text_with_markers(text) if part.strip()]
+        run(
+            f"split_into_chunks.{size}", lambda parts=parts: [split_into_chunks(part) for part in parts],
+            characters=sum(len(part) for part in parts), parts=len(parts)
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size, seconds in audio_seconds.items():
+            samples = synthetic_speech(seconds, args.seed)
+            peaks = WaveformPeaks.from_audio(samples, SAMPLE_RATE)
+            wav_path = os.path.join(directory, f"{size}.wav")
+            sf.write(wav_path, samples, SAMPLE_RATE)
+            png_path = os.path.join(directory, f"{size}.png")
+            run(f"waveform_peaks.{size}", lambda samples=samples: WaveformPeaks.from_audio(samples, SAMPLE_RATE), audio_seconds=seconds)
+            run(f"waveform_render.{size}", lambda peaks=peaks: peaks.render(), audio_seconds=seconds)
+            run(f"generate_waveform.{size}", lambda wav_path=wav_path, png_path=png_path: generate_waveform(wav_path, png_path), audio_seconds=seconds)
+
+    write_results(
+        args.output, "micro_benchmarks",
+        {"repeat": args.repeat, "seed": args.seed, "tokenizer": args.tokenizer},
+        results
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import copy
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import replace
+from typing import Dict, Hashable, Optional, Tuple, Union
+
+import torch
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Number of prepared conditionals kept in memory. Each entry holds the speaker embedding,
+# the prompt speech tokens and the S3Gen reference features, which is a few MB at most.
+DEFAULT_CONDITIONING_CACHE_SIZE = 32
+
+def hash_voice_sample(data: bytes) -> str:
+    """
+    Return the content hash that identifies a voice sample.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+# A voice sample, either the path of a stored sample or the bytes of an inline one
+VoiceSample = Union[str, bytes]
+
+def _open_sample(voice_sample: VoiceSample):
+    """
+    Return something librosa can load: the path of a stored sample, or a buffer over the
+    bytes of an inline sample, which never touch the disk.
+    """
+    return io.BytesIO(voice_sample) if isinstance(voice_sample, bytes) else voice_sample
+
+def _supports_direct_conditioning(model) -> bool:
+    return all(hasattr(model, name) for name in ("t3", "s3gen", "ve", "ENC_COND_LEN", "DEC_COND_LEN"))
+
+def _compute_conditionals(model, voice_sample: VoiceSample, exaggeration: float):
+    """
+    Same steps as `ChatterboxTTS.prepare_conditionals`, but returns the conditionals
+    instead of storing them on the model, so several voices can be prepared concurrently.
+    """
+    import librosa
+    from chatterbox.tts import Conditionals
+    from chatterbox.models.s3gen import S3GEN_SR
+    from chatterbox.models.s3tokenizer import S3_SR
+    from chatterbox.models.t3.modules.cond_enc import T3Cond
+
+    s3gen_ref_wav, _ = librosa.load(_open_sample(voice_sample), sr=S3GEN_SR)
+    ref_16k_wav = librosa.resample(s3gen_ref_wav, orig_sr=S3GEN_SR, target_sr=S3_SR)
+    s3gen_ref_wav = s3gen_ref_wav[:model.DEC_COND_LEN]
+
+    with torch.no_grad():
+        s3gen_ref_dict = model.s3gen.embed_ref(s3gen_ref_wav, S3GEN_SR, device=model.device)
+
+        t3_cond_prompt_tokens = None
+        if plen := model.t3.hp.speech_cond_prompt_len:
+            t3_cond_prompt_tokens, _ = model.s3gen.tokenizer.forward([ref_16k_wav[:model.ENC_COND_LEN]], max_len=plen)
+            t3_cond_prompt_tokens = torch.atleast_2d(t3_cond_prompt_tokens).to(model.device)
+
+        ve_embed = torch.from_numpy(model.ve.embeds_from_wavs([ref_16k_wav], sample_rate=S3_SR))
+        ve_embed = ve_embed.mean(axis=0, keepdim=True).to(model.device)
+
+    t3_cond = T3Cond(
+        speaker_emb=ve_embed,
+        cond_prompt_speech_tokens=t3_cond_prompt_tokens,
+        emotion_adv=exaggeration * torch.ones(1, 1, 1),
+    ).to(device=model.device)
+    return Conditionals(t3_cond, s3gen_ref_dict)
+
+def prepare_conditionals(model, voice_sample: VoiceSample, exaggeration: float):
+    """
+    Run the model's conditioning for a voice sample, given as a path or as the sample's
+    bytes, and return the result without replacing the conditionals the model currently holds.
+    """
+    with timed("conditioning"):
+        if _supports_direct_conditioning(model):
+            return _compute_conditionals(model, voice_sample, exaggeration)
+        # Engines that can only prepare conditionals in place do so on a shallow copy, which
+        # shares the weights, so the conditionals the scheduler generates with stay untouched
+        scratch = copy.copy(model)
+        scratch.prepare_conditionals(_open_sample(voice_sample), exaggeration=exaggeration)
+        return scratch.conds
+
+def use_conditionals(model, conds) -> None:
+    """
+    Make the model generate with the given conditionals.
+
+    `model.generate` replaces `conds.t3` in place when the exaggeration changes, so the
+    model gets a shallow copy to keep cached entries untouched.
+    """
+    model.conds = replace(conds) if conds is not None else None
+
+class ConditioningCache:
+    """
+    In-process LRU cache of speaker conditionals keyed by voice sample hash and exaggeration.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CONDITIONING_CACHE_SIZE, store=None):
+        self.max_entries = max(1, max_entries)
+        # Optional persistent ConditioningStore consulted before preparing conditionals
+        self.store = store
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        # Conditionals being loaded or prepared, so concurrent misses of a key wait for one result
+        self._preparing: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(voice_hash: str, exaggeration: float) -> Tuple[str, float]:
+        return (voice_hash, round(float(exaggeration), 4))
+
+    def get(self, voice_hash: str, exaggeration: float) -> Optional[object]:
+        key = self.make_key(voice_hash, exaggeration)
+        with self._lock:
+            conds = self._entries.get(key)
+            if conds is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return conds
+
+    def put(self, voice_hash: str, exaggeration: float, conds) -> None:
+        key = self.make_key(voice_hash, exaggeration)
+        with self._lock:
+            self._entries[key] = conds
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.debug(f"Evicted conditionals for voice {evicted_key[0][:12]} (exaggeration {evicted_key[1]})")
+
+    def get_or_prepare(self, model, voice_hash: str, voice_sample: VoiceSample, exaggeration: float):
+        """
+        Return cached conditionals for the voice, loading them from the persistent store
+        or preparing them on a cache miss. Concurrent misses of the same voice and
+        exaggeration wait for the first one instead of preparing the voice again.
+        """
+        conds = self.get(voice_hash, exaggeration)
+        if conds is not None:
+            return conds
+        key = self.make_key(voice_hash, exaggeration)
+        with self._lock:
+            future = self._preparing.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self._preparing[key] = future
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            if self.store is not None:
+                conds = self.store.load(voice_hash, exaggeration, model.device)
+            if conds is None:
+                logger.debug(f"Preparing conditionals for voice {voice_hash[:12]} with exaggeration {exaggeration}")
+                conds = prepare_conditionals(model, voice_sample, exaggeration)
+                if self.store is not None:
+                    self.store.save(voice_hash, conds)
+            self.put(voice_hash, exaggeration, conds)
+        except BaseException as e:
+            with self._lock:
+                self._preparing.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._preparing.pop(key, None)
+        future.set_result(conds)
+        return conds
+
+    def discard(self, voice_hash: str) -> None:
+        """
+        Drop all cached conditionals of a voice, whatever their exaggeration.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == voice_hash]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,178 @@
+import os
+import hashlib
+import logging
+import threading
+from importlib import metadata
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from model_files import is_converted_checkpoint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONDITIONING_STORE_DIR = "data/conditionals"
+
+def model_version(model_dir: str) -> str:
+    """
+    Return a short identifier for the installed Chatterbox package and model files.
+
+    Conditionals depend on the voice encoder, tokenizer and S3Gen weights, so stored
+    entries are only reused for the exact same model. Files are told apart by size and
+    modification time, so replacing weights with a checkpoint of the same size, like a
+    fine-tune, changes the version as well.
+    """
+    digest = hashlib.sha256()
+    try:
+        digest.update(metadata.version("chatterbox-tts").encode())
+    except metadata.PackageNotFoundError:
+        pass
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        # Converted checkpoints hold the same weights as their originals
+        if os.path.isfile(path) and not is_converted_checkpoint(model_dir, name):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+def _flatten_conditionals(conds) -> Tuple[Dict[str, torch.Tensor], List[str]]:
+    """
+    Turn conditionals into a flat tensor dict plus the names of fields that are None.
+    """
+    tensors = {}
+    none_keys = []
+    for prefix, fields in (("t3", vars(conds.t3)), ("gen", conds.gen)):
+        for name, value in fields.items():
+            key = f"{prefix}.{name}"
+            if value is None:
+                none_keys.append(key)
+            else:
+                tensors[key] = torch.as_tensor(value).detach().to("cpu").contiguous()
+    return tensors, none_keys
+
+def _unflatten_conditionals(tensors: Dict[str, torch.Tensor], none_keys: List[str], exaggeration: float, device):
+    """
+    Rebuild conditionals on the given device with the requested exaggeration.
+    """
+    from chatterbox.tts import Conditionals
+    from chatterbox.models.t3.modules.cond_enc import T3Cond
+
+    fields = {"t3": {}, "gen": {}}
+    for key, value in tensors.items():
+        prefix, name = key.split(".", 1)
+        fields[prefix][name] = value.to(device)
+    for key in none_keys:
+        prefix, name = key.split(".", 1)
+        fields[prefix][name] = None
+    # Exaggeration only affects the emotion input of T3, so one entry serves all values
+    fields["t3"]["emotion_adv"] = exaggeration * torch.ones(1, 1, 1, device=device)
+    return Conditionals(T3Cond(**fields["t3"]), fields["gen"])
+
+class ConditioningStore:
+    """
+    Precomputed conditionals persisted as one safetensors file per voice sample hash,
+    grouped by model version.
+
+    All entries are opened memory-mapped at startup, so a restart doesn't pay for
+    conditioning again and untouched voices cost no resident memory. Entries saved by
+    other replica processes later on are opened when first needed.
+    """
+
+    def __init__(self, directory: str, version: str):
+        self.directory = os.path.join(directory, version)
+        self.version = version
+        self._entries: Dict[str, Tuple[Dict[str, torch.Tensor], List[str]]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path_for(self, voice_hash: str) -> str:
+        return os.path.join(self.directory, f"{voice_hash}.safetensors")
+
+    @staticmethod
+    def _read(path: str) -> Tuple[Dict[str, torch.Tensor], List[str]]:
+        with safe_open(path, framework="pt", device="cpu") as f:
+            tensors = {key: f.get_tensor(key) for key in f.keys()}
+            none_keys = (f.metadata() or {}).get("none_keys", "")
+        return tensors, [key for key in none_keys.split(",") if key]
+
+    def load_all(self) -> int:
+        """
+        Open every stored entry of the current model version and return their count.
+        """
+        loaded = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".safetensors"):
+                continue
+            voice_hash = entry.name[:-len(".safetensors")]
+            try:
+                self._entries[voice_hash] = self._read(entry.path)
+                loaded += 1
+            except Exception as e:
+                logger.warning(f"Skipping unreadable conditionals {entry.path}: {str(e)}")
+        return loaded
+
+    def contains(self, voice_hash: str) -> bool:
+        with self._lock:
+            if voice_hash in self._entries:
+                return True
+        return os.path.exists(self._path_for(voice_hash))
+
+    def _open_saved(self, voice_hash: str) -> Optional[Tuple[Dict[str, torch.Tensor], List[str]]]:
+        """
+        Open an entry another process saved after this store was loaded.
+        """
+        path = self._path_for(voice_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            entry = self._read(path)
+        except Exception as e:
+            logger.warning(f"Skipping unreadable conditionals {path}: {str(e)}")
+            return None
+        with self._lock:
+            return self._entries.setdefault(voice_hash, entry)
+
+    def load(self, voice_hash: str, exaggeration: float, device) -> Optional[object]:
+        with self._lock:
+            entry = self._entries.get(voice_hash)
+        if entry is None:
+            entry = self._open_saved(voice_hash)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        tensors, none_keys = entry
+        return _unflatten_conditionals(tensors, none_keys, exaggeration, device)
+
+    def save(self, voice_hash: str, conds) -> None:
+        tensors, none_keys = _flatten_conditionals(conds)
+        path = self._path_for(voice_hash)
+        # Write to a sibling file first so a crash never leaves a truncated entry behind
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+        save_file(tensors, partial_path, metadata={"none_keys": ",".join(none_keys)})
+        os.replace(partial_path, path)
+        with self._lock:
+            self._entries[voice_hash] = (tensors, none_keys)
+        logger.info(f"Stored conditionals for voice {voice_hash[:12]}")
+
+    def discard(self, voice_hash: str) -> None:
+        with self._lock:
+            self._entries.pop(voice_hash, None)
+        try:
+            os.unlink(self._path_for(voice_hash))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "model_version": self.version,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,135 @@
+import contextlib
+import functools
+import logging
+from typing import Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Values of TTS_CPU_QUANTIZE and TTS_CPU_BF16
+QUANTIZE_MODES = ("none", "int8")
+BF16_MODES = ("off", "auto", "on")
+
+# CPU flags of native bf16 arithmetic; without them bf16 is emulated and slower than fp32
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+@functools.lru_cache(maxsize=None)
+def cpu_supports_bf16() -> bool:
+    """
+    Return whether the CPU has native bf16 instructions, as listed in /proc/cpuinfo.
+    """
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set()
+            for line in f:
+                if line.startswith("flags"):
+                    flags.update(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        return False
+    return any(flag in flags for flag in BF16_CPU_FLAGS)
+
+class CpuEngineOptions:
+    """
+    How models on the CPU are prepared and run.
+
+    `quantize="int8"` replaces the linear layers of the T3 transformer with dynamically
+    quantized int8 ones, `bf16` runs generation under bf16 autocast ("auto" only if the
+    CPU has native bf16 instructions), the thread counts configure torch's intra-op and
+    inter-op pools (0 keeps torch's default) and `compile` wraps the T3 transformer in
+    `torch.compile`.
+    """
+
+    def __init__(
+        self,
+        quantize: str = "none",
+        bf16: str = "off",
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        compile: bool = False
+    ):
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unsupported quantization {quantize}, use one of {', '.join(QUANTIZE_MODES)}")
+        if bf16 not in BF16_MODES:
+            raise ValueError(f"Unsupported bf16 mode {bf16}, use one of {', '.join(BF16_MODES)}")
+        self.quantize = quantize
+        self.bf16 = bf16
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.compile = compile
+
+    @property
+    def use_bf16(self) -> bool:
+        return self.bf16 == "on" or (self.bf16 == "auto" and cpu_supports_bf16())
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "quantize": self.quantize,
+            "bf16": self.bf16,
+            "bf16_active": self.use_bf16,
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "compile": self.compile,
+        }
+
+def configure_threads(options: CpuEngineOptions) -> None:
+    """
+    Size torch's thread pools. The inter-op pool can only be sized before it is first
+    used, so a late call keeps its current size.
+    """
+    if options.intra_op_threads > 0:
+        torch.set_num_threads(options.intra_op_threads)
+    if options.inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(options.inter_op_threads)
+        except RuntimeError as e:
+            logger.warning(f"Could not set inter-op threads: {str(e)}")
+    logger.info(f"Using {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op threads")
+
+def optimize_model(model, options: CpuEngineOptions) -> None:
+    """
+    Apply the quantization and compilation options to a model loaded on the CPU. Call it
+    before the first generation, so no generation runs with the unoptimized transformer.
+    """
+    if options.quantize == "int8":
+        # Replaces the linear layers in place, so every holder of the transformer uses them
+        torch.ao.quantization.quantize_dynamic(model.t3.tfmr, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info("Quantized T3 transformer linear layers to int8")
+    if options.compile:
+        # Compiling wraps the transformer instead, so T3 has to decode with the wrapper.
+        # T3 builds its decoding backend around `tfmr` when it first generates, and some
+        # versions keep that backend as `patched_model`, which then holds the unwrapped
+        # transformer. Decoding grows the sequence, so shapes are dynamic.
+        compiled = torch.compile(model.t3.tfmr, dynamic=True)
+        model.t3.tfmr = compiled
+        patched_model = getattr(model.t3, "patched_model", None)
+        if patched_model is not None:
+            patched_model.model = compiled
+        logger.info("Compiled T3 transformer with torch.compile")
+
+@contextlib.contextmanager
+def map_checkpoints_to_cpu():
+    """
+    Load checkpoints saved on CUDA onto the CPU while the context is active.
+    """
+    # See https://github.com/resemble-ai/chatterbox/issues/96#issuecomment-2925635803
+    original_torch_load = torch.load
+    def load_on_cpu(*args, **kwargs):
+        kwargs.setdefault('map_location', torch.device('cpu'))
+        return original_torch_load(*args, **kwargs)
+    torch.load = load_on_cpu
+    try:
+        yield
+    finally:
+        torch.load = original_torch_load
+
+def inference_context(options: Optional[CpuEngineOptions]):
+    """
+    Return the context generation runs in: bf16 autocast if enabled, else nothing.
+    """
+    if options is not None and options.use_bf16:
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
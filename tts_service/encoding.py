@@ -0,0 +1,68 @@
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Dict, Optional
+
+import torch
+
+from audio_io import OUTPUT_FORMATS, encode_audio, write_audio
+from metrics import observe_stage
+from stats import RollingStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODE_WORKERS = 2
+
+class AudioEncoder:
+    """
+    Thread pool that encodes generated audio, so neither the batch scheduler nor the event
+    loop waits on encoders. libsndfile runs without holding the GIL, so threads encode in
+    parallel.
+    """
+
+    def __init__(self, workers: int = DEFAULT_ENCODE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="encode")
+        self.output_bytes = {output_format: RollingStats() for output_format in OUTPUT_FORMATS}
+        self.encode_seconds = {output_format: RollingStats() for output_format in OUTPUT_FORMATS}
+
+    def submit(
+        self,
+        audio: torch.Tensor,
+        sample_rate: int,
+        output_format: str = "wav",
+        bitrate: Optional[int] = None,
+        target: Optional[BinaryIO] = None
+    ) -> Future:
+        """
+        Queue audio for encoding and return a future resolving to the encoded bytes, or
+        to the number of bytes written if a target file object is given.
+        """
+        return self._pool.submit(self._encode, audio, sample_rate, output_format, bitrate, target)
+
+    def encode(self, audio: torch.Tensor, sample_rate: int, output_format: str = "wav", bitrate: Optional[int] = None) -> bytes:
+        """Encode on the pool and wait for the result."""
+        return self.submit(audio, sample_rate, output_format, bitrate).result()
+
+    def _encode(self, audio, sample_rate, output_format, bitrate, target):
+        start_time = time.perf_counter()
+        if target is None:
+            result = encode_audio(audio, sample_rate, output_format, bitrate)
+            size = len(result)
+        else:
+            write_audio(target, audio, sample_rate, output_format, bitrate)
+            result = size = target.tell()
+        elapsed = time.perf_counter() - start_time
+        observe_stage("encoding", elapsed)
+        self.output_bytes[output_format].add(size)
+        self.encode_seconds[output_format].add(elapsed)
+        logger.debug(f"Encoded {audio.shape[-1] / sample_rate:.2f}s of audio as {output_format} ({size} bytes) in {elapsed * 1000:.1f} ms")
+        return result
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            output_format: {
+                "output_bytes": self.output_bytes[output_format].summary(),
+                "encode_seconds": self.encode_seconds[output_format].summary(),
+            }
+            for output_format in OUTPUT_FORMATS
+        }
@@ -1,51 +1,221 @@
-import os
-import numpy as np
-import librosa
-import matplotlib.pyplot as plt
-from PIL import Image
-import io
-
-def generate_waveform(wav_path: str, output_path: str, width: int = 800, height: int = 200):
-    """
-    Generate a waveform visualization from a WAV file.
-    
-    Args:
-        wav_path: Path to the WAV file
-        output_path: Path to save the waveform image
-        width: Width of the output image
-        height: Height of the output image
-    """
-    # Load the audio file
-    y, sr = librosa.load(wav_path, sr=None)
-    
-    # Create figure with transparent background
-    plt.figure(figsize=(width/100, height/100), dpi=100)
-    plt.axis('off')
-    
-    # Plot waveform
-    plt.plot(y, color='#2563eb', linewidth=1, alpha=0.8)
-    
-    # Remove padding
-    plt.margins(x=0)
-    
-    # Save to buffer
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', transparent=True, bbox_inches='tight', pad_inches=0)
-    plt.close()
-    
-    # Open the image and resize
-    img = Image.open(buf)
-    img = img.resize((width, height), Image.Resampling.LANCZOS)
-    
-    # Save the image
-    img.save(output_path, 'PNG')
-    
-    return output_path
-
-if __name__ == '__main__':
-    import sys
-    if len(sys.argv) != 3:
-        print("Usage: python generate_waveform.py <input_wav> <output_png>")
-        sys.exit(1)
-    
-    generate_waveform(sys.argv[1], sys.argv[2]) 
\ No newline at end of file
+import io
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import librosa
+from PIL import Image
+
+# Samples per peak of the finest zoom level; every coarser level doubles it
+BASE_SAMPLES_PER_PEAK = 256
+
+# Coarser levels are added until a level has at most this many peaks
+MIN_PEAKS_PER_LEVEL = 256
+
+# Peaks file layout, all little-endian:
+#   header: magic, version, sample rate, length in samples, number of levels
+#   per level: samples per peak, number of peaks, then (min, max, rms) int16 triples
+PEAKS_MAGIC = b"LVPK"
+PEAKS_VERSION = 1
+PEAKS_MEDIA_TYPE = "application/octet-stream"
+
+# Waveform color (#2563eb); the peak envelope is drawn at 80% opacity and RMS on top of it
+WAVEFORM_COLOR = (37, 99, 235)
+PEAK_ALPHA = 204
+RMS_ALPHA = 255
+
+DEFAULT_PEAKS_STORE_SIZE = 256
+
+class PeakLevel:
+    """
+    Min, max and RMS of consecutive blocks of `samples_per_peak` samples.
+    """
+
+    def __init__(self, samples_per_peak: int, mins: np.ndarray, maxs: np.ndarray, rms: np.ndarray):
+        self.samples_per_peak = samples_per_peak
+        self.mins = mins
+        self.maxs = maxs
+        self.rms = rms
+
+    def __len__(self) -> int:
+        return len(self.mins)
+
+def _block_starts(length: int, block_size: int) -> np.ndarray:
+    return np.arange(0, length, block_size)
+
+def reduce_peaks(samples: np.ndarray, samples_per_peak: int) -> PeakLevel:
+    """
+    Reduce mono samples to one min/max/RMS peak per block of `samples_per_peak` samples.
+    """
+    if len(samples) == 0:
+        empty = np.zeros(0, dtype=np.float32)
+        return PeakLevel(samples_per_peak, empty, empty, empty)
+    starts = _block_starts(len(samples), samples_per_peak)
+    counts = np.diff(np.append(starts, len(samples)))
+    squares = np.add.reduceat(np.square(samples, dtype=np.float64), starts)
+    return PeakLevel(
+        samples_per_peak,
+        np.minimum.reduceat(samples, starts),
+        np.maximum.reduceat(samples, starts),
+        np.sqrt(squares / counts).astype(np.float32)
+    )
+
+def _coarsen(level: PeakLevel) -> PeakLevel:
+    """
+    Merge pairs of neighbouring peaks into a level with twice the samples per peak.
+    """
+    starts = _block_starts(len(level), 2)
+    counts = np.diff(np.append(starts, len(level)))
+    squares = np.add.reduceat(np.square(level.rms, dtype=np.float64), starts)
+    return PeakLevel(
+        level.samples_per_peak * 2,
+        np.minimum.reduceat(level.mins, starts),
+        np.maximum.reduceat(level.maxs, starts),
+        np.sqrt(squares / counts).astype(np.float32)
+    )
+
+class WaveformPeaks:
+    """
+    Multi-resolution peaks of a mono signal, from which waveforms of any width are drawn.
+    """
+
+    def __init__(self, sample_rate: int, length: int, levels: List[PeakLevel]):
+        self.sample_rate = sample_rate
+        self.length = length
+        self.levels = levels
+
+    @classmethod
+    def from_audio(cls, samples: np.ndarray, sample_rate: int) -> "WaveformPeaks":
+        """
+        Compute peaks of mono float samples, or of (channels, samples) arrays mixed down to mono.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=0)
+        levels = [reduce_peaks(samples, BASE_SAMPLES_PER_PEAK)]
+        while len(levels[-1]) > MIN_PEAKS_PER_LEVEL:
+            levels.append(_coarsen(levels[-1]))
+        return cls(sample_rate, len(samples), levels)
+
+    def level_for_width(self, width: int) -> PeakLevel:
+        """
+        Return the coarsest level that still has at least one peak per pixel column.
+        """
+        for level in reversed(self.levels):
+            if len(level) >= width:
+                return level
+        return self.levels[0]
+
+    def render(self, width: int = 800, height: int = 200) -> bytes:
+        """
+        Rasterize the waveform into a transparent PNG.
+        """
+        image = np.zeros((height, width, 4), dtype=np.uint8)
+        level = self.level_for_width(width)
+        if len(level):
+            # Map every pixel column to its range of peaks; short signals repeat peaks
+            starts = np.arange(width) * len(level) // width
+            mins = np.minimum.reduceat(level.mins, starts)
+            maxs = np.maximum.reduceat(level.maxs, starts)
+            rms = np.maximum.reduceat(level.rms, starts)
+
+            scale = max(float(np.abs(mins).max()), float(np.abs(maxs).max()), 1e-6)
+            center = (height - 1) / 2.0
+            rows = np.arange(height)[:, None]
+
+            def row_of(values: np.ndarray) -> np.ndarray:
+                return np.round(center - values / scale * center)
+
+            peak_mask = (rows >= row_of(maxs)) & (rows <= row_of(mins))
+            rms_mask = peak_mask & (rows >= row_of(rms)) & (rows <= row_of(-rms))
+            image[peak_mask] = (*WAVEFORM_COLOR, PEAK_ALPHA)
+            image[rms_mask] = (*WAVEFORM_COLOR, RMS_ALPHA)
+
+        buffer = io.BytesIO()
+        Image.fromarray(image, "RGBA").save(buffer, "PNG")
+        return buffer.getvalue()
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the peaks into the compact binary peaks file format.
+        """
+        parts = [struct.pack('<4sHIIH', PEAKS_MAGIC, PEAKS_VERSION, self.sample_rate, self.length, len(self.levels))]
+        for level in self.levels:
+            triples = np.stack([level.mins, level.maxs, level.rms], axis=1)
+            parts.append(struct.pack('<II', level.samples_per_peak, len(level)))
+            parts.append((np.clip(triples, -1.0, 1.0) * 32767.0).round().astype("<i2").tobytes())
+        return b"".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "length": self.length,
+            "levels": [
+                {
+                    "samples_per_peak": level.samples_per_peak,
+                    "min": np.round(level.mins, 4).tolist(),
+                    "max": np.round(level.maxs, 4).tolist(),
+                    "rms": np.round(level.rms, 4).tolist(),
+                }
+                for level in self.levels
+            ],
+        }
+
+def load_peaks(source) -> WaveformPeaks:
+    """
+    Compute the peaks of an audio file, given as a path or a file-like object.
+    """
+    y, sr = librosa.load(source, sr=None)
+    return WaveformPeaks.from_audio(y, sr)
+
+class PeaksStore:
+    """
+    In-memory LRU store of the peaks of recently generated speech, so clients can fetch
+    waveforms by ID instead of uploading the audio again.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_PEAKS_STORE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, WaveformPeaks]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, peaks: WaveformPeaks) -> str:
+        waveform_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[waveform_id] = peaks
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return waveform_id
+
+    def get(self, waveform_id: str) -> Optional[WaveformPeaks]:
+        with self._lock:
+            peaks = self._entries.get(waveform_id)
+            if peaks is not None:
+                self._entries.move_to_end(waveform_id)
+            return peaks
+
+def generate_waveform(wav_path: str, output_path: str, width: int = 800, height: int = 200):
+    """
+    Generate a waveform visualization from a WAV file.
+
+    Args:
+        wav_path: Path to the WAV file
+        output_path: Path to save the waveform image
+        width: Width of the output image
+        height: Height of the output image
+    """
+    with open(output_path, "wb") as f:
+        f.write(load_peaks(wav_path).render(width, height))
+
+    return output_path
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python generate_waveform.py <input_wav> <output_png>")
+        sys.exit(1)
+
+    generate_waveform(sys.argv[1], sys.argv[2])
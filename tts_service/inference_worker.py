@@ -0,0 +1,369 @@
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+from batching import GenerationCancelled
+from stats import RollingStats
+
+logger = logging.getLogger(__name__)
+
+# Lower values run first
+PRIORITIES = {
+    "interactive": 0,
+    "bulk": 10,
+}
+
+DEFAULT_MAX_QUEUE_SIZE = 64
+DEFAULT_MAX_CLIENT_JOBS = 16
+DEFAULT_CONCURRENCY = 4
+DEFAULT_JOB_TTL_SECONDS = 3600
+
+# Client of jobs submitted without one
+ANONYMOUS_CLIENT = "anonymous"
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the inference queue, or the client's share of it,
+    is full. `retry_after` estimates the seconds until a slot frees up.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Marks the end of a job's event stream
+END_OF_EVENTS = object()
+
+class Job:
+    """
+    A unit of work for the inference worker, together with its state and result.
+    """
+
+    def __init__(self, fn: Callable, args: tuple, kwargs: dict, priority: int, kind: str, client: str = ANONYMOUS_CLIENT):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.kind = kind
+        self.client = client
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Per-item counters of jobs that cover several lines
+        self.progress: Optional[Dict[str, int]] = None
+        self.future: Future = Future()
+        # Partial results emitted while the job runs, terminated by END_OF_EVENTS
+        self.events: "queue.Queue" = queue.Queue()
+        # Set once nobody waits for the result; the chunks of the job are dropped
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """
+        Give up on the job. A queued job never starts, a running one stops generating at
+        the next decoding step or chunk. Finished jobs are left alone.
+        """
+        if self.finished_at is None:
+            self.cancelled.set()
+
+    def emit(self, item) -> None:
+        """Publish a partial result to consumers of `iter_events`."""
+        self.events.put(item)
+
+    def iter_events(self) -> Iterator:
+        """Yield partial results until the job finishes; blocks while waiting."""
+        while True:
+            item = self.events.get()
+            if item is END_OF_EVENTS:
+                return
+            yield item
+
+    def to_dict(self) -> Dict:
+        result = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.progress is not None:
+            result["progress"] = dict(self.progress)
+        return result
+
+class ClientQueueFull(Exception):
+    """Raised by `FairQueue.put` when the job's client holds its share of the queue."""
+
+class FairQueue:
+    """
+    Bounded queue of jobs, lowest priority value first. Within a priority, clients take
+    turns, so a client with many queued jobs doesn't delay the first job of another, and
+    no client may hold more than `max_client_jobs` of the queue.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_QUEUE_SIZE, max_client_jobs: int = DEFAULT_MAX_CLIENT_JOBS):
+        self.max_size = max_size
+        self.max_client_jobs = max_client_jobs
+        # Queued jobs by priority, then by client in the order clients get their turn
+        self._queues: Dict[int, "OrderedDict[str, Deque[Job]]"] = {}
+        self._client_sizes: Dict[str, int] = {}
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def client_size(self, client: str) -> int:
+        with self._condition:
+            return self._client_sizes.get(client, 0)
+
+    def put(self, job: Job) -> None:
+        """
+        Queue a job, raising `queue.Full` if the queue is full and `ClientQueueFull` if the
+        job's client holds its share already.
+        """
+        with self._condition:
+            if self.max_size > 0 and self._size >= self.max_size:
+                raise queue.Full
+            if self.max_client_jobs > 0 and self._client_sizes.get(job.client, 0) >= self.max_client_jobs:
+                raise ClientQueueFull
+            clients = self._queues.setdefault(job.priority, OrderedDict())
+            clients.setdefault(job.client, deque()).append(job)
+            self._client_sizes[job.client] = self._client_sizes.get(job.client, 0) + 1
+            self._size += 1
+            self._condition.notify()
+
+    def get(self) -> Job:
+        """
+        Block for the next job: the first job of the next client in line at the most urgent priority.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._size > 0)
+            priority = min(self._queues)
+            clients = self._queues[priority]
+            client, jobs = next(iter(clients.items()))
+            job = jobs.popleft()
+            # The client goes to the back of the line, or leaves it without queued jobs
+            del clients[client]
+            if jobs:
+                clients[client] = jobs
+            if not clients:
+                del self._queues[priority]
+            self._dequeued(client)
+            return job
+
+    def remove(self, job: Job) -> bool:
+        """
+        Take a queued job out of the queue, returning whether it was queued.
+        """
+        with self._condition:
+            clients = self._queues.get(job.priority, {})
+            jobs = clients.get(job.client)
+            if not jobs or job not in jobs:
+                return False
+            jobs.remove(job)
+            if not jobs:
+                del clients[job.client]
+            if not clients:
+                self._queues.pop(job.priority, None)
+            self._dequeued(job.client)
+            return True
+
+    def _dequeued(self, client: str) -> None:
+        self._size -= 1
+        self._client_sizes[client] -= 1
+        if not self._client_sizes[client]:
+            del self._client_sizes[client]
+
+class InferenceWorker:
+    """
+    Worker threads that run submitted jobs, lowest priority value first and in submission
+    order within a priority.
+
+    Jobs orchestrate requests (markers, conditioning, concatenation) while the model itself
+    is driven by the batch scheduler, so several jobs run at once and their chunks can share
+    batches. Keeping all of this off the event loop leaves it free to answer /health and
+    other requests while speech is being generated.
+
+    Clients take turns within a priority and each may only hold part of the queue, see
+    `FairQueue`.
+    """
+
+    def __init__(
+        self,
+        name: str = "inference",
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_client_jobs: int = DEFAULT_MAX_CLIENT_JOBS
+    ):
+        self.name = name
+        self.max_queue_size = max_queue_size
+        self.max_client_jobs = max_client_jobs
+        self.concurrency = max(1, concurrency)
+        self._queue = FairQueue(max_queue_size, max_client_jobs)
+        self._threads: List[threading.Thread] = []
+        self._running_lock = threading.Lock()
+        self.running_jobs = 0
+        self.job_seconds = RollingStats(window=100)
+        self.rejected = 0
+        self.cancelled = 0
+
+    def start(self) -> None:
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def retry_after(self, jobs_ahead: int) -> int:
+        """
+        Estimate the seconds until `jobs_ahead` queued jobs have been started.
+        """
+        mean = self.job_seconds.summary()["mean"] or 1.0
+        return max(1, math.ceil(mean * jobs_ahead / self.concurrency))
+
+    def submit(
+        self,
+        fn: Callable,
+        *args,
+        priority: int = PRIORITIES["interactive"],
+        kind: str = "tts",
+        client: str = ANONYMOUS_CLIENT,
+        **kwargs
+    ) -> Job:
+        """
+        Queue `fn(job, *args, **kwargs)` for the worker thread and return its job.
+        """
+        job = Job(fn, args, kwargs, priority, kind, client)
+        try:
+            self._queue.put(job)
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Inference queue is full ({self.max_queue_size} jobs)", self.retry_after(self._queue.qsize())
+            )
+        except ClientQueueFull:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Client {client} has {self.max_client_jobs} jobs queued already",
+                self.retry_after(self._queue.client_size(client))
+            )
+        return job
+
+    def cancel(self, job: Job) -> None:
+        """
+        Cancel a job, taking it out of the queue if it hasn't started.
+        """
+        if job.finished_at is not None or job.cancelled.is_set():
+            return
+        job.cancel()
+        self.cancelled += 1
+        if self._queue.remove(job):
+            self._finish(job, "cancelled")
+            job.future.cancel()
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.events.put(END_OF_EVENTS)
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job.cancelled.is_set():
+                job.future.cancel()
+            # A future cancelled while the job waited has nobody to take its result
+            if not job.future.set_running_or_notify_cancel():
+                self._finish(job, "cancelled")
+                continue
+            with self._running_lock:
+                self.running_jobs += 1
+            job.status = "running"
+            job.started_at = time.time()
+            status = "done"
+            try:
+                result = job.fn(job, *job.args, **job.kwargs)
+                self._settle(job.future, result=result)
+            except GenerationCancelled as e:
+                logger.info(f"Cancelled job {job.id}")
+                status = "cancelled"
+                job.error = str(e)
+                self._settle(job.future, error=e)
+            except Exception as e:
+                logger.error(f"Error in job {job.id}: {str(e)}", exc_info=True)
+                status = "failed"
+                job.error = str(e)
+                self._settle(job.future, error=e)
+            finally:
+                self.job_seconds.add(time.time() - job.started_at)
+                self._finish(job, status)
+                with self._running_lock:
+                    self.running_jobs -= 1
+
+    @staticmethod
+    def _settle(future: Future, result=None, error: Optional[BaseException] = None) -> None:
+        """
+        Resolve the future of a job, unless it was resolved elsewhere already, which must not
+        take the worker thread down.
+        """
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            logger.debug("Dropping the result of a job whose future is already done")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_size": self.max_queue_size,
+            "max_client_jobs": self.max_client_jobs,
+            "running_jobs": self.running_jobs,
+            "rejected_jobs": self.rejected,
+            "cancelled_jobs": self.cancelled,
+            "job_seconds": self.job_seconds.summary(),
+        }
+
+class JobStore:
+    """
+    Jobs submitted through the /jobs endpoints, kept until they expire after finishing.
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> None:
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            self._expire()
+            return list(self._jobs.values())
+
+    def _expire(self) -> None:
+        deadline = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < deadline]
+        for job_id in expired:
+            del self._jobs[job_id]
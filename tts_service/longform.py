@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+from typing import BinaryIO, Dict, Iterable, Optional
+
+from audio_io import UNKNOWN_WAV_SIZE, wav_header
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LONGFORM_DIR = "data/tts_longform"
+DEFAULT_LONGFORM_MAX_MB = 4096
+
+# Chunks of a long-form job generated ahead of the one being written
+DEFAULT_LONGFORM_WINDOW = 8
+
+# Size of the header written by `wav_header`
+WAV_HEADER_SIZE = 44
+
+class LongformWriter:
+    """
+    Appends 16-bit PCM to a WAV file entry by entry, so the audio of long texts never has
+    to be held in memory as a whole.
+
+    After every appended entry a checkpoint next to the file records how many entries and
+    bytes of audio are complete, so a synthesis that is interrupted resumes after the last
+    complete entry. Until `finish` patches in the final sizes, the header announces a
+    stream of unknown length, so the partial file already plays.
+    """
+
+    def __init__(self, directory: str, output_id: str, sample_rate: int):
+        self.directory = directory
+        self.output_id = output_id
+        self.sample_rate = sample_rate
+        self.path = os.path.join(directory, f"{output_id}.wav")
+        self.checkpoint_path = os.path.join(directory, f"{output_id}.json")
+        self.entries = 0
+        self.data_bytes = 0
+        self.done = False
+        self._file: Optional[BinaryIO] = None
+
+    @staticmethod
+    def read_checkpoint(directory: str, output_id: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(directory, f"{output_id}.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def open(self) -> int:
+        """
+        Open the file, resuming from its checkpoint if there is a usable one. Returns the
+        number of entries already complete.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        checkpoint = self.read_checkpoint(self.directory, self.output_id)
+        if (
+            checkpoint is not None
+            and checkpoint.get("sample_rate") == self.sample_rate
+            and os.path.exists(self.path)
+            and os.path.getsize(self.path) >= WAV_HEADER_SIZE + checkpoint["data_bytes"]
+        ):
+            self.entries = checkpoint["entries"]
+            self.data_bytes = checkpoint["data_bytes"]
+            self.done = checkpoint.get("done", False)
+            self._file = open(self.path, "r+b")
+            # Drop audio written after the last checkpoint
+            self._file.truncate(WAV_HEADER_SIZE + self.data_bytes)
+            self._file.seek(0, os.SEEK_END)
+            if self.entries:
+                logger.info(f"Resuming long-form output {self.output_id[:12]} after {self.entries} entries")
+            return self.entries
+
+        self.entries = 0
+        self.data_bytes = 0
+        self.done = False
+        self._file = open(self.path, "w+b")
+        self._file.write(wav_header(self.sample_rate, UNKNOWN_WAV_SIZE))
+        self._sync()
+        return 0
+
+    def append(self, data: bytes) -> None:
+        """
+        Append the PCM of the next entry and checkpoint it.
+        """
+        self._file.write(data)
+        self._sync()
+        self.entries += 1
+        self.data_bytes += len(data)
+        self._write_checkpoint()
+
+    def finish(self) -> None:
+        """
+        Write the final sizes into the header and mark the output as complete.
+        """
+        self._file.seek(0)
+        self._file.write(wav_header(self.sample_rate, self.data_bytes))
+        self._file.seek(0, os.SEEK_END)
+        self._sync()
+        self.done = True
+        self._write_checkpoint()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def duration_seconds(self) -> float:
+        return self.data_bytes / 2 / self.sample_rate
+
+    def _sync(self) -> None:
+        # The checkpoint must never be ahead of the audio on disk
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write_checkpoint(self) -> None:
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "entries": self.entries,
+                "data_bytes": self.data_bytes,
+                "sample_rate": self.sample_rate,
+                "done": self.done,
+            }, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+def evict_longform_outputs(directory: str, max_bytes: int, keep: Iterable[str] = ()) -> int:
+    """
+    Delete the least recently written or fetched long-form outputs with their checkpoints
+    until the directory holds at most `max_bytes`. Outputs in `keep`, like those being
+    written, stay. Returns the number of outputs deleted.
+    """
+    keep = set(keep)
+    outputs = []
+    total = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.is_file() and entry.name.endswith(".wav"):
+            stat = entry.stat()
+            total += stat.st_size
+            output_id = entry.name[:-len(".wav")]
+            if output_id not in keep:
+                outputs.append((stat.st_mtime, output_id, stat.st_size))
+    evicted = 0
+    for _, output_id, size in sorted(outputs):
+        if total <= max_bytes:
+            break
+        for name in (f"{output_id}.json", f"{output_id}.wav"):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+        total -= size
+        evicted += 1
+        logger.debug(f"Evicted long-form output {output_id[:12]}")
+    return evicted
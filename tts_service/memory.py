@@ -0,0 +1,201 @@
+import contextlib
+import gc
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CUDA_MEMORY_FRACTION = 0.8
+
+# Share of the memory budget that learned batch limits plan to use
+MEMORY_HEADROOM = 0.9
+
+# Chunks this short aren't split any further after running out of memory
+MIN_SPLIT_CHARS = 20
+
+# How often a chunk is retried in smaller batches or pieces after running out of memory
+MAX_OUT_OF_MEMORY_RETRIES = 4
+
+class MemoryOptions:
+    """
+    How much memory replicas may use.
+
+    `cuda_fraction` caps the share of a GPU's memory the process may allocate. CPU replicas
+    share `cpu_limit_bytes` of resident memory, by default the limit of the container's
+    cgroup, if any. With `simulate_oom_chars` set, batches with more characters raise an
+    out-of-memory error, so the recovery can be exercised without exhausting memory.
+    """
+
+    def __init__(
+        self,
+        cuda_fraction: float = DEFAULT_CUDA_MEMORY_FRACTION,
+        cpu_limit_bytes: Optional[int] = None,
+        simulate_oom_chars: int = 0
+    ):
+        self.cuda_fraction = cuda_fraction
+        self.cpu_limit_bytes = cpu_limit_bytes if cpu_limit_bytes is not None else cgroup_memory_limit()
+        self.simulate_oom_chars = simulate_oom_chars
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "cuda_fraction": self.cuda_fraction,
+            "cpu_limit_bytes": self.cpu_limit_bytes,
+            "simulate_oom_chars": self.simulate_oom_chars,
+        }
+
+def memory_budget(device: str, options: MemoryOptions, cpu_replicas: int = 1) -> Optional[int]:
+    """
+    Return the bytes a replica on the device may use, or None if that isn't known. CPU
+    replicas split the CPU limit evenly.
+    """
+    if str(device).startswith("cuda"):
+        if not torch.cuda.is_available():
+            return None
+        return int(torch.cuda.get_device_properties(device).total_memory * options.cuda_fraction)
+    if options.cpu_limit_bytes is None:
+        return None
+    return options.cpu_limit_bytes // max(1, cpu_replicas)
+
+def cgroup_memory_limit() -> Optional[int]:
+    """
+    Return the memory limit of the process's cgroup in bytes, or None without one.
+    """
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a number close to the largest 64-bit value
+        if value.isdigit() and int(value) < 2**60:
+            return int(value)
+        return None
+    return None
+
+def resident_bytes() -> Optional[int]:
+    """
+    Return the resident memory of the process, or None where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """
+    Tell whether an error means the device ran out of memory. Errors of worker processes
+    arrive as RuntimeErrors with the original message.
+    """
+    if isinstance(error, (MemoryError, torch.cuda.OutOfMemoryError)):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+def free_memory(device: str) -> None:
+    """
+    Release what the failed generation left behind, so the retry starts from the baseline.
+    """
+    gc.collect()
+    if str(device).startswith("cuda") and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def check_simulated_oom(options: Optional[MemoryOptions], chars: int) -> None:
+    if options is not None and 0 < options.simulate_oom_chars < chars:
+        raise torch.cuda.OutOfMemoryError(
+            f"Simulated out of memory: batch of {chars} characters exceeds {options.simulate_oom_chars}"
+        )
+
+class MemoryUsage:
+    """
+    Measures the baseline and peak memory of generations on a device: allocated memory on
+    CUDA, resident memory on the CPU.
+    """
+
+    def __init__(self, device: str):
+        self.device = device
+        self.cuda = str(device).startswith("cuda") and torch.cuda.is_available()
+
+    def current(self) -> Optional[int]:
+        if self.cuda:
+            return torch.cuda.memory_allocated(self.device)
+        return resident_bytes()
+
+    @contextlib.contextmanager
+    def measure(self):
+        """
+        Yield a dict that holds the "baseline" and "peak" bytes of the block once it is done.
+        The CPU has no resettable peak, so the resident memory at the end stands in for it.
+        """
+        usage = {"baseline": self.current(), "peak": None}
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        yield usage
+        usage["peak"] = torch.cuda.max_memory_allocated(self.device) if self.cuda else self.current()
+
+class MemoryLimits:
+    """
+    Learned ceilings on the characters of a chunk and the chunks and characters of a
+    batch, so batches that would run out of memory aren't formed again.
+
+    Every generation reports its peak memory above the baseline; the most memory per
+    character seen so far tells how many characters fit into `budget_bytes`. Running out
+    of memory frees the device's caches and lowers the ceilings below the failed batch, or
+    the failed chunk if it ran alone, whether or not peaks can be measured.
+    """
+
+    def __init__(self, device: str, budget_bytes: Optional[int] = None):
+        self.device = device
+        self.budget_bytes = budget_bytes
+        self.bytes_per_char = 0.0
+        self.fitted_batch_chars: Optional[int] = None
+        self.failed_batch_chars: Optional[int] = None
+        self.max_batch_size: Optional[int] = None
+        self.max_chunk_chars: Optional[int] = None
+        self.out_of_memory = 0
+        self.split_chunks = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_batch_chars(self) -> Optional[int]:
+        limits = [limit for limit in (self.fitted_batch_chars, self.failed_batch_chars) if limit is not None]
+        return min(limits) if limits else None
+
+    def observe(self, chars: int, baseline: Optional[int], peak: Optional[int]) -> None:
+        if self.budget_bytes is None or baseline is None or peak is None or chars <= 0:
+            return
+        with self._lock:
+            self.bytes_per_char = max(self.bytes_per_char, max(0, peak - baseline) / chars)
+            if self.bytes_per_char > 0:
+                available = self.budget_bytes * MEMORY_HEADROOM - baseline
+                self.fitted_batch_chars = max(MIN_SPLIT_CHARS, int(available / self.bytes_per_char))
+
+    def record_out_of_memory(self, batch_size: int, batch_chars: int, longest_chars: int) -> None:
+        free_memory(self.device)
+        with self._lock:
+            self.out_of_memory += 1
+            if batch_size > 1:
+                self.max_batch_size = min(self.max_batch_size or batch_size, max(1, batch_size // 2))
+                limit = max(longest_chars, batch_chars // 2)
+            else:
+                limit = max(MIN_SPLIT_CHARS, longest_chars // 2)
+                self.max_chunk_chars = min(self.max_chunk_chars or limit, limit)
+            self.failed_batch_chars = min(self.failed_batch_chars or limit, limit)
+        logger.warning(
+            f"Out of memory in a batch of {batch_size} chunks with {batch_chars} characters, "
+            f"limiting batches to {self.max_batch_chars} characters"
+        )
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "bytes_per_char": round(self.bytes_per_char, 1),
+            "max_batch_size": self.max_batch_size,
+            "max_batch_chars": self.max_batch_chars,
+            "max_chunk_chars": self.max_chunk_chars,
+            "out_of_memory": self.out_of_memory,
+            "split_chunks": self.split_chunks,
+        }
@@ -0,0 +1,258 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import torch
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages timed by the `tts_stage_seconds` histogram
+STAGES = ("parse", "chunking", "conditioning", "t3", "s3gen", "concatenation", "encoding", "waveform")
+
+# Share of requests whose timings are logged as one JSON line
+DEFAULT_TIMING_LOG_SAMPLE_RATE = 0.05
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REAL_TIME_FACTOR_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+CHUNK_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64, 128, 256)
+
+registry = CollectorRegistry()
+
+stage_seconds = Histogram(
+    "tts_stage_seconds", "Seconds spent in each stage of the speech pipeline",
+    ["stage"], buckets=STAGE_BUCKETS, registry=registry
+)
+real_time_factor = Histogram(
+    "tts_real_time_factor", "Seconds of generation per second of generated audio, by job kind",
+    ["kind"], buckets=REAL_TIME_FACTOR_BUCKETS, registry=registry
+)
+chunks_per_request = Histogram(
+    "tts_chunks_per_request", "Number of chunks the text of a request or script line is split into",
+    buckets=CHUNK_BUCKETS, registry=registry
+)
+
+# Observations of a worker process, collected until they're handed to the server process
+_buffer: Optional[List[Tuple[str, float]]] = None
+_buffer_lock = threading.Lock()
+
+# Set in contexts whose stage observations are dropped. Work handed to another thread
+# with a copy of the context, like the vocoding of pipelined chunks, is dropped as well.
+_untimed = contextvars.ContextVar("untimed", default=False)
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if _untimed.get():
+        return
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.append((stage, seconds))
+            return
+    stage_seconds.labels(stage).observe(seconds)
+
+def buffer_stage_observations() -> None:
+    """
+    Collect stage observations instead of recording them, for processes whose metrics
+    are exported by another process.
+    """
+    global _buffer
+    with _buffer_lock:
+        _buffer = []
+
+def drain_stage_observations() -> List[Tuple[str, float]]:
+    """
+    Return and forget the stage observations collected so far.
+    """
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            return []
+        observations, _buffer = _buffer, []
+    return observations
+
+@contextlib.contextmanager
+def untimed():
+    """
+    Drop the stage observations of the current thread within the block, such as those of
+    warm-up generations.
+    """
+    token = _untimed.set(True)
+    try:
+        yield
+    finally:
+        _untimed.reset(token)
+
+@contextlib.contextmanager
+def timed(stage: str):
+    """
+    Record the time spent in the block as a stage observation.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def instrument(owner, name: str, stage: str, device: Optional[str] = None) -> bool:
+    """
+    Time every call of a method of an object as the given stage. On CUDA the calling
+    thread's stream is synchronized, so the time covers the kernels and not only their
+    launch, while other streams keep running.
+
+    Returns False if the object has no such method.
+    """
+    method = getattr(owner, name, None)
+    if method is None:
+        return False
+    synchronize = device is not None and str(device).startswith("cuda")
+
+    @functools.wraps(method)
+    def timed_method(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if synchronize:
+                torch.cuda.current_stream(device).synchronize()
+            observe_stage(stage, time.perf_counter() - start)
+
+    setattr(owner, name, timed_method)
+    return True
+
+class RequestTimings:
+    """
+    Stage timings of a single request, logged as one JSON line for a sample of requests.
+    """
+
+    def __init__(self, kind: str, sample_rate: float = DEFAULT_TIMING_LOG_SAMPLE_RATE):
+        self.kind = kind
+        self.sampled = random.random() < sample_rate
+        self.started_at = time.perf_counter()
+        self.fields: Dict[str, object] = {}
+        self.seconds: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def finish(self, status: str = "ok") -> None:
+        if not self.sampled:
+            return
+        record = {
+            "kind": self.kind,
+            "status": status,
+            **self.fields,
+            "seconds": {name: round(value, 4) for name, value in self.seconds.items()},
+            "total_seconds": round(time.perf_counter() - self.started_at, 4),
+        }
+        logger.info(f"Request timings {json.dumps(record)}")
+
+class ServiceCollector:
+    """
+    Exports values the service keeps elsewhere, read at scrape time from a snapshot.
+
+    The snapshot holds "queue_depth" as {queue: depth}, "jobs" with the counts of "rejected"
+    and "cancelled" jobs, "caches" as {cache: stats} with
+    "hits", "misses" and optionally "size", "pipelines" as {replica: stats} of stage
+    pipelines, "memory" as {replica: stats} of learned memory limits, and "cuda_devices"
+    as a list of devices.
+    """
+
+    def __init__(self, snapshot: Callable[[], Dict]):
+        self.snapshot = snapshot
+
+    def collect(self) -> Iterable:
+        snapshot = self.snapshot()
+
+        queue_depth = GaugeMetricFamily("tts_queue_depth", "Jobs or chunks waiting in each queue", labels=["queue"])
+        for queue, depth in snapshot.get("queue_depth", {}).items():
+            queue_depth.add_metric([queue], depth)
+        yield queue_depth
+
+        jobs = snapshot.get("jobs")
+        if jobs is not None:
+            yield CounterMetricFamily("tts_jobs_rejected", "Jobs turned away because the queue was full", value=jobs["rejected"])
+            yield CounterMetricFamily("tts_jobs_cancelled", "Jobs cancelled by their clients", value=jobs["cancelled"])
+
+        hits = CounterMetricFamily("tts_cache_hits", "Lookups answered by each cache", labels=["cache"])
+        misses = CounterMetricFamily("tts_cache_misses", "Lookups each cache couldn't answer", labels=["cache"])
+        hit_ratio = GaugeMetricFamily("tts_cache_hit_ratio", "Share of lookups answered by each cache", labels=["cache"])
+        entries = GaugeMetricFamily("tts_cache_entries", "Entries held by each cache", labels=["cache"])
+        for cache, stats in snapshot.get("caches", {}).items():
+            lookups = stats["hits"] + stats["misses"]
+            hits.add_metric([cache], stats["hits"])
+            misses.add_metric([cache], stats["misses"])
+            hit_ratio.add_metric([cache], stats["hits"] / lookups if lookups else 0.0)
+            if "size" in stats:
+                entries.add_metric([cache], stats["size"])
+        yield from (hits, misses, hit_ratio, entries)
+
+        pipelines = snapshot.get("pipelines", {})
+        if pipelines:
+            chunks = CounterMetricFamily("tts_pipeline_chunks", "Chunks vocoded by each stage pipeline", labels=["replica"])
+            stage = CounterMetricFamily(
+                "tts_pipeline_stage_seconds", "Seconds spent decoding and vocoding in each stage pipeline", labels=["replica"]
+            )
+            busy = CounterMetricFamily(
+                "tts_pipeline_busy_seconds", "Wall-clock seconds each stage pipeline had chunks in flight", labels=["replica"]
+            )
+            saved = CounterMetricFamily(
+                "tts_pipeline_saved_seconds", "Wall-clock seconds overlapping the stages saved", labels=["replica"]
+            )
+            for replica, stats in pipelines.items():
+                chunks.add_metric([replica], stats["chunks"])
+                stage.add_metric([replica], stats["stage_seconds"])
+                busy.add_metric([replica], stats["busy_seconds"])
+                saved.add_metric([replica], stats["saved_seconds"])
+            yield from (chunks, stage, busy, saved)
+
+        memory = snapshot.get("memory", {})
+        if memory:
+            out_of_memory = CounterMetricFamily(
+                "tts_out_of_memory", "Batches or chunks of each replica that ran out of memory", labels=["replica"]
+            )
+            split = CounterMetricFamily(
+                "tts_split_chunks", "Chunks each replica split into pieces to fit into memory", labels=["replica"]
+            )
+            batch_chars = GaugeMetricFamily(
+                "tts_max_batch_chars", "Characters per batch each replica learned to fit into memory", labels=["replica"]
+            )
+            for replica, stats in memory.items():
+                out_of_memory.add_metric([replica], stats["out_of_memory"])
+                split.add_metric([replica], stats["split_chunks"])
+                if stats["max_batch_chars"] is not None:
+                    batch_chars.add_metric([replica], stats["max_batch_chars"])
+            yield from (out_of_memory, split, batch_chars)
+
+        cuda_devices = snapshot.get("cuda_devices", [])
+        if cuda_devices:
+            allocated = GaugeMetricFamily("tts_cuda_memory_allocated_bytes", "CUDA memory held by tensors", labels=["device"])
+            reserved = GaugeMetricFamily("tts_cuda_memory_reserved_bytes", "CUDA memory reserved by the caching allocator", labels=["device"])
+            peak = GaugeMetricFamily("tts_cuda_memory_peak_allocated_bytes", "Peak CUDA memory held by tensors", labels=["device"])
+            for device in cuda_devices:
+                allocated.add_metric([device], torch.cuda.memory_allocated(device))
+                reserved.add_metric([device], torch.cuda.memory_reserved(device))
+                peak.add_metric([device], torch.cuda.max_memory_allocated(device))
+            yield from (allocated, reserved, peak)
+
+def register_collector(snapshot: Callable[[], Dict]) -> None:
+    registry.register(ServiceCollector(snapshot))
+
+def render() -> Tuple[bytes, str]:
+    """
+    Return the metrics in the Prometheus text format and its content type.
+    """
+    return generate_latest(registry), CONTENT_TYPE_LATEST
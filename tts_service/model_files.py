@@ -0,0 +1,105 @@
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+import torch
+from safetensors.torch import load_file, save_file
+
+logger = logging.getLogger(__name__)
+
+# Model checkpoints that are converted to safetensors, by file stem
+CHECKPOINTS = ("ve", "t3_cfg", "s3gen")
+
+def checkpoint_paths(model_dir: str, name: str):
+    return os.path.join(model_dir, f"{name}.pt"), os.path.join(model_dir, f"{name}.safetensors")
+
+def is_converted_checkpoint(model_dir: str, filename: str) -> bool:
+    """
+    Return whether a file in the model directory is the safetensors copy of a checkpoint.
+    """
+    stem, extension = os.path.splitext(filename)
+    return extension == ".safetensors" and os.path.exists(os.path.join(model_dir, f"{stem}.pt"))
+
+def _state_dict(checkpoint) -> Dict[str, torch.Tensor]:
+    # T3 checkpoints wrap their state dict as {"model": [state_dict]}
+    if "model" in checkpoint.keys():
+        checkpoint = checkpoint["model"][0]
+    # safetensors refuses tensors that share memory, so every tensor gets its own copy
+    return {key: value.detach().to("cpu").clone().contiguous() for key, value in checkpoint.items()}
+
+def convert_checkpoints(model_dir: str) -> List[str]:
+    """
+    Convert the checkpoints of the model directory to safetensors once, so later starts
+    load them memory-mapped instead of unpickling them. Returns the converted names.
+    """
+    converted = []
+    for name in CHECKPOINTS:
+        pt_path, safetensors_path = checkpoint_paths(model_dir, name)
+        if not os.path.exists(pt_path):
+            continue
+        if os.path.exists(safetensors_path) and os.path.getmtime(safetensors_path) >= os.path.getmtime(pt_path):
+            continue
+        start_time = time.time()
+        state = _state_dict(torch.load(pt_path, map_location="cpu", weights_only=True))
+        partial_path = f"{safetensors_path}.{os.getpid()}.partial"
+        save_file(state, partial_path)
+        os.replace(partial_path, safetensors_path)
+        converted.append(name)
+        logger.info(f"Converted {pt_path} to safetensors in {time.time() - start_time:.2f} seconds")
+    return converted
+
+def has_safetensors(model_dir: str) -> bool:
+    return all(os.path.exists(checkpoint_paths(model_dir, name)[1]) for name in CHECKPOINTS)
+
+def _load_module(module, path: str, device: str, strict: bool = True):
+    """
+    Load weights from a safetensors file into a module and move it to the device.
+
+    On the CPU the module takes over the memory-mapped tensors instead of copying them,
+    so its weights are paged in on demand and shared between processes.
+    """
+    state = load_file(path)
+    if device == "cpu":
+        module.load_state_dict(state, strict=strict, assign=True)
+    else:
+        module.load_state_dict(state, strict=strict)
+    return module.to(device).eval()
+
+def load_chatterbox(model_dir: str, device: str):
+    """
+    Load ChatterboxTTS from the safetensors copies of its checkpoints, falling back to
+    `ChatterboxTTS.from_local` if they're missing or the package layout is unknown.
+    """
+    from chatterbox.tts import ChatterboxTTS
+    if not has_safetensors(model_dir):
+        return ChatterboxTTS.from_local(model_dir, torch.device(device))
+    try:
+        from chatterbox.tts import Conditionals
+        from chatterbox.models.t3 import T3
+        from chatterbox.models.s3gen import S3Gen
+        from chatterbox.models.tokenizers import EnTokenizer
+        from chatterbox.models.voice_encoder import VoiceEncoder
+    except ImportError as e:
+        logger.warning(f"Loading checkpoints through ChatterboxTTS.from_local: {str(e)}")
+        return ChatterboxTTS.from_local(model_dir, torch.device(device))
+
+    ve = _load_module(VoiceEncoder(), checkpoint_paths(model_dir, "ve")[1], device)
+    t3 = _load_module(T3(), checkpoint_paths(model_dir, "t3_cfg")[1], device)
+    s3gen = _load_module(S3Gen(), checkpoint_paths(model_dir, "s3gen")[1], device, strict=False)
+    tokenizer = EnTokenizer(os.path.join(model_dir, "tokenizer.json"))
+
+    conds = None
+    builtin_voice = os.path.join(model_dir, "conds.pt")
+    if os.path.exists(builtin_voice):
+        map_location = torch.device("cpu") if device in ("cpu", "mps") else None
+        conds = Conditionals.load(builtin_voice, map_location=map_location).to(device)
+
+    return ChatterboxTTS(t3, s3gen, ve, tokenizer, device, conds=conds)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stdout)
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "data/model"
+    converted = convert_checkpoints(model_dir)
+    print(f"Converted {len(converted)} checkpoints" + (f": {', '.join(converted)}" if converted else ""))
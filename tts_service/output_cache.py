@@ -0,0 +1,187 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_CACHE_DIR = "data/tts_output_cache"
+DEFAULT_OUTPUT_CACHE_MAX_MB = 512
+
+def output_cache_key(
+    text_parts: List[Tuple[str, Dict]],
+    exaggeration: float,
+    temperature: float,
+    voice_hash: Optional[str],
+    seed: int,
+    version: str,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None
+) -> str:
+    """
+    Return the content address of a deterministic generation.
+
+    `text_parts` are the parsed text parts with their marker settings, with the text
+    already normalized, so requests that only differ in whitespace share an entry.
+    """
+    payload = json.dumps({
+        "parts": [[text, settings] for text, settings in text_parts],
+        "exaggeration": round(float(exaggeration), 4),
+        "temperature": round(float(temperature), 4),
+        "voice": voice_hash or "default",
+        "seed": seed,
+        "model_version": version,
+        "format": output_format,
+        "bitrate": bitrate,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class OutputCache:
+    """
+    Disk-backed LRU cache of encoded outputs keyed by content address, capped in bytes.
+
+    Requests for a key that is currently being generated wait for that generation instead
+    of starting their own, see `claim` and `resolve`.
+    """
+
+    # What the cache holds, for log messages
+    description = "Output cache"
+
+    def __init__(self, directory: str = DEFAULT_OUTPUT_CACHE_DIR, max_bytes: int = DEFAULT_OUTPUT_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # File name and size of every entry, least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path_for(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_index(self) -> None:
+        """
+        Rebuild the LRU order from the files on disk, least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".partial"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name.split(".", 1)[0]] = (name, size)
+            self.size_bytes += size
+        self._evict()
+        logger.info(f"{self.description} holds {len(self._entries)} entries ({self.size_bytes / 1024**2:.1f} MB)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            name, _ = self._entries[key]
+            try:
+                with open(self._path_for(name), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self.size_bytes -= self._entries.pop(key)[1]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # The modification time persists the LRU order across restarts
+        try:
+            os.utime(self._path_for(name))
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes, extension: str = "wav") -> None:
+        if len(data) > self.max_bytes:
+            return
+        name = f"{key}.{extension}"
+        path = self._path_for(name)
+        with self._lock:
+            # Write to a sibling file first so readers never see a partial file
+            partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+            with open(partial_path, "wb") as f:
+                f.write(data)
+            os.replace(partial_path, path)
+            self.size_bytes += len(data) - self._entries.get(key, (name, 0))[1]
+            self._entries[key] = (name, len(data))
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.size_bytes > self.max_bytes and self._entries:
+            key, (name, size) = self._entries.popitem(last=False)
+            self.size_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path_for(name))
+            except FileNotFoundError:
+                pass
+            logger.debug(f"Evicted cached output {key[:12]}")
+
+    def claim(self, key: str) -> Tuple[Future, bool]:
+        """
+        Return the future of the generation in flight for a key and whether the caller
+        started it and therefore has to `resolve` it.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            # Running futures can't be cancelled, so one waiter giving up doesn't affect the others
+            future.set_running_or_notify_cancel()
+            self._in_flight[key] = future
+            return future, True
+
+    def resolve(
+        self,
+        key: str,
+        data: Optional[bytes] = None,
+        extension: str = "wav",
+        error: Optional[BaseException] = None
+    ) -> None:
+        """
+        Finish a claimed generation, storing its output and handing it to all waiters.
+        """
+        if error is None:
+            try:
+                self.put(key, data, extension)
+            except OSError as e:
+                logger.warning(f"Could not cache output {key[:12]}: {str(e)}")
+        with self._lock:
+            future = self._in_flight.pop(key)
+        if error is None:
+            future.set_result(data)
+        else:
+            future.set_exception(error)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,383 @@
+import contextlib
+import contextvars
+import inspect
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Speech tokens at or above this id are special tokens S3Gen can't vocode
+SPEECH_VOCAB_SIZE = 6561
+
+# T3 stops decoding after this many speech tokens, as in `ChatterboxTTS.generate`
+MAX_NEW_TOKENS = 1000
+
+class ChatterboxStages:
+    """
+    The two stages of `ChatterboxTTS.generate`, run separately: T3 decodes speech tokens
+    from text and S3Gen vocodes them into a waveform.
+
+    Both take the conditionals as an argument instead of reading `model.conds`, so one
+    chunk can be vocoded while the next is decoded with other conditionals. Sampling
+    settings the installed version of `generate` has are taken from its defaults.
+
+    `T3.inference` decodes a single chunk, so several chunks are decoded together by
+    `decode_speech_tokens_batch`, which runs the same sampling loop over left-padded
+    sequences in one forward pass per token. It's only offered for models whose
+    `inference` runs that loop, and not for the multilingual ones whose alignment analyzer
+    steers each step.
+    """
+
+    def __init__(self, model):
+        from chatterbox.tts import punc_norm
+        from chatterbox.models.s3tokenizer import drop_invalid_tokens
+        from chatterbox.models.t3.modules.cond_enc import T3Cond
+        from transformers.generation.logits_process import MinPLogitsWarper, RepetitionPenaltyLogitsProcessor, TopPLogitsWarper
+
+        self.model = model
+        self._punc_norm = punc_norm
+        self._drop_invalid_tokens = drop_invalid_tokens
+        self._t3_cond = T3Cond
+        generate_parameters = inspect.signature(model.generate).parameters
+        inference_parameters = inspect.signature(model.t3.inference).parameters
+        self.cfg_weight = generate_parameters["cfg_weight"].default if "cfg_weight" in generate_parameters else 0.5
+        self.sampling = {
+            name: generate_parameters[name].default
+            for name in ("repetition_penalty", "min_p", "top_p")
+            if name in generate_parameters and name in inference_parameters
+        }
+        # What the batched decoding samples with, falling back to the defaults of `T3.inference`
+        settings = {
+            name: inference_parameters[name].default
+            for name in ("repetition_penalty", "min_p", "top_p")
+            if name in inference_parameters
+        }
+        settings.update(self.sampling)
+        self._processors = [
+            RepetitionPenaltyLogitsProcessor(penalty=float(settings.get("repetition_penalty", 1.2))),
+            MinPLogitsWarper(min_p=settings.get("min_p", 0.05)),
+            TopPLogitsWarper(top_p=settings.get("top_p", 1.0)),
+        ]
+        if not getattr(model.t3.hp, "is_multilingual", False):
+            self.decode_speech_tokens_batch = self._decode_speech_tokens_batch
+
+    @staticmethod
+    def supports(model) -> bool:
+        return all(hasattr(model, name) for name in ("t3", "s3gen", "tokenizer", "generate"))
+
+    def _conditioning(self, conds, exaggeration: float):
+        t3_cond = conds.t3
+        if exaggeration != t3_cond.emotion_adv[0, 0, 0]:
+            t3_cond = self._t3_cond(
+                speaker_emb=t3_cond.speaker_emb,
+                cond_prompt_speech_tokens=t3_cond.cond_prompt_speech_tokens,
+                emotion_adv=exaggeration * torch.ones(1, 1, 1),
+            ).to(device=self.model.device)
+        return t3_cond
+
+    def _text_tokens(self, text: str) -> torch.Tensor:
+        model = self.model
+        text_tokens = model.tokenizer.text_to_tokens(self._punc_norm(text)).to(model.device)
+        if self.cfg_weight > 0.0:
+            # Classifier-free guidance decodes a conditioned and an unconditioned sequence
+            text_tokens = torch.cat([text_tokens, text_tokens], dim=0)
+        text_tokens = F.pad(text_tokens, (1, 0), value=model.t3.hp.start_text_token)
+        return F.pad(text_tokens, (0, 1), value=model.t3.hp.stop_text_token)
+
+    def _speech_tokens(self, speech_tokens: torch.Tensor) -> torch.Tensor:
+        speech_tokens = self._drop_invalid_tokens(speech_tokens)
+        return speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE].to(self.model.device)
+
+    def decode_speech_tokens(self, text: str, conds, exaggeration: float, temperature: float) -> torch.Tensor:
+        speech_tokens = self.model.t3.inference(
+            t3_cond=self._conditioning(conds, exaggeration),
+            text_tokens=self._text_tokens(text),
+            max_new_tokens=MAX_NEW_TOKENS,
+            temperature=temperature,
+            cfg_weight=self.cfg_weight,
+            **self.sampling
+        )
+        # Only the conditioned sequence is vocoded
+        return self._speech_tokens(speech_tokens[0])
+
+    def _decode_speech_tokens_batch(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        generators: Optional[List[Optional[torch.Generator]]] = None
+    ) -> List[torch.Tensor]:
+        """
+        Decode the speech tokens of chunks that share conditionals in one batch, each
+        sampled with its own temperature and, where given, its own random generator.
+
+        Every chunk contributes its conditioned and, with guidance, unconditioned sequence.
+        Prompts of different lengths are left-padded and masked, with position ids that
+        skip the padding, so each sequence sees the same inputs as when decoded alone.
+        Chunks that reached the stop token are fed stop tokens until the longest is done,
+        and are cut after their first one. A chunk with a generator draws one token from it
+        per step like `T3.inference` draws from the default generator, so it decodes the
+        same tokens as alone after the default generator was seeded like its generator.
+        """
+        generators = generators or [None] * len(texts)
+        if len(texts) == 1 and generators[0] is None:
+            return [self.decode_speech_tokens(texts[0], conds, exaggeration, temperatures[0])]
+        t3 = self.model.t3
+        device = self.model.device
+        hp = t3.hp
+        t3_cond = self._conditioning(conds, exaggeration)
+        guided = self.cfg_weight > 0.0
+        rows = 2 if guided else 1
+
+        with timed("t3"):
+            start = torch.full((rows, 1), hp.start_speech_token, dtype=torch.long, device=device)
+            # As in `T3.inference`, guided decoding feeds the start of speech once more
+            start_embed = t3.speech_emb(start) + t3.speech_pos_emb.get_fixed_embedding(0)
+            prompts = []
+            for text in texts:
+                embeds, _ = t3.prepare_input_embeds(
+                    t3_cond=t3_cond, text_tokens=self._text_tokens(text), speech_tokens=start, cfg_weight=self.cfg_weight
+                )
+                prompts.append(torch.cat([embeds, start_embed], dim=1) if guided else embeds)
+
+            longest = max(prompt.size(1) for prompt in prompts)
+            inputs = prompts[0].new_zeros(len(texts) * rows, longest, prompts[0].size(2))
+            attention_mask = torch.zeros(len(texts) * rows, longest, dtype=torch.long, device=device)
+            for index, prompt in enumerate(prompts):
+                inputs[index * rows:(index + 1) * rows, longest - prompt.size(1):] = prompt
+                attention_mask[index * rows:(index + 1) * rows, longest - prompt.size(1):] = 1
+            position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+            output = t3.tfmr(
+                inputs_embeds=inputs, attention_mask=attention_mask, position_ids=position_ids, use_cache=True
+            )
+            generated = torch.full((len(texts), 1), hp.start_speech_token, dtype=torch.long, device=device)
+            finished = torch.zeros(len(texts), dtype=torch.bool, device=device)
+            temperature = torch.tensor(temperatures, dtype=torch.float32, device=device).unsqueeze(1)
+            unseeded = [index for index, generator in enumerate(generators) if generator is None]
+            predicted = []
+            for step in range(MAX_NEW_TOKENS):
+                logits = t3.speech_head(output.last_hidden_state[:, -1])
+                if guided:
+                    conditioned, unconditioned = logits[0::2], logits[1::2]
+                    logits = conditioned + self.cfg_weight * (conditioned - unconditioned)
+                logits = self._processors[0](generated, logits)
+                # In float32 like the division by a Python float in `T3.inference`
+                logits = (logits.float() / temperature).to(logits.dtype)
+                for processor in self._processors[1:]:
+                    logits = processor(generated, logits)
+                probs = torch.softmax(logits, dim=-1)
+                next_tokens = torch.full_like(generated[:, :1], hp.stop_speech_token)
+                running = [not done for done in finished.tolist()]
+                rows = [index for index in unseeded if running[index]]
+                if rows:
+                    next_tokens[rows] = torch.multinomial(probs[rows], num_samples=1)
+                for index, generator in enumerate(generators):
+                    if generator is not None and running[index]:
+                        next_tokens[index] = torch.multinomial(probs[index:index + 1], num_samples=1, generator=generator)[0]
+                predicted.append(next_tokens)
+                generated = torch.cat([generated, next_tokens], dim=1)
+                finished |= next_tokens.squeeze(1) == hp.stop_speech_token
+                if bool(finished.all()):
+                    break
+
+                embeds = t3.speech_emb(next_tokens) + t3.speech_pos_emb.get_fixed_embedding(step + 1)
+                if guided:
+                    embeds = embeds.repeat_interleave(2, dim=0)
+                attention_mask = F.pad(attention_mask, (0, 1), value=1)
+                position_ids = position_ids[:, -1:] + 1
+                output = t3.tfmr(
+                    inputs_embeds=embeds,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=output.past_key_values,
+                    use_cache=True
+                )
+            predicted = torch.cat(predicted, dim=1)
+        chunk_tokens = []
+        for tokens in predicted:
+            # `drop_invalid_tokens` expects a single stop token, like `T3.inference` returns
+            stops = (tokens == hp.stop_speech_token).nonzero()
+            if len(stops):
+                tokens = tokens[:int(stops[0, 0]) + 1]
+            chunk_tokens.append(self._speech_tokens(tokens))
+        return chunk_tokens
+
+    def vocode(self, speech_tokens: torch.Tensor, conds) -> torch.Tensor:
+        model = self.model
+        wav, _ = model.s3gen.inference(speech_tokens=speech_tokens, ref_dict=conds.gen)
+        wav = wav.squeeze(0).detach().cpu().numpy()
+        if hasattr(model, "watermarker"):
+            wav = model.watermarker.apply_watermark(wav, sample_rate=model.sr)
+        return torch.from_numpy(wav).unsqueeze(0)
+
+def stages_for(model):
+    """
+    Return the separately runnable stages of a model, or None if it has none. Engines
+    may provide `decode_speech_tokens` and `vocode` themselves.
+    """
+    if hasattr(model, "decode_speech_tokens") and hasattr(model, "vocode"):
+        return model
+    if ChatterboxStages.supports(model):
+        try:
+            return ChatterboxStages(model)
+        except ImportError as e:
+            logger.warning(f"Can't run generation stages separately: {str(e)}")
+    return None
+
+class StagePipeline:
+    """
+    Runs generation as two pipelined stages: speech tokens are decoded on the calling
+    thread and vocoded on a worker thread, so decoding of the next chunk overlaps with
+    vocoding of the previous one. On CUDA the vocoder runs on its own stream.
+
+    At most `depth` chunks are between the start of decoding and the end of vocoding,
+    which bounds the memory of decoded tokens waiting for the vocoder.
+    """
+
+    def __init__(self, stages, device: str, depth: int = 2, context: Callable = contextlib.nullcontext):
+        self.stages = stages
+        self.device = device
+        self.depth = max(2, depth)
+        # Autocast and inference mode are per thread, so both stages enter the context
+        self.context = context
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vocoder")
+        self._slots = threading.BoundedSemaphore(self.depth)
+        # The stub engine may claim a CUDA device on hosts without one
+        self._stream = torch.cuda.Stream(device) if str(device).startswith("cuda") and torch.cuda.is_available() else None
+        self._idle = threading.Condition()
+        self._active = 0
+        self._busy_since = 0.0
+        self._busy_stage_seconds = 0.0
+        # Totals of finished busy periods, for reporting how much overlapping saves over
+        # running the stages back to back
+        self.chunks = 0
+        self.stage_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def _begin(self) -> None:
+        with self._idle:
+            if self._active == 0:
+                self._busy_since = time.perf_counter()
+            self._active += 1
+
+    def _end(self, stage_seconds: float, vocoded: int) -> None:
+        with self._idle:
+            self._active -= 1
+            self._busy_stage_seconds += stage_seconds
+            self.chunks += vocoded
+            if self._active == 0:
+                self.stage_seconds += self._busy_stage_seconds
+                self.busy_seconds += time.perf_counter() - self._busy_since
+                self._busy_stage_seconds = 0.0
+                self._idle.notify_all()
+
+    def submit(self, text: str, conds, exaggeration: float, temperature: float) -> Future:
+        """
+        Decode the speech tokens of a chunk and queue them for vocoding. Returns a future
+        resolving to the chunk's audio.
+        """
+        self._slots.acquire()
+        self._begin()
+        start = time.perf_counter()
+        try:
+            with self.context():
+                tokens = self.stages.decode_speech_tokens(text, conds, exaggeration, temperature)
+            event = None
+            if self._stream is not None:
+                event = torch.cuda.Event()
+                event.record()
+        except BaseException:
+            self._slots.release()
+            self._end(time.perf_counter() - start, 0)
+            raise
+        # The vocoder runs in the submitter's context, so it's timed like the decoding
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._vocode, tokens, conds, event, time.perf_counter() - start)
+
+    def _vocode(self, tokens, conds, event, decode_seconds: float) -> torch.Tensor:
+        start = time.perf_counter()
+        try:
+            stream = torch.cuda.stream(self._stream) if self._stream is not None else contextlib.nullcontext()
+            with stream, self.context():
+                if event is not None:
+                    self._stream.wait_event(event)
+                    tokens.record_stream(self._stream)
+                return self.stages.vocode(tokens, conds).float()
+        finally:
+            self._slots.release()
+            self._end(decode_seconds + time.perf_counter() - start, 1)
+
+    def submit_batch(self, texts: List[str], conds, exaggeration: float, temperatures: List[float]) -> List[Future]:
+        """
+        Decode the speech tokens of chunks in one batch, for stages that can, and queue them
+        for vocoding. The batch takes a single slot; its chunks are vocoded one after another.
+        Returns futures resolving to the audio of each chunk.
+        """
+        self._slots.acquire()
+        self._begin()
+        start = time.perf_counter()
+        try:
+            with self.context():
+                tokens = self.stages.decode_speech_tokens_batch(texts, conds, exaggeration, temperatures)
+            event = None
+            if self._stream is not None:
+                event = torch.cuda.Event()
+                event.record()
+        except BaseException:
+            self._slots.release()
+            self._end(time.perf_counter() - start, 0)
+            raise
+        futures = [Future() for _ in texts]
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._vocode_batch, tokens, conds, event, time.perf_counter() - start, futures)
+        return futures
+
+    def _vocode_batch(self, tokens, conds, event, decode_seconds: float, futures: List[Future]) -> None:
+        start = time.perf_counter()
+        vocoded = 0
+        try:
+            stream = torch.cuda.stream(self._stream) if self._stream is not None else contextlib.nullcontext()
+            with stream, self.context():
+                if event is not None:
+                    self._stream.wait_event(event)
+                for chunk_tokens, future in zip(tokens, futures):
+                    future.set_running_or_notify_cancel()
+                    try:
+                        if event is not None:
+                            chunk_tokens.record_stream(self._stream)
+                        future.set_result(self.stages.vocode(chunk_tokens, conds).float())
+                        vocoded += 1
+                    except BaseException as e:
+                        future.set_exception(e)
+        finally:
+            self._slots.release()
+            self._end(decode_seconds + time.perf_counter() - start, vocoded)
+
+    def drain(self) -> None:
+        """
+        Wait until no chunk is in the pipeline.
+        """
+        with self._idle:
+            self._idle.wait_for(lambda: self._active == 0)
+
+    def stats(self) -> Dict[str, float]:
+        with self._idle:
+            return {
+                "depth": self.depth,
+                "chunks": self.chunks,
+                "stage_seconds": self.stage_seconds,
+                "busy_seconds": self.busy_seconds,
+                # Wall-clock time overlapping saved over running both stages back to back
+                "saved_seconds": max(0.0, self.stage_seconds - self.busy_seconds),
+                "speedup": self.stage_seconds / self.busy_seconds if self.busy_seconds else None,
+            }
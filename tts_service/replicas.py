@@ -0,0 +1,895 @@
+import abc
+import contextlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import torch
+
+from batching import BatchScheduler, DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_BATCH_WAIT_MS, check_cancelled
+from conditioning import ConditioningCache, DEFAULT_CONDITIONING_CACHE_SIZE, VoiceSample, prepare_conditionals, use_conditionals
+from conditioning_store import ConditioningStore
+from model_files import load_chatterbox
+from stub_engine import StubOptions, StubTTS
+from cpu_engine import CpuEngineOptions, configure_threads, inference_context, map_checkpoints_to_cpu, optimize_model
+from memory import MemoryLimits, MemoryOptions, MemoryUsage, check_simulated_oom, free_memory, is_out_of_memory, memory_budget
+from metrics import buffer_stage_observations, drain_stage_observations, instrument, observe_stage, untimed
+from pipeline import StagePipeline, stages_for
+from text_processor import split_in_half
+
+logger = logging.getLogger(__name__)
+
+# Number of chunks a replica may have in flight beyond the least busy replica before
+# chunks of its voices are dispatched elsewhere
+DEFAULT_AFFINITY_SLACK = 8
+
+# Text synthesized once per replica before it takes requests
+WARMUP_TEXT = "Warming up the speech model."
+
+# Startup stages of a replica in the order they're reached
+REPLICA_STAGES = ("loading", "weights_loaded", "warming", "warmed", "ready")
+
+class GeneratorLock:
+    """
+    Guards a default random generator that several replicas of a process draw from: the
+    CPU generator, or the generator of a CUDA device.
+
+    Unseeded generations share it. A seeded generation reseeds it, or resumes the state of
+    a generator of its own, and has it to itself until it is done, so its output doesn't
+    depend on what the other replicas generate meanwhile. Waiting seeded generations go
+    before new unseeded ones.
+    """
+
+    def __init__(self, generator: torch.Generator):
+        self.generator = generator
+        self._condition = threading.Condition()
+        self._sharing = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    def acquire_shared(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and not self._waiting)
+            self._sharing += 1
+
+    def release_shared(self) -> None:
+        with self._condition:
+            self._sharing -= 1
+            if not self._sharing:
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextlib.contextmanager
+    def _exclusive_use(self):
+        with self._condition:
+            self._waiting += 1
+            self._condition.wait_for(lambda: not self._exclusive and not self._sharing)
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def seeded(self, seed: int):
+        with self._exclusive_use():
+            self.generator.manual_seed(seed)
+            yield
+
+    @contextlib.contextmanager
+    def resumed(self, state: torch.Tensor):
+        with self._exclusive_use():
+            self.generator.set_state(state)
+            yield
+
+_generator_locks: Dict[str, GeneratorLock] = {}
+_generator_locks_lock = threading.Lock()
+
+def generator_lock(device: str) -> GeneratorLock:
+    """
+    Return the lock of the default random generator a replica on the device draws from.
+    """
+    device = torch.device(device)
+    if device.type == "cuda" and torch.cuda.is_available():
+        index = device.index if device.index is not None else torch.cuda.current_device()
+        name, generator = f"cuda:{index}", torch.cuda.default_generators[index]
+    else:
+        # Including the stub engine simulating CUDA devices, which samples on the CPU
+        name, generator = "cpu", torch.default_generator
+    with _generator_locks_lock:
+        if name not in _generator_locks:
+            _generator_locks[name] = GeneratorLock(generator)
+        return _generator_locks[name]
+
+class ReplicaEngine:
+    """
+    A loaded model together with the conditionals it generates with.
+    """
+
+    def __init__(
+        self,
+        model,
+        store: Optional[ConditioningStore],
+        cache_size: int = DEFAULT_CONDITIONING_CACHE_SIZE,
+        cpu_options: Optional[CpuEngineOptions] = None,
+        pipeline_depth: int = 0,
+        memory_options: Optional[MemoryOptions] = None
+    ):
+        self.model = model
+        self.store = store
+        # Options of models on the CPU, None on other devices
+        self.cpu_options = cpu_options
+        self.memory_options = memory_options
+        self.generator_lock = generator_lock(model.device)
+        # Keep the built-in voice so custom voices never leak into default voice requests
+        self.default_conds = model.conds
+        self.conditioning_cache = ConditioningCache(cache_size, store)
+        # Time the token decoding and vocoding stages of each generation
+        if hasattr(model, "t3") and hasattr(model, "s3gen"):
+            instrument(model.t3, "inference", "t3", model.device)
+            instrument(model.s3gen, "inference", "s3gen", model.device)
+        # The T3 transformer runs once per decoded token, which is where abandoned batches stop
+        if hasattr(model, "t3") and hasattr(model.t3, "tfmr"):
+            model.t3.tfmr.register_forward_pre_hook(lambda module, args: check_cancelled())
+        # Generation stages of the model, if they can run separately, which also lets
+        # batches of chunks be decoded in one pass
+        self.stages = stages_for(model)
+        # Decoding and vocoding of consecutive chunks overlap if the model's stages can run separately
+        self.pipeline: Optional[StagePipeline] = None
+        if pipeline_depth > 0:
+            if self.stages is not None:
+                self.pipeline = StagePipeline(self.stages, str(model.device), pipeline_depth, self._stage_context)
+            else:
+                logger.warning("Pipelined generation isn't supported by the model, generating chunks serially")
+
+    @classmethod
+    def load(
+        cls,
+        model_dir: str,
+        device: str,
+        store: Optional[ConditioningStore],
+        cache_size: int,
+        cpu_options: Optional[CpuEngineOptions] = None,
+        stub_options: Optional[StubOptions] = None,
+        pipeline_depth: int = 0,
+        memory_options: Optional[MemoryOptions] = None
+    ) -> "ReplicaEngine":
+        """
+        Load the model, or the stub engine if `stub_options` are given. The stub's
+        conditionals can't be persisted, so it runs without the conditioning store.
+        """
+        if stub_options is not None:
+            return cls(StubTTS(stub_options, device), None, cache_size, None, pipeline_depth, memory_options)
+        model = load_chatterbox(model_dir, device)
+        if device != "cpu":
+            cpu_options = None
+        elif cpu_options is not None:
+            optimize_model(model, cpu_options)
+        return cls(model, store, cache_size, cpu_options, pipeline_depth, memory_options)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.model.sr
+
+    @property
+    def decodes_batches(self) -> bool:
+        return self.stages is not None and hasattr(self.stages, "decode_speech_tokens_batch")
+
+    def conditionals(self, voice_hash: Optional[str], voice_sample: Optional[VoiceSample], exaggeration: float):
+        """
+        Return the conditionals of a voice, or of the built-in voice without a sample.
+        """
+        if voice_sample is None:
+            return self.default_conds
+        return self.conditioning_cache.get_or_prepare(self.model, voice_hash, voice_sample, exaggeration)
+
+    @contextlib.contextmanager
+    def _stage_context(self):
+        # What `ChatterboxTTS.generate` enters itself, for stages called from outside it
+        with inference_context(self.cpu_options), torch.inference_mode():
+            yield
+
+    def submit(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        seeds: List[Optional[int]]
+    ) -> List:
+        """
+        Start generating speech for chunks that share conditioning and exaggeration and
+        return their audio tensors, or futures resolving to them while chunks are still vocoded.
+
+        Chunks go through the stage pipeline if there is one, with their speech tokens
+        decoded in one batch if the stages support it. Seeded chunks are generated without
+        it after the pipeline drained, since both stages draw from the random generator and
+        overlapping them would make the output depend on timing.
+        """
+        check_simulated_oom(self.memory_options, sum(len(text) for text in texts))
+        if self.pipeline is None or any(seed is not None for seed in seeds):
+            if self.pipeline is not None:
+                self.pipeline.drain()
+            return self._generate_serially(texts, conds, exaggeration, temperatures, seeds)
+        # Pipelined chunks share the random generator until their vocoding is done
+        self.generator_lock.acquire_shared()
+        try:
+            if len(texts) > 1 and self.decodes_batches:
+                results = self.pipeline.submit_batch(texts, conds, exaggeration, temperatures)
+            else:
+                results = []
+                for text, temperature in zip(texts, temperatures):
+                    # Chunks queued for vocoding already are kept if a later one fails to decode
+                    try:
+                        results.append(self.pipeline.submit(text, conds, exaggeration, temperature))
+                    except Exception as e:
+                        failed = Future()
+                        failed.set_exception(e)
+                        results.append(failed)
+        except BaseException:
+            self.generator_lock.release_shared()
+            raise
+        remaining = [len(results)]
+        remaining_lock = threading.Lock()
+
+        def vocoded(_) -> None:
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self.generator_lock.release_shared()
+
+        for result in results:
+            result.add_done_callback(vocoded)
+        return results
+
+    def generate(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        seeds: List[Optional[int]]
+    ) -> List[torch.Tensor]:
+        """
+        Generate speech for chunks that share conditioning and exaggeration and wait for it.
+        """
+        results = self.submit(texts, conds, exaggeration, temperatures, seeds)
+        return [result.result() if isinstance(result, Future) else result for result in results]
+
+    def _generate_serially(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        seeds: List[Optional[int]]
+    ) -> List[torch.Tensor]:
+        """
+        Engines with a batched forward pass expose `generate_batch`. For ChatterboxTTS, whose
+        `generate` handles a single sequence, the speech tokens of the chunks are decoded in
+        one batch and vocoded one by one; otherwise chunks run back to back with the
+        conditionals set once. Chunks with a seed reseed the random generator right before
+        they are sampled and have it to themselves until they're done; engines with
+        `generate_batch` seed each chunk's sampling themselves.
+        """
+        model = self.model
+        use_conditionals(model, conds)
+        with inference_context(self.cpu_options):
+            if hasattr(model, "generate_batch"):
+                with self.generator_lock.shared():
+                    results = model.generate_batch(texts, exaggeration=exaggeration, temperatures=temperatures, seeds=seeds)
+            elif len(texts) > 1 and self.decodes_batches:
+                results = self._decode_batch(texts, conds, exaggeration, temperatures, seeds)
+            else:
+                results = []
+                for text, temperature, seed in zip(texts, temperatures, seeds):
+                    lock = self.generator_lock.shared() if seed is None else self.generator_lock.seeded(seed)
+                    with lock:
+                        results.append(model.generate(text, exaggeration=exaggeration, temperature=temperature))
+        # Audio generated under bf16 autocast is handed on as float32 like any other
+        return [audio.float() for audio in results]
+
+    def _decode_batch(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        seeds: List[Optional[int]]
+    ) -> List[torch.Tensor]:
+        """
+        Decode the speech tokens of chunks in one batch and vocode them one by one. Seeded
+        chunks sample from a generator of their own and are vocoded with the default
+        generator resumed from where their decoding left it, which draws the same numbers
+        as generating the chunk alone after reseeding the default generator.
+        """
+        device = self.generator_lock.generator.device
+        generators = [torch.Generator(device).manual_seed(seed) if seed is not None else None for seed in seeds]
+        with self._stage_context():
+            with self.generator_lock.shared():
+                tokens = self.stages.decode_speech_tokens_batch(texts, conds, exaggeration, temperatures, generators)
+            results = []
+            for chunk_tokens, generator in zip(tokens, generators):
+                if generator is None:
+                    lock = self.generator_lock.shared()
+                else:
+                    lock = self.generator_lock.resumed(generator.get_state())
+                with lock:
+                    results.append(self.stages.vocode(chunk_tokens, conds))
+        return results
+
+    def warm_up(self) -> None:
+        """
+        Synthesize a short text, so kernels are selected, allocator pools are filled and
+        compiled graphs are built before the first request pays for them.
+        """
+        if self.default_conds is None:
+            logger.warning("Skipping warm-up without a built-in voice")
+            return
+        # Warm-up pays for one-off costs that would skew the stage timings
+        with untimed():
+            self.generate([WARMUP_TEXT], self.default_conds, 0.5, [0.5], [None])
+
+    def precompute(self, voice_hash: str, voice_sample: VoiceSample, exaggeration: float) -> None:
+        """
+        Condition a voice and persist the result in the conditioning store.
+        """
+        conds = prepare_conditionals(self.model, voice_sample, exaggeration)
+        if self.store is not None:
+            self.store.save(voice_hash, conds)
+        self.conditioning_cache.put(voice_hash, exaggeration, conds)
+
+    def discard(self, voice_hash: str) -> None:
+        self.conditioning_cache.discard(voice_hash)
+        if self.store is not None:
+            self.store.discard(voice_hash)
+
+class Replica(abc.ABC):
+    """
+    One copy of the model with its own batch scheduler and conditioning cache.
+    """
+
+    kind = "local"
+
+    def __init__(
+        self,
+        index: int,
+        device: str,
+        cache_size: int = DEFAULT_CONDITIONING_CACHE_SIZE,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_batch_wait_ms: float = DEFAULT_MAX_BATCH_WAIT_MS,
+        cpu_options: Optional[CpuEngineOptions] = None,
+        stub_options: Optional[StubOptions] = None,
+        pipeline_depth: int = 0,
+        memory_options: Optional[MemoryOptions] = None,
+        memory_budget: Optional[int] = None
+    ):
+        self.index = index
+        self.device = device
+        self.cache_size = cache_size
+        self.cpu_options = cpu_options if device == "cpu" else None
+        self.stub_options = stub_options
+        self.pipeline_depth = pipeline_depth
+        self.memory_options = memory_options
+        # Chunk and batch sizes learned to fit into the replica's share of memory
+        self.memory_limits = MemoryLimits(device, memory_budget)
+        self.status = "loading"
+        self.error: Optional[str] = None
+        # Seconds from the start of loading until each startup stage was reached
+        self.stage_seconds: Dict[str, float] = {}
+        self._load_started_at: Optional[float] = None
+        self.sample_rate: Optional[int] = None
+        self.scheduler = BatchScheduler(
+            self.generate_batch, max_batch_size=max_batch_size, max_wait_ms=max_batch_wait_ms,
+            name=f"batch-scheduler-{index}", limits=self.memory_limits, split=split_in_half
+        )
+        self._in_flight_lock = threading.Lock()
+        self.in_flight = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @abc.abstractmethod
+    def load(self, model_dir: str, store: ConditioningStore, warmup: bool = True) -> None:
+        raise NotImplementedError
+
+    def _enter_stage(self, stage: str) -> None:
+        if self._load_started_at is None:
+            self._load_started_at = time.monotonic()
+        self.status = stage
+        if stage in ("weights_loaded", "warmed", "ready"):
+            self.stage_seconds[stage] = time.monotonic() - self._load_started_at
+            logger.info(f"Replica {self.index} reached stage {stage} after {self.stage_seconds[stage]:.2f} seconds")
+
+    def _fail(self, error: str) -> None:
+        logger.error(f"Error loading replica {self.index} on {self.device}: {error}")
+        self.status = "failed"
+        self.error = error
+
+    @abc.abstractmethod
+    def generate_batch(self, texts: List[str], conds, exaggeration: float, temperatures: List[float], seeds: List[Optional[int]]) -> List:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scheduler_conds(self, voice_hash: Optional[str], voice_sample: Optional[VoiceSample], exaggeration: float):
+        """
+        Return what the batch scheduler hands to `generate_batch` as conditionals.
+        """
+        raise NotImplementedError
+
+    def submit(
+        self,
+        text: str,
+        voice_hash: Optional[str],
+        voice_sample: Optional[VoiceSample],
+        exaggeration: float,
+        temperature: float,
+        priority: int,
+        seed: Optional[int] = None,
+        cancelled: Optional[threading.Event] = None
+    ) -> Future:
+        """
+        Queue a chunk on this replica and return a future resolving to its audio tensor.
+        """
+        conds = self.scheduler_conds(voice_hash, voice_sample, exaggeration)
+        future = self.scheduler.submit(
+            text, conds, voice_hash or "default", exaggeration, temperature, priority, seed, cancelled
+        )
+        with self._in_flight_lock:
+            self.in_flight += 1
+        future.add_done_callback(self._chunk_done)
+        return future
+
+    def _chunk_done(self, future: Future) -> None:
+        with self._in_flight_lock:
+            self.in_flight -= 1
+
+    @abc.abstractmethod
+    def precompute(self, voice_hash: str, voice_sample: VoiceSample, exaggeration: float) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def discard(self, voice_hash: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def conditioning_stats(self) -> Optional[Dict[str, float]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def pipeline_stats(self) -> Optional[Dict[str, float]]:
+        raise NotImplementedError
+
+    def health(self) -> Dict[str, object]:
+        return {
+            "replica": self.index,
+            "kind": self.kind,
+            "device": self.device,
+            "status": self.status,
+            "error": self.error,
+            "startup_seconds": dict(self.stage_seconds),
+            "queue_depth": self.scheduler.pending,
+            "in_flight_chunks": self.in_flight,
+            "cpu_engine": self.cpu_options.to_dict() if self.cpu_options is not None else None,
+            "stub_engine": self.stub_options.to_dict() if self.stub_options is not None else None,
+        }
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            **self.health(),
+            "conditioning_cache": self.conditioning_stats(),
+            "batching": self.scheduler.stats(),
+            "pipeline": self.pipeline_stats(),
+            "memory": self.memory_limits.stats(),
+        }
+
+class LocalReplica(Replica):
+    """
+    Replica whose model lives in the server process, on a GPU or the CPU.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.engine: Optional[ReplicaEngine] = None
+        self.memory_usage = MemoryUsage(self.device)
+
+    def load(self, model_dir: str, store: ConditioningStore, warmup: bool = True) -> None:
+        self._enter_stage("loading")
+        try:
+            self.engine = ReplicaEngine.load(
+                model_dir, self.device, store, self.cache_size, self.cpu_options, self.stub_options,
+                self.pipeline_depth, self.memory_options
+            )
+            self.sample_rate = self.engine.sample_rate
+            self._enter_stage("weights_loaded")
+            if warmup:
+                self._enter_stage("warming")
+                self.engine.warm_up()
+                self._enter_stage("warmed")
+        except Exception as e:
+            logger.debug("Replica load failure", exc_info=True)
+            self._fail(str(e))
+            return
+        self.scheduler.start()
+        self._enter_stage("ready")
+
+    def scheduler_conds(self, voice_hash, voice_sample, exaggeration):
+        # Conditioning runs on the submitting thread, so it overlaps with generation
+        return self.engine.conditionals(voice_hash, voice_sample, exaggeration)
+
+    def generate_batch(self, texts, conds, exaggeration, temperatures, seeds):
+        # Pipelined chunks are handed back as futures, so the scheduler can start the next batch;
+        # their peak is that of decoding with the vocoder running alongside
+        with self.memory_usage.measure() as usage:
+            results = self.engine.submit(texts, conds, exaggeration, temperatures, seeds)
+        self.memory_limits.observe(sum(len(text) for text in texts), usage["baseline"], usage["peak"])
+        return results
+
+    def precompute(self, voice_hash, voice_sample, exaggeration):
+        self.engine.precompute(voice_hash, voice_sample, exaggeration)
+
+    def discard(self, voice_hash):
+        if self.engine is not None:
+            self.engine.discard(voice_hash)
+
+    def conditioning_stats(self):
+        return self.engine.conditioning_cache.stats() if self.engine is not None else None
+
+    def pipeline_stats(self):
+        if self.engine is None or self.engine.pipeline is None:
+            return None
+        return self.engine.pipeline.stats()
+
+def worker_report(engine: ReplicaEngine, memory: Optional[Dict[str, int]] = None) -> Dict[str, object]:
+    return {
+        "conditioning_cache": engine.conditioning_cache.stats(),
+        "pipeline": engine.pipeline.stats() if engine.pipeline is not None else None,
+        "stages": drain_stage_observations(),
+        "memory": memory,
+    }
+
+def run_process_replica(
+    connection,
+    model_dir: str,
+    store_dir: str,
+    store_version: str,
+    cache_size: int,
+    cpu_options: CpuEngineOptions,
+    warmup: bool = True,
+    stub_options: Optional[StubOptions] = None,
+    pipeline_depth: int = 0,
+    memory_options: Optional[MemoryOptions] = None
+) -> None:
+    """
+    Entry point of a CPU worker process: load the model, then serve requests from the
+    server process until the connection closes.
+
+    Startup stages are reported as they're reached, ending with "ready". Every reply carries
+    the conditioning cache stats and the stage timings since the previous reply, so the server
+    can report them without waiting for the worker, and generations their memory usage.
+    """
+    buffer_stage_observations()
+    try:
+        configure_threads(cpu_options)
+        store = ConditioningStore(store_dir, store_version)
+        store.load_all()
+        with map_checkpoints_to_cpu():
+            engine = ReplicaEngine.load(
+                model_dir, "cpu", store, cache_size, cpu_options, stub_options, pipeline_depth, memory_options
+            )
+        connection.send(("weights_loaded", engine.sample_rate, None))
+        if warmup:
+            engine.warm_up()
+            connection.send(("warmed", None, None))
+    except Exception as e:
+        connection.send(("error", str(e), None))
+        return
+    connection.send(("ready", None, None))
+    memory_usage = MemoryUsage("cpu")
+
+    while True:
+        try:
+            command, *args = connection.recv()
+        except (EOFError, OSError):
+            return
+        memory = None
+        try:
+            if command == "generate":
+                texts, voice_hash, voice_sample, exaggeration, temperatures, seeds = args
+                conds = engine.conditionals(voice_hash, voice_sample, exaggeration)
+                with memory_usage.measure() as usage:
+                    audio = engine.generate(texts, conds, exaggeration, temperatures, seeds)
+                memory = {"chars": sum(len(text) for text in texts), **usage}
+                # Plain arrays travel through the pipe without torch's shared memory handling
+                result = [tensor.detach().to("cpu").numpy() for tensor in audio]
+            elif command == "precompute":
+                engine.precompute(*args)
+                result = None
+            elif command == "discard":
+                engine.discard(*args)
+                result = None
+            else:
+                raise ValueError(f"Unknown command {command}")
+            connection.send(("ok", result, worker_report(engine, memory)))
+        except Exception as e:
+            if is_out_of_memory(e):
+                # The server process retries with smaller batches or chunks
+                logger.warning(f"Replica process ran out of memory: {str(e)}")
+                free_memory("cpu")
+            else:
+                logger.error(f"Error in replica process command {command}: {str(e)}", exc_info=True)
+            connection.send(("error", str(e), worker_report(engine)))
+
+class ProcessReplica(Replica):
+    """
+    Replica whose model runs on the CPU in a worker process with its own thread budget,
+    so several CPU replicas don't contend for one interpreter.
+
+    Chunks are batched in the server process and each batch is generated by the worker,
+    which conditions voices itself from the sample path or bytes it receives.
+    """
+
+    kind = "process"
+
+    def __init__(self, index: int, threads: int, *args, **kwargs):
+        super().__init__(index, "cpu", *args, **kwargs)
+        self.threads = threads
+        # The worker sizes its intra-op pool to its share of the cores
+        options = self.cpu_options or CpuEngineOptions()
+        self.cpu_options = CpuEngineOptions(
+            options.quantize, options.bf16, threads, options.inter_op_threads, options.compile
+        )
+        self._process = None
+        self._connection = None
+        self._connection_lock = threading.Lock()
+        self._conditioning_stats: Optional[Dict[str, float]] = None
+        self._pipeline_stats: Optional[Dict[str, float]] = None
+
+    def load(self, model_dir: str, store: ConditioningStore, warmup: bool = True) -> None:
+        self._enter_stage("loading")
+        # Spawned workers start without the server's threads and torch state
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=run_process_replica,
+            args=(
+                child_connection, model_dir, os.path.dirname(store.directory), store.version,
+                self.cache_size, self.cpu_options, warmup, self.stub_options, self.pipeline_depth,
+                self.memory_options
+            ),
+            name=f"tts-replica-{self.index}",
+            daemon=True
+        )
+        self._process.start()
+        child_connection.close()
+        while True:
+            try:
+                status, result, _ = self._connection.recv()
+            except (EOFError, OSError):
+                self._process.join(timeout=5)
+                status, result = "error", f"Worker process exited with code {self._process.exitcode}"
+            if status == "error":
+                self._fail(result)
+                return
+            if status == "ready":
+                break
+            if status == "weights_loaded":
+                self.sample_rate = result
+            self._enter_stage(status)
+            if status == "weights_loaded" and warmup:
+                self._enter_stage("warming")
+        self.scheduler.start()
+        self._enter_stage("ready")
+        logger.info(f"Replica {self.index} runs in worker process {self._process.pid} with {self.threads} threads")
+
+    def _call(self, *message):
+        with self._connection_lock:
+            if self.status == "failed":
+                raise RuntimeError(f"Replica {self.index} failed: {self.error}")
+            try:
+                self._connection.send(message)
+                status, result, report = self._connection.recv()
+            except (EOFError, OSError):
+                self._process.join(timeout=5)
+                self.status = "failed"
+                self.error = f"Worker process exited with code {self._process.exitcode}"
+                logger.error(f"Replica {self.index} failed: {self.error}")
+                raise RuntimeError(f"Replica {self.index} failed: {self.error}")
+        if report is not None:
+            self._conditioning_stats = report["conditioning_cache"]
+            self._pipeline_stats = report["pipeline"]
+            for stage, seconds in report["stages"]:
+                observe_stage(stage, seconds)
+            if report["memory"] is not None:
+                self.memory_limits.observe(report["memory"]["chars"], report["memory"]["baseline"], report["memory"]["peak"])
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def scheduler_conds(self, voice_hash, voice_sample, exaggeration):
+        return (voice_hash, voice_sample)
+
+    def generate_batch(self, texts, conds, exaggeration, temperatures, seeds):
+        voice_hash, voice_sample = conds
+        arrays = self._call("generate", texts, voice_hash, voice_sample, exaggeration, temperatures, seeds)
+        return [torch.from_numpy(array) for array in arrays]
+
+    def precompute(self, voice_hash, voice_sample, exaggeration):
+        self._call("precompute", voice_hash, voice_sample, exaggeration)
+
+    def discard(self, voice_hash):
+        if self.ready:
+            self._call("discard", voice_hash)
+
+    def conditioning_stats(self):
+        return self._conditioning_stats
+
+    def pipeline_stats(self):
+        return self._pipeline_stats
+
+    def health(self):
+        return {**super().health(), "pid": self._process.pid if self._process is not None else None, "threads": self.threads}
+
+def create_replicas(
+    devices: List[str],
+    cpu_processes: int = 0,
+    cpu_threads: int = 0,
+    cache_size: int = DEFAULT_CONDITIONING_CACHE_SIZE,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    max_batch_wait_ms: float = DEFAULT_MAX_BATCH_WAIT_MS,
+    cpu_options: Optional[CpuEngineOptions] = None,
+    stub_options: Optional[StubOptions] = None,
+    pipeline_depth: int = 0,
+    memory_options: Optional[MemoryOptions] = None
+) -> List[Replica]:
+    """
+    Create one replica per device. With `cpu_processes` set, CPU devices are replaced by
+    that many worker processes with `cpu_threads` threads each, or an even share of the
+    CPU cores if not given. CPU replicas run with `cpu_options`, and all replicas run the
+    stub engine instead of the model if `stub_options` are given. With `pipeline_depth`
+    set, replicas overlap decoding and vocoding of that many chunks. Every replica learns
+    how much it can batch within its share of the memory given by `memory_options`.
+    """
+    memory_options = memory_options or MemoryOptions()
+    options = dict(
+        cache_size=cache_size, max_batch_size=max_batch_size, max_batch_wait_ms=max_batch_wait_ms,
+        cpu_options=cpu_options, stub_options=stub_options, pipeline_depth=pipeline_depth,
+        memory_options=memory_options
+    )
+    cpu_replicas = cpu_processes if cpu_processes > 0 and "cpu" in devices else devices.count("cpu")
+    replicas: List[Replica] = []
+    for device in devices:
+        if device == "cpu" and cpu_processes > 0:
+            continue
+        replicas.append(LocalReplica(
+            len(replicas), device, memory_budget=memory_budget(device, memory_options, cpu_replicas), **options
+        ))
+    if cpu_processes > 0 and "cpu" in devices:
+        threads = cpu_threads or max(1, (os.cpu_count() or 1) // cpu_processes)
+        for _ in range(cpu_processes):
+            replicas.append(ProcessReplica(
+                len(replicas), threads, memory_budget=memory_budget("cpu", memory_options, cpu_replicas), **options
+            ))
+    return replicas
+
+class ReplicaPool:
+    """
+    Dispatcher in front of the model replicas.
+
+    Chunks of a custom voice go to the replica the voice hashes to, so its conditionals
+    stay warm in one place, unless that replica is more than `affinity_slack` chunks
+    busier than the least busy one; then the next replica in the voice's order takes
+    them. Rendezvous hashing keeps the voices of healthy replicas in place when another
+    replica fails. Built-in voice chunks go to the least busy replica.
+    """
+
+    def __init__(self, replicas: List[Replica], affinity_slack: int = DEFAULT_AFFINITY_SLACK):
+        self.replicas = replicas
+        self.affinity_slack = max(0, affinity_slack)
+
+    def load(self, model_dir: str, store: ConditioningStore, warmup: bool = True) -> None:
+        """
+        Load and warm up all replicas concurrently and return once each is ready or failed.
+        """
+        threads = [
+            threading.Thread(
+                target=replica.load, args=(model_dir, store, warmup), name=f"replica-loader-{replica.index}", daemon=True
+            )
+            for replica in self.replicas
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    @property
+    def ready(self) -> bool:
+        return any(replica.ready for replica in self.replicas)
+
+    @property
+    def stage(self) -> str:
+        """
+        The startup stage all replicas that haven't failed have reached.
+        """
+        stages = [REPLICA_STAGES.index(replica.status) for replica in self.replicas if replica.status != "failed"]
+        return REPLICA_STAGES[min(stages)] if stages else "failed"
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """
+        Seconds until all replicas that haven't failed reached each startup stage.
+        """
+        replicas = [replica for replica in self.replicas if replica.status != "failed"]
+        result = {}
+        for stage in ("weights_loaded", "warmed", "ready"):
+            if replicas and all(stage in replica.stage_seconds for replica in replicas):
+                result[stage] = max(replica.stage_seconds[stage] for replica in replicas)
+        return result
+
+    @property
+    def sample_rate(self) -> Optional[int]:
+        for replica in self.replicas:
+            if replica.ready:
+                return replica.sample_rate
+        return None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(replica.scheduler.pending for replica in self.replicas)
+
+    def select(self, voice_hash: Optional[str]) -> Replica:
+        replicas = [replica for replica in self.replicas if replica.ready]
+        if not replicas:
+            raise RuntimeError("No model replica is ready")
+        least_busy = min(replica.in_flight for replica in replicas)
+        if voice_hash is None:
+            return min(replicas, key=lambda replica: replica.in_flight)
+        ranked = sorted(replicas, key=lambda replica: zlib.crc32(f"{voice_hash}:{replica.index}".encode()), reverse=True)
+        return next(replica for replica in ranked if replica.in_flight <= least_busy + self.affinity_slack)
+
+    def submit(
+        self,
+        text: str,
+        voice_hash: Optional[str],
+        voice_sample: Optional[VoiceSample],
+        exaggeration: float,
+        temperature: float,
+        priority: int,
+        seed: Optional[int] = None,
+        cancelled: Optional[threading.Event] = None
+    ) -> Future:
+        """
+        Queue a chunk on the replica chosen for its voice. Setting `cancelled` drops the
+        chunk if it hasn't been generated yet.
+        """
+        replica = self.select(voice_hash)
+        return replica.submit(text, voice_hash, voice_sample, exaggeration, temperature, priority, seed, cancelled)
+
+    def precompute(self, voice_hash: str, voice_sample: VoiceSample, exaggeration: float) -> None:
+        self.select(voice_hash).precompute(voice_hash, voice_sample, exaggeration)
+
+    def discard(self, voice_hash: str) -> None:
+        for replica in self.replicas:
+            replica.discard(voice_hash)
+
+    def health(self) -> List[Dict[str, object]]:
+        return [replica.health() for replica in self.replicas]
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [replica.stats() for replica in self.replicas]
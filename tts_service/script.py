@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+import re
+from typing import Dict, List
+
+# Columns of a CSV script; only id and text are required
+SCRIPT_COLUMNS = ("id", "text", "voice", "exaggeration", "temperature", "seed")
+
+def parse_script_file(content: bytes, filename: str) -> List[Dict]:
+    """
+    Parse an uploaded dialogue script into a list of line dicts.
+
+    CSV files need a header row with at least `id` and `text` columns; `.jsonl` and
+    `.ndjson` files hold one JSON object per line. Raises ValueError with the offending
+    line number for malformed input.
+    """
+    text = content.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        lines = []
+        for number, raw_line in enumerate(text.splitlines(), start=1):
+            if not raw_line.strip():
+                continue
+            try:
+                entry = json.loads(raw_line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {number}: invalid JSON ({e.msg})")
+            if not isinstance(entry, dict):
+                raise ValueError(f"Line {number}: expected a JSON object")
+            if "id" in entry:
+                entry["id"] = str(entry["id"])
+            lines.append(entry)
+        return lines
+
+    if filename.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [column for column in ("id", "text") if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV header is missing column(s): {', '.join(missing)}")
+        lines = []
+        for row in reader:
+            # Empty optional cells fall back to the defaults
+            lines.append({
+                column: row[column]
+                for column in SCRIPT_COLUMNS
+                if row.get(column) not in (None, "")
+            })
+        return lines
+
+    raise ValueError("Unsupported script format, upload a .csv, .jsonl or .ndjson file")
+
+def archive_name(line_id: str) -> str:
+    """
+    Return a file name for a line ID that is safe to use inside a zip archive.
+    """
+    return re.sub(r'[^\w.-]', '_', line_id).lstrip('.') or "line"
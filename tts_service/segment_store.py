@@ -0,0 +1,88 @@
+import hashlib
+import io
+import json
+import math
+import zlib
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import torch
+
+from output_cache import OutputCache
+
+DEFAULT_SEGMENT_STORE_DIR = "data/tts_segments"
+DEFAULT_SEGMENT_STORE_MAX_MB = 256
+DEFAULT_CROSSFADE_MS = 10.0
+
+def segment_key(
+    text: str,
+    voice_hash: Optional[str],
+    exaggeration: float,
+    temperature: float,
+    seed: int,
+    version: str
+) -> str:
+    """
+    Return the content address of a sentence synthesized for a request with the given seed.
+    """
+    payload = json.dumps({
+        "text": text,
+        "voice": voice_hash or "default",
+        "exaggeration": round(float(exaggeration), 4),
+        "temperature": round(float(temperature), 4),
+        "seed": seed,
+        "model_version": version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def segment_seed(seed: Optional[int], text: str) -> Optional[int]:
+    """
+    Derive the seed of a segment from the request's seed and the segment's text rather
+    than its position, so inserting a sentence doesn't change the audio of the others.
+    """
+    if seed is None:
+        return None
+    return (seed + zlib.crc32(text.encode())) % 2**32
+
+class SegmentStore(OutputCache):
+    """
+    Disk-backed LRU of the audio of single sentences, so a request that differs from an
+    earlier one in a few sentences only generates those.
+    """
+
+    description = "Segment store"
+
+    def get_audio(self, key: str) -> Optional[torch.Tensor]:
+        data = self.get(key)
+        if data is None:
+            return None
+        return torch.from_numpy(np.load(io.BytesIO(data), allow_pickle=False))
+
+    def put_audio(self, key: str, audio: torch.Tensor) -> None:
+        buffer = io.BytesIO()
+        np.save(buffer, audio.detach().to("cpu", torch.float32).numpy(), allow_pickle=False)
+        self.put(key, buffer.getvalue(), "npy")
+
+def crossfade(parts: Iterable[torch.Tensor], fade_samples: int) -> Iterator[torch.Tensor]:
+    """
+    Yield audio parts joined with equal-power crossfades of up to `fade_samples` at every
+    boundary, hiding clicks where separately generated segments meet. The end of each part
+    is held back until the next one arrives, so parts can be streamed.
+    """
+    held = None
+    for part in parts:
+        if held is None:
+            held = part
+            continue
+        fade = min(fade_samples, held.shape[-1], part.shape[-1])
+        if fade <= 0:
+            yield held
+            held = part
+            continue
+        angle = torch.linspace(0.0, math.pi / 2, fade + 2, dtype=part.dtype)[1:-1]
+        mixed = held[..., -fade:] * torch.cos(angle) + part[..., :fade] * torch.sin(angle)
+        if held.shape[-1] > fade:
+            yield held[..., :-fade]
+        held = torch.cat([mixed, part[..., fade:]], dim=-1)
+    if held is not None:
+        yield held
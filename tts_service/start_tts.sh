@@ -42,7 +42,7 @@ for file in "${!MODEL_FILES[@]}"; do
 done
 
 # Set up CUDA environment if using GPU
-if [ "$TTS_DEVICE" = "cuda" ]; then
+if [ "$TTS_DEVICE" = "cuda" ] || [[ "$TTS_DEVICES" == *cuda* ]]; then
     echo "Setting up CUDA environment..."
     # Check if CUDA is available
     if command -v nvidia-smi &> /dev/null; then
@@ -54,9 +54,11 @@ if [ "$TTS_DEVICE" = "cuda" ]; then
         export LD_LIBRARY_PATH=$CUDA_HOME/lib64:$LD_LIBRARY_PATH
         
         # Set PyTorch environment variables
-        export PYTORCH_CUDA_ALLOC_CONF=max_split_size_mb:512
-        export CUDA_LAUNCH_BLOCKING=1
-        export CUDA_VISIBLE_DEVICES=0
+        # Can be overridden, e.g. with expandable_segments:True to reduce fragmentation
+        export PYTORCH_CUDA_ALLOC_CONF=${PYTORCH_CUDA_ALLOC_CONF:-max_split_size_mb:512}
+        # Kernel launches stay asynchronous, so decoding and vocoding overlap on their streams;
+        # set CUDA_LAUNCH_BLOCKING=1 in the environment to debug CUDA errors
+        # CUDA_VISIBLE_DEVICES is left alone, so TTS_DEVICES can place a replica on every GPU
         
         # Check if CUDA is working
         if python3 -c "import torch; print('CUDA available:', torch.cuda.is_available()); print('CUDA version:', torch.version.cuda)" 2>/dev/null; then
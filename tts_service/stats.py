@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+class RollingStats:
+    """
+    Summary of the most recent observations of a value, such as a latency.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+
+    @staticmethod
+    def _percentile(ordered, fraction: float) -> float:
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            ordered = sorted(self._values)
+            count = self.count
+        if not ordered:
+            return {"count": count, "mean": None, "p50": None, "p95": None, "max": None}
+        return {
+            "count": count,
+            "mean": sum(ordered) / len(ordered),
+            "p50": self._percentile(ordered, 0.5),
+            "p95": self._percentile(ordered, 0.95),
+            "max": ordered[-1],
+        }
+
+class ThroughputMeter:
+    """
+    Rate of events per second over a sliding time window.
+    """
+
+    def __init__(self, window_seconds: float = 60.0):
+        self.window_seconds = window_seconds
+        self._events = deque()
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def record(self, count: int = 1) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._events.append((now, count))
+            self.total += count
+            self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._events and self._events[0][0] < now - self.window_seconds:
+            self._events.popleft()
+
+    def rate(self) -> float:
+        with self._lock:
+            self._trim(time.monotonic())
+            return sum(count for _, count in self._events) / self.window_seconds
@@ -0,0 +1,141 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import torch
+
+from batching import check_cancelled
+
+# Values of TTS_ENGINE
+ENGINES = ("chatterbox", "stub")
+
+# Length of the stub's simulated decoding steps
+STEP_SECONDS = 0.02
+
+@dataclass
+class StubConditionals:
+    voice: str
+    exaggeration: float
+
+class StubOptions:
+    """
+    How the stub engine behaves.
+
+    Every chunk yields `1 / chars_per_second` seconds of audio per character and takes
+    `latency_ms` plus `real_time_factor` times the audio duration to generate. With
+    `batched`, a batch takes as long as its longest chunk, like a batched forward pass
+    would; otherwise chunks run back to back. Conditioning a voice takes `conditioning_ms`.
+    Run as separate stages, `vocoder_share` of the generation time is spent vocoding.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        real_time_factor: float = 0.2,
+        chars_per_second: float = 15.0,
+        conditioning_ms: float = 200.0,
+        sample_rate: int = 24000,
+        batched: bool = False,
+        vocoder_share: float = 0.3
+    ):
+        self.latency_ms = latency_ms
+        self.real_time_factor = real_time_factor
+        self.chars_per_second = chars_per_second
+        self.conditioning_ms = conditioning_ms
+        self.sample_rate = sample_rate
+        self.batched = batched
+        self.vocoder_share = min(1.0, max(0.0, vocoder_share))
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "latency_ms": self.latency_ms,
+            "real_time_factor": self.real_time_factor,
+            "chars_per_second": self.chars_per_second,
+            "conditioning_ms": self.conditioning_ms,
+            "sample_rate": self.sample_rate,
+            "batched": self.batched,
+            "vocoder_share": self.vocoder_share,
+        }
+
+class StubTTS:
+    """
+    Stand-in for ChatterboxTTS with the same `generate`, `prepare_conditionals`, `conds`
+    and `sr` surface, plus `decode_speech_tokens` and `vocode` for pipelined generation,
+    where the "speech tokens" are the duration of the chunk. It sleeps instead of
+    computing, which releases the GIL like GPU work does, and returns a quiet tone with
+    noise, so the service can be load tested without weights or a GPU.
+    """
+
+    def __init__(self, options: StubOptions, device: str = "cpu"):
+        self.options = options
+        self.device = device
+        self.sr = options.sample_rate
+        self.conds = StubConditionals("default", 0.5)
+        if options.batched:
+            self.generate_batch = self._generate_batch
+            self.decode_speech_tokens_batch = self._decode_speech_tokens_batch
+
+    def prepare_conditionals(self, wav_fpath, exaggeration: float = 0.5) -> None:
+        time.sleep(self.options.conditioning_ms / 1000.0)
+        self.conds = StubConditionals(getattr(wav_fpath, "name", None) or "sample", exaggeration)
+
+    @staticmethod
+    def _sleep(seconds: float) -> None:
+        # In steps, so abandoned batches stop between them like decoding does
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            check_cancelled()
+            time.sleep(min(STEP_SECONDS, remaining))
+
+    def _duration(self, text: str) -> float:
+        return max(1, len(text)) / self.options.chars_per_second
+
+    def _audio(self, duration: float, generator: Optional[torch.Generator] = None) -> torch.Tensor:
+        samples = max(1, int(duration * self.sr))
+        t = torch.arange(samples, dtype=torch.float32) / self.sr
+        return (0.1 * torch.sin(2 * math.pi * 220.0 * t) + 0.01 * torch.randn(samples, generator=generator)).unsqueeze(0)
+
+    def generate(self, text: str, exaggeration: float = 0.5, temperature: float = 0.8, **kwargs) -> torch.Tensor:
+        duration = self._duration(text)
+        self._sleep((self.options.latency_ms / 1000.0) + duration * self.options.real_time_factor)
+        return self._audio(duration)
+
+    def decode_speech_tokens(self, text: str, conds, exaggeration: float, temperature: float) -> float:
+        duration = self._duration(text)
+        decode_seconds = duration * self.options.real_time_factor * (1.0 - self.options.vocoder_share)
+        self._sleep((self.options.latency_ms / 1000.0) + decode_seconds)
+        return duration
+
+    def _decode_speech_tokens_batch(
+        self,
+        texts: List[str],
+        conds,
+        exaggeration: float,
+        temperatures: List[float],
+        generators: Optional[List[Optional[torch.Generator]]] = None
+    ) -> List[float]:
+        durations = [self._duration(text) for text in texts]
+        decode_seconds = max(durations) * self.options.real_time_factor * (1.0 - self.options.vocoder_share)
+        self._sleep((self.options.latency_ms / 1000.0) + decode_seconds)
+        return durations
+
+    def vocode(self, duration: float, conds) -> torch.Tensor:
+        self._sleep(duration * self.options.real_time_factor * self.options.vocoder_share)
+        return self._audio(duration)
+
+    def _generate_batch(
+        self,
+        texts: List[str],
+        exaggeration: float = 0.5,
+        temperatures: Optional[List[float]] = None,
+        seeds: Optional[List[Optional[int]]] = None
+    ) -> List[torch.Tensor]:
+        durations = [self._duration(text) for text in texts]
+        self._sleep((self.options.latency_ms / 1000.0) + max(durations) * self.options.real_time_factor)
+        results = []
+        for duration, seed in zip(durations, seeds or [None] * len(texts)):
+            # Seeded chunks draw from a generator of their own, so concurrent replicas can't disturb them
+            generator = torch.Generator().manual_seed(seed) if seed is not None else None
+            results.append(self._audio(duration, generator))
+        return results
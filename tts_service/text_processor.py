@@ -1,146 +1,290 @@
-import re
-import logging
-from typing import List, Tuple, Dict
-
-logger = logging.getLogger(__name__)
-
-# We use word count as a proxy for token count since words are always split into equal or fewer tokens.
-# Since Chatterbox TTS is English-only right now, we can make an informed estimate:
-# - Average English word length is ~5 characters
-# - Common English tokenizers (like BPE) split into 2-4 character subword units
-# - This means English words are typically split into 1-3 tokens each
-# - Using 400 words as our limit ensures we stay under the 1000 token limit
-#   even with the maximum expected token expansion
-# See https://github.com/resemble-ai/chatterbox/blob/master/src/chatterbox/tts.py#L246
-MAX_TOKENS_PER_CHUNK = 400
-
-def sanitize_text(text: str) -> str:
-    """
-    Sanitize text by removing unwanted characters and normalizing whitespace.
-    """
-    if not text or not isinstance(text, str):
-        return ""
-        
-    # Remove control characters except newlines
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
-    
-    # Normalize whitespace (preserve newlines)
-    text = re.sub(r'[ \t]+', ' ', text)
-    
-    # Remove multiple newlines
-    text = re.sub(r'\n\s*\n', '\n', text)
-    
-    # Trim whitespace
-    text = text.strip()
-    
-    return text
-
-def split_into_chunks(text: str, max_tokens: int = MAX_TOKENS_PER_CHUNK) -> List[str]:
-    """
-    Split text into chunks that respect sentence boundaries and token limits.
-    """
-    if not text:
-        return []
-        
-    # First sanitize the text
-    text = sanitize_text(text)
-    
-    # Split into sentences (preserving punctuation)
-    sentences = re.split(r'([.!?]+)\s+', text)
-    
-    # Recombine sentences with their punctuation
-    sentences = [''.join(i) for i in zip(sentences[::2], sentences[1::2] + [''])]
-    
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for sentence in sentences:
-        # Rough estimate of tokens (words + punctuation)
-        sentence_length = len(sentence.split())
-        
-        if current_length + sentence_length > max_tokens:
-            if current_chunk:
-                chunks.append(' '.join(current_chunk))
-                current_chunk = []
-                current_length = 0
-            
-            # If a single sentence is longer than max_tokens, split it
-            if sentence_length > max_tokens:
-                words = sentence.split()
-                for i in range(0, len(words), max_tokens):
-                    chunk = ' '.join(words[i:i + max_tokens])
-                    chunks.append(chunk)
-            else:
-                current_chunk = [sentence]
-                current_length = sentence_length
-        else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
-    
-    # Add the last chunk if it exists
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    
-    return chunks
-
-def parse_text_with_markers(text: str) -> List[Tuple[str, Dict]]:
-    """
-    Parse text containing markers:
-    - <p=N> for pause in milliseconds
-    - <e=N> for exaggeration value
-    - <t=N> for temperature value
-    
-    Returns a list of tuples (text_part, settings_dict).
-    settings_dict contains:
-    - pause_ms: Optional[int] - pause duration in milliseconds
-    - exaggeration: Optional[float] - exaggeration value
-    - temperature: Optional[float] - temperature value
-    """
-    if not text or not isinstance(text, str):
-        logger.warning("Received empty or invalid text input")
-        return []
-        
-    logger.info(f"Parsing text: {text}")
-    
-    # First, find all markers and their positions
-    markers = []
-    for match in re.finditer(r'<(?:p|e|t)=(\d+(?:\.\d+)?)>', text):
-        marker_type = match.group(0)[1]  # Get the type (p, e, or t)
-        value = float(match.group(1))
-        
-        settings = {}
-        if marker_type == 'p':
-            settings['pause_ms'] = int(value)
-        elif marker_type == 'e':
-            settings['exaggeration'] = value
-        elif marker_type == 't':
-            settings['temperature'] = value
-            
-        markers.append((match.start(), match.end(), settings))
-        logger.info(f"Found marker: {marker_type}={value} at position {match.start()}-{match.end()}")
-    
-    # Split text into parts based on marker positions
-    result = []
-    last_pos = 0
-    
-    for start, end, settings in markers:
-        # Add text before marker if it's not empty
-        text_part = text[last_pos:start].strip()
-        if text_part:
-            logger.info(f"Adding text part: '{text_part}'")
-            result.append((text_part, {}))
-        
-        # Add marker settings
-        logger.info(f"Adding marker with settings: {settings}")
-        result.append(('', settings))
-        last_pos = end
-    
-    # Add remaining text if any
-    remaining_text = text[last_pos:].strip()
-    if remaining_text:
-        logger.info(f"Adding remaining text: '{remaining_text}'")
-        result.append((remaining_text, {}))
-    
-    logger.info(f"Final parsed parts: {result}")
+import math
+import re
+import logging
+from typing import List, Tuple, Dict
+
+logger = logging.getLogger(__name__)
+
+# Chunk budgets in text tokens of the model's tokenizer. Chatterbox stops decoding after
+# 1000 speech tokens (40 seconds of audio), which English speech reaches at around 600 text
+# tokens, so chunks stay well below that. Decode cost grows with sequence length, so chunks
+# are balanced around the target instead of being packed up to the maximum.
+# See https://github.com/resemble-ai/chatterbox/blob/master/src/chatterbox/tts.py#L246
+MAX_TOKENS_PER_CHUNK = 400
+TARGET_TOKENS_PER_CHUNK = 250
+
+# Token the Chatterbox tokenizer encodes spaces as
+SPACE_TOKEN = "[SPACE]"
+
+# Characters other than spaces per text token, for estimating token counts without the
+# tokenizer. Its small vocabulary holds single characters and common letter groups.
+ESTIMATED_CHARS_PER_TOKEN = 1.5
+
+_CONTROL_CHARACTERS = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+_HORIZONTAL_WHITESPACE = re.compile(r'[ \t]+')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+# Whitespace after sentence-ending punctuation, optionally followed by closing quotes or brackets
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?\u2026])\s+|(?<=[.!?\u2026]["\'\u201d\u2019)\]])\s+')
+# Whitespace after commas, semicolons, colons and spaced dashes, or right after unspaced dashes
+_CLAUSE_BREAK = re.compile(r'(?<=[,;:])\s+|(?<=\s[-\u2013\u2014])\s+|(?<=\w[\u2013\u2014])(?=\w)')
+_MARKER = re.compile(r'<(p|e|t)=(\d+(?:\.\d+)?)>')
+
+_tokenizer = None
+
+def load_tokenizer(path: str) -> bool:
+    """
+    Count chunk tokens with the model's tokenizer.json from now on.
+
+    Returns False if the tokenizer can't be loaded, in which case token counts stay
+    estimated from character counts.
+    """
+    global _tokenizer
+    try:
+        from tokenizers import Tokenizer
+        _tokenizer = Tokenizer.from_file(path)
+    except Exception as e:
+        logger.warning(f"Could not load tokenizer from {path}, estimating token counts: {str(e)}")
+        return False
+    logger.info(f"Counting chunk tokens with {path}")
+    return True
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the text tokens of a text: one per space and one per
+    ESTIMATED_CHARS_PER_TOKEN other characters.
+    """
+    spaces = text.count(' ')
+    return spaces + math.ceil((len(text) - spaces) / ESTIMATED_CHARS_PER_TOKEN)
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """
+    Count the text tokens the model sees for each text, or estimate them without a tokenizer.
+    """
+    if _tokenizer is None:
+        return [estimate_tokens(text) for text in texts]
+    encodings = _tokenizer.encode_batch([text.replace(' ', SPACE_TOKEN) for text in texts])
+    return [len(encoding.ids) for encoding in encodings]
+
+def sanitize_text(text: str) -> str:
+    """
+    Sanitize text by removing unwanted characters and normalizing whitespace.
+    """
+    if not text or not isinstance(text, str):
+        return ""
+        
+    # Remove control characters except newlines
+    text = _CONTROL_CHARACTERS.sub('', text)
+    
+    # Normalize whitespace (preserve newlines)
+    text = _HORIZONTAL_WHITESPACE.sub(' ', text)
+    
+    # Remove multiple newlines
+    text = _BLANK_LINES.sub('\n', text)
+    
+    # Trim whitespace
+    text = text.strip()
+    
+    return text
+
+def _split_evenly(words: List[str], counts: List[int], max_tokens: int, target_tokens: int) -> List[Tuple[str, int]]:
+    """
+    Split a run of words without any punctuation to break at into equally long pieces near
+    the target length.
+    """
+    total = sum(counts) + len(counts) - 1
+    pieces = max(round(total / target_tokens), -(-total // max_tokens), 1)
+    size = total / pieces
+    result = []
+    start = 0
+    used = 0
+    position = 0
+    for index in range(len(words)):
+        used += counts[index] + (1 if index > start else 0)
+        position += counts[index] + (1 if index > 0 else 0)
+        is_last = index == len(words) - 1
+        # Breaks aim at multiples of the piece size, so rounding doesn't pile up in the last piece
+        if is_last or (position >= size * (len(result) + 1) and len(result) < pieces - 1):
+            result.append((' '.join(words[start:index + 1]), used))
+            start = index + 1
+            used = 0
+    return result
+
+def _split_units(sentence: str, count: int, max_tokens: int, target_tokens: int) -> List[Tuple[str, int]]:
+    """
+    Break a sentence that exceeds the maximum at clause boundaries, and clauses that
+    still exceed it at word boundaries into pieces near the target, into units that fit.
+    """
+    if count <= max_tokens:
+        return [(sentence, count)]
+    clauses = [clause for clause in _CLAUSE_BREAK.split(sentence) if clause]
+    if len(clauses) > 1:
+        units = []
+        for clause, clause_count in zip(clauses, count_tokens(clauses)):
+            units.extend(_split_units(clause, clause_count, max_tokens, target_tokens))
+        return units
+    words = sentence.split()
+    if len(words) == 1:
+        # A single word longer than the maximum can't be split sensibly
+        return [(sentence, count)]
+    return _split_evenly(words, count_tokens(words), max_tokens, target_tokens)
+
+def _balance(counts: List[int], max_tokens: int, target_tokens: int) -> List[int]:
+    """
+    Partition units into consecutive chunks of at most `max_tokens` whose lengths are as
+    close as possible to each other, aiming at `target_tokens`, and return the start of
+    every chunk.
+    """
+    total = sum(counts) + len(counts) - 1
+    chunk_count = max(1, round(total / target_tokens))
+    ideal = total / chunk_count
+
+    # cost[i] is the lowest squared deviation from the ideal length for the first i units
+    cost = [0.0] + [float('inf')] * len(counts)
+    previous = [0] * (len(counts) + 1)
+    for end in range(1, len(counts) + 1):
+        length = -1
+        for start in range(end - 1, -1, -1):
+            length += counts[start] + 1
+            if length > max_tokens and start < end - 1:
+                break
+            candidate = cost[start] + (length - ideal) ** 2
+            if candidate < cost[end]:
+                cost[end] = candidate
+                previous[end] = start
+
+    starts = []
+    end = len(counts)
+    while end > 0:
+        end = previous[end]
+        starts.append(end)
+    return starts[::-1]
+
+def split_into_chunks(
+    text: str,
+    max_tokens: int = MAX_TOKENS_PER_CHUNK,
+    target_tokens: int = TARGET_TOKENS_PER_CHUNK
+) -> List[str]:
+    """
+    Split text into chunks that respect sentence boundaries and token limits.
+
+    Text up to the target length stays in one piece. Longer text is split into sentences,
+    overlong sentences into clauses, and the pieces are grouped into chunks of similar
+    length near the target.
+    """
+    if not text:
+        return []
+        
+    # First sanitize the text
+    text = sanitize_text(text)
+    if not text:
+        return []
+
+    sentences = [sentence for sentence in _SENTENCE_BREAK.split(text) if sentence]
+    sentence_counts = count_tokens(sentences)
+    if sum(sentence_counts) + len(sentences) - 1 <= target_tokens:
+        return [' '.join(sentences)]
+
+    units = []
+    for sentence, count in zip(sentences, sentence_counts):
+        units.extend(_split_units(sentence, count, max_tokens, target_tokens))
+
+    starts = _balance([count for _, count in units], max_tokens, target_tokens)
+    return [
+        ' '.join(unit for unit, _ in units[start:end])
+        for start, end in zip(starts, starts[1:] + [len(units)])
+    ]
+
+def split_into_sentences(
+    text: str,
+    max_tokens: int = MAX_TOKENS_PER_CHUNK,
+    target_tokens: int = TARGET_TOKENS_PER_CHUNK
+) -> List[str]:
+    """
+    Split text into sentences, and sentences that exceed the maximum into clauses, so each
+    can be synthesized and reused on its own.
+    """
+    text = sanitize_text(text) if text else ""
+    if not text:
+        return []
+    sentences = [sentence for sentence in _SENTENCE_BREAK.split(text) if sentence]
+    units = []
+    for sentence, count in zip(sentences, count_tokens(sentences)):
+        units.extend(unit for unit, _ in _split_units(sentence, count, max_tokens, target_tokens))
+    return units
+
+def split_in_half(text: str) -> List[str]:
+    """
+    Split a chunk into two pieces of similar length, at the sentence break nearest to its
+    middle, else a clause break, else a space. Returns the chunk alone if it can't be split.
+    """
+    for pattern in (_SENTENCE_BREAK, _CLAUSE_BREAK, _HORIZONTAL_WHITESPACE):
+        # Breaks near either end would leave one piece about as long as the chunk
+        breaks = [
+            match.span() for match in pattern.finditer(text)
+            if len(text) / 4 <= match.start() <= len(text) * 3 / 4
+        ]
+        if breaks:
+            start, end = min(breaks, key=lambda span: abs(span[0] - len(text) / 2))
+            return [text[:start].strip(), text[end:].strip()]
+    return [text]
+
+def parse_text_with_markers(text: str) -> List[Tuple[str, Dict]]:
+    """
+    Parse text containing markers:
+    - <p=N> for pause in milliseconds
+    - <e=N> for exaggeration value
+    - <t=N> for temperature value
+    
+    Returns a list of tuples (text_part, settings_dict).
+    settings_dict contains:
+    - pause_ms: Optional[int] - pause duration in milliseconds
+    - exaggeration: Optional[float] - exaggeration value
+    - temperature: Optional[float] - temperature value
+    """
+    if not text or not isinstance(text, str):
+        logger.warning("Received empty or invalid text input")
+        return []
+        
+    logger.debug(f"Parsing text: {text}")
+    
+    # First, find all markers and their positions
+    markers = []
+    for match in _MARKER.finditer(text):
+        marker_type = match.group(1)  # Get the type (p, e, or t)
+        value = float(match.group(2))
+        
+        settings = {}
+        if marker_type == 'p':
+            settings['pause_ms'] = int(value)
+        elif marker_type == 'e':
+            settings['exaggeration'] = value
+        elif marker_type == 't':
+            settings['temperature'] = value
+            
+        markers.append((match.start(), match.end(), settings))
+        logger.debug(f"Found marker: {marker_type}={value} at position {match.start()}-{match.end()}")
+    
+    # Split text into parts based on marker positions
+    result = []
+    last_pos = 0
+    
+    for start, end, settings in markers:
+        # Add text before marker if it's not empty
+        text_part = text[last_pos:start].strip()
+        if text_part:
+            logger.debug(f"Adding text part: '{text_part}'")
+            result.append((text_part, {}))
+        
+        # Add marker settings
+        logger.debug(f"Adding marker with settings: {settings}")
+        result.append(('', settings))
+        last_pos = end
+    
+    # Add remaining text if any
+    remaining_text = text[last_pos:].strip()
+    if remaining_text:
+        logger.debug(f"Adding remaining text: '{remaining_text}'")
+        result.append((remaining_text, {}))
+    
+    logger.debug(f"Final parsed parts: {result}")
     return result 
\ No newline at end of file
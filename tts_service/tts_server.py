@@ -2,25 +2,56 @@ import os
 import sys
 import tempfile
 import base64
+import hashlib
 import torch
-import torchaudio as ta
 import re
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional, List, Tuple, Dict
-from chatterbox.tts import ChatterboxTTS
+from pydantic import BaseModel, ValidationError
+from typing import Optional, List, Tuple, Dict, Iterator, AsyncIterator
 import logging
 import time
-from generate_waveform import generate_waveform
+from generate_waveform import DEFAULT_PEAKS_STORE_SIZE, PEAKS_MEDIA_TYPE, PeaksStore, WaveformPeaks, load_peaks
 import uuid
 import signal
 from contextlib import contextmanager
 import threading
 import asyncio
-from text_processor import sanitize_text, split_into_chunks, parse_text_with_markers
+import queue
+from text_processor import MAX_TOKENS_PER_CHUNK, TARGET_TOKENS_PER_CHUNK, load_tokenizer, sanitize_text, split_into_chunks, split_into_sentences, parse_text_with_markers
+from conditioning import DEFAULT_CONDITIONING_CACHE_SIZE, VoiceSample, hash_voice_sample
+from voice_registry import VoiceRegistry, DEFAULT_VOICE_REGISTRY_DIR
+from conditioning_store import ConditioningStore, DEFAULT_CONDITIONING_STORE_DIR, model_version
+from concurrent.futures import ThreadPoolExecutor
+from audio_io import OUTPUT_FORMATS, STREAM_MEDIA_TYPES, check_output_format, pcm16_bytes, streaming_wav_header
+from encoding import AudioEncoder, DEFAULT_ENCODE_WORKERS
+from output_cache import OutputCache, DEFAULT_OUTPUT_CACHE_DIR, DEFAULT_OUTPUT_CACHE_MAX_MB, output_cache_key
+from segment_store import (
+    DEFAULT_CROSSFADE_MS, DEFAULT_SEGMENT_STORE_DIR, DEFAULT_SEGMENT_STORE_MAX_MB, SegmentStore, crossfade, segment_key, segment_seed
+)
+from script import archive_name, parse_script_file
+from longform import DEFAULT_LONGFORM_DIR, DEFAULT_LONGFORM_MAX_MB, DEFAULT_LONGFORM_WINDOW, LongformWriter, evict_longform_outputs
+from collections import deque
+import io
+import json
+import zipfile
+from stats import RollingStats, ThroughputMeter
+from inference_worker import (
+    ANONYMOUS_CLIENT, DEFAULT_CONCURRENCY, DEFAULT_JOB_TTL_SECONDS, DEFAULT_MAX_CLIENT_JOBS, DEFAULT_MAX_QUEUE_SIZE, END_OF_EVENTS,
+    PRIORITIES, InferenceWorker, Job, JobStore, QueueFullError
+)
+from starlette.concurrency import run_in_threadpool
+from batching import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_BATCH_WAIT_MS, GenerationCancelled
+from replicas import DEFAULT_AFFINITY_SLACK, ReplicaPool, create_replicas
+from cpu_engine import CpuEngineOptions, configure_threads
+from stub_engine import ENGINES, StubOptions
+from model_files import convert_checkpoints
+from memory import DEFAULT_CUDA_MEMORY_FRACTION, MemoryOptions
+import metrics
+from metrics import DEFAULT_TIMING_LOG_SAMPLE_RATE, RequestTimings, timed
+from concurrent.futures import CancelledError, Future
 
 # Configure logging
 logging.basicConfig(
@@ -33,21 +64,154 @@ logger = logging.getLogger(__name__)
 # Get device from environment variable, default to cuda
 device_name = os.getenv('TTS_DEVICE', 'cuda')
 
+# Engine generating speech: the Chatterbox model, or a stub with synthetic latency and
+# output for benchmarks without weights or a GPU
+engine_name = os.getenv('TTS_ENGINE', 'chatterbox')
+if engine_name not in ENGINES:
+    raise ValueError(f"Unsupported engine {engine_name}, use one of {', '.join(ENGINES)}")
+
+# Devices to run model replicas on, one replica per entry, e.g. "cuda:0,cuda:1"
+replica_devices = [device.strip() for device in (os.getenv('TTS_DEVICES') or device_name).split(',') if device.strip()]
+# The stub engine only pretends to use its devices
+cuda_devices = sorted(set(device for device in replica_devices if device.startswith('cuda'))) if engine_name != 'stub' else []
+
+# Number of worker processes running CPU replicas instead of the server process, and the
+# torch threads of each; 0 threads shares the cores evenly
+cpu_processes = int(os.getenv('TTS_CPU_PROCESSES', '0'))
+cpu_threads = int(os.getenv('TTS_CPU_THREADS', '0'))
+
+# How CPU replicas run: int8 quantization of the T3 transformer (none or int8), bf16
+# autocast (off, auto or on), torch inter-op threads (0 keeps torch's default) and
+# torch.compile of the T3 transformer (0 or 1)
+cpu_engine_options = CpuEngineOptions(
+    quantize=os.getenv('TTS_CPU_QUANTIZE', 'none'),
+    bf16=os.getenv('TTS_CPU_BF16', 'off'),
+    intra_op_threads=cpu_threads,
+    inter_op_threads=int(os.getenv('TTS_CPU_INTEROP_THREADS', '0')),
+    compile=os.getenv('TTS_CPU_COMPILE', '0') == '1'
+)
+
+# Latency per chunk in ms, seconds of generation per second of audio, audio seconds per
+# text character, conditioning latency in ms, whether chunks are generated as one batch
+# and the share of generation time spent vocoding when running the stub engine
+stub_options = StubOptions(
+    latency_ms=float(os.getenv('TTS_STUB_LATENCY_MS', '50')),
+    real_time_factor=float(os.getenv('TTS_STUB_RTF', '0.2')),
+    chars_per_second=float(os.getenv('TTS_STUB_CHARS_PER_SECOND', '15')),
+    conditioning_ms=float(os.getenv('TTS_STUB_CONDITIONING_MS', '200')),
+    batched=os.getenv('TTS_STUB_BATCHED', '0') == '1',
+    vocoder_share=float(os.getenv('TTS_STUB_VOCODER_SHARE', '0.3'))
+) if engine_name == 'stub' else None
+
+# Share of every GPU's memory the service may allocate, resident memory in MB that CPU
+# replicas share (0 uses the container's cgroup limit, if any), and, for testing the
+# recovery from running out of memory, the most characters a batch may have before it
+# fails as if it had run out of memory (0 never fails)
+memory_options = MemoryOptions(
+    cuda_fraction=float(os.getenv('TTS_CUDA_MEMORY_FRACTION', DEFAULT_CUDA_MEMORY_FRACTION)),
+    cpu_limit_bytes=int(float(os.getenv('TTS_CPU_MEMORY_LIMIT_MB', '0')) * 1024 * 1024) or None,
+    simulate_oom_chars=int(os.getenv('TTS_SIMULATE_OOM_CHARS', '0'))
+)
+
+# Chunks a replica keeps between token decoding and vocoding, so decoding the next chunk
+# overlaps with vocoding the previous one; 0 generates chunks serially, 2 is enough for overlap
+pipeline_depth = int(os.getenv('TTS_PIPELINE_DEPTH', '0'))
+
+# Whether replicas synthesize a short text before they take requests
+warmup = os.getenv('TTS_WARMUP', '1') == '1'
+
+# Chunks a replica may run ahead of the least busy one before its voices spill over
+affinity_slack = int(os.getenv('TTS_AFFINITY_SLACK', DEFAULT_AFFINITY_SLACK))
+
+# Maximum number of prepared voice conditionals kept in memory
+conditioning_cache_size = int(os.getenv('TTS_CONDITIONING_CACHE_SIZE', DEFAULT_CONDITIONING_CACHE_SIZE))
+
+# Directory holding voice samples registered through the /voices endpoints
+voice_registry_dir = os.getenv('TTS_VOICE_REGISTRY_DIR', DEFAULT_VOICE_REGISTRY_DIR)
+
+# Directory of the persistent store of precomputed conditionals
+conditioning_store_dir = os.getenv('TTS_CONDITIONING_STORE_DIR', DEFAULT_CONDITIONING_STORE_DIR)
+
+# Number of voices conditioned in parallel by /voices/precompute
+precompute_workers = int(os.getenv('TTS_PRECOMPUTE_WORKERS', '4'))
+
+# Maximum number of jobs waiting for the inference worker, in total and per client;
+# clients are told by the X-Client-Id header or their address
+max_queue_size = int(os.getenv('TTS_MAX_QUEUE_SIZE', DEFAULT_MAX_QUEUE_SIZE))
+max_client_jobs = int(os.getenv('TTS_MAX_CLIENT_JOBS', DEFAULT_MAX_CLIENT_JOBS))
+
+# How often requests waiting for their job check whether the client is still connected
+disconnect_poll_seconds = float(os.getenv('TTS_DISCONNECT_POLL_MS', '250')) / 1000.0
+
+# Seconds finished jobs stay available through the /jobs endpoints
+job_ttl_seconds = float(os.getenv('TTS_JOB_TTL_SECONDS', DEFAULT_JOB_TTL_SECONDS))
+
+# Number of requests processed at the same time; their chunks are batched together
+request_concurrency = int(os.getenv('TTS_REQUEST_CONCURRENCY', DEFAULT_CONCURRENCY))
+
+# Maximum number of chunks per batch, and how long to wait for more chunks to fill a batch
+max_batch_size = int(os.getenv('TTS_MAX_BATCH_SIZE', DEFAULT_MAX_BATCH_SIZE))
+max_batch_wait_ms = float(os.getenv('TTS_MAX_BATCH_WAIT_MS', DEFAULT_MAX_BATCH_WAIT_MS))
+
+# Number of script lines in flight at once during script synthesis
+script_window = int(os.getenv('TTS_SCRIPT_WINDOW', '16'))
+
+# Text tokens per chunk that long text is balanced around, and the most a chunk may have
+chunk_target_tokens = int(os.getenv('TTS_CHUNK_TARGET_TOKENS', TARGET_TOKENS_PER_CHUNK))
+chunk_max_tokens = int(os.getenv('TTS_CHUNK_MAX_TOKENS', MAX_TOKENS_PER_CHUNK))
+
+# Directory and size cap of the cache of seeded generations; a cap of 0 disables the cache
+output_cache_dir = os.getenv('TTS_OUTPUT_CACHE_DIR', DEFAULT_OUTPUT_CACHE_DIR)
+output_cache_max_mb = float(os.getenv('TTS_OUTPUT_CACHE_MAX_MB', DEFAULT_OUTPUT_CACHE_MAX_MB))
+
+# Directory and size cap of the store of synthesized sentences that incremental requests
+# reuse; a cap of 0 disables reuse
+segment_store_dir = os.getenv('TTS_SEGMENT_STORE_DIR', DEFAULT_SEGMENT_STORE_DIR)
+segment_store_max_mb = float(os.getenv('TTS_SEGMENT_STORE_MAX_MB', DEFAULT_SEGMENT_STORE_MAX_MB))
+
+# Length of the crossfades joining the sentences of incremental requests
+crossfade_ms = float(os.getenv('TTS_CROSSFADE_MS', DEFAULT_CROSSFADE_MS))
+
+# Directory of the WAV files and checkpoints of long-form jobs, its size cap beyond which
+# the least recently used outputs are deleted, and how many chunks of a long-form job are
+# generated ahead of the one being written
+longform_dir = os.getenv('TTS_LONGFORM_DIR', DEFAULT_LONGFORM_DIR)
+longform_max_mb = float(os.getenv('TTS_LONGFORM_MAX_MB', DEFAULT_LONGFORM_MAX_MB))
+longform_window = int(os.getenv('TTS_LONGFORM_WINDOW', DEFAULT_LONGFORM_WINDOW))
+
+# Number of generated outputs whose waveform peaks are kept for the /waveform endpoints
+waveform_store_size = int(os.getenv('TTS_WAVEFORM_STORE_SIZE', DEFAULT_PEAKS_STORE_SIZE))
+
+# Outputs are encoded in memory; above this size in MB they spill over into temporary files
+# in the given directory. 0 keeps every output in memory.
+spill_threshold_bytes = int(float(os.getenv('TTS_SPILL_THRESHOLD_MB', '0')) * 1024 * 1024)
+spill_dir = os.getenv('TTS_SPILL_DIR') or None
+
+# Number of threads encoding outputs
+encode_workers = int(os.getenv('TTS_ENCODE_WORKERS', DEFAULT_ENCODE_WORKERS))
+
+# Share of requests whose stage timings are logged as one JSON line
+timing_log_sample_rate = float(os.getenv('TTS_TIMING_LOG_SAMPLE_RATE', DEFAULT_TIMING_LOG_SAMPLE_RATE))
+
+# Block size for sending spilled outputs
+SPILL_READ_SIZE = 64 * 1024
+
 # Check CUDA availability and memory before starting
-if device_name == 'cuda':
+if cuda_devices:
     try:
         if not torch.cuda.is_available():
             logger.error("CUDA is not available on this system")
             sys.exit(1)
         logger.info(f"CUDA is available. Device count: {torch.cuda.device_count()}")
-        logger.info(f"Current CUDA device: {torch.cuda.current_device()}")
-        logger.info(f"CUDA device name: {torch.cuda.get_device_name()}")
-        logger.info(f"CUDA memory allocated: {torch.cuda.memory_allocated() / 1024**2:.2f} MB")
-        logger.info(f"CUDA memory cached: {torch.cuda.memory_reserved() / 1024**2:.2f} MB")
+        for cuda_device in cuda_devices:
+            logger.info(f"CUDA device {cuda_device} name: {torch.cuda.get_device_name(cuda_device)}")
+            logger.info(f"CUDA memory allocated on {cuda_device}: {torch.cuda.memory_allocated(cuda_device) / 1024**2:.2f} MB")
+            logger.info(f"CUDA memory cached on {cuda_device}: {torch.cuda.memory_reserved(cuda_device) / 1024**2:.2f} MB")
         
         # Set CUDA memory management
         torch.cuda.empty_cache()
-        torch.cuda.set_per_process_memory_fraction(0.8)  # Use 80% of available memory
+        for cuda_device in cuda_devices:
+            torch.cuda.set_per_process_memory_fraction(memory_options.cuda_fraction, cuda_device)
         logger.info("Set CUDA memory management parameters")
         
     except Exception as e:
@@ -62,7 +226,7 @@ def patched_torch_load(*args, **kwargs):
     if 'map_location' not in kwargs:
         kwargs['map_location'] = torch.device(device_name)
     return original_torch_load(*args, **kwargs)
-if device_name != 'cuda':
+if not cuda_devices:
     torch.load = patched_torch_load
 
 app = FastAPI()
@@ -80,79 +244,179 @@ class TTSRequest(BaseModel):
     text: str
     voice: str = "default"
     voice_sample: Optional[str] = None
+    voice_id: Optional[str] = None
     exaggeration: float = 0.5
     temperature: float = 0.5
+    priority: str = "interactive"
+    # Makes generation deterministic and lets /tts serve repeated requests from the output cache
+    seed: Optional[int] = None
+    # Synthesizes sentence by sentence and reuses the sentences of earlier requests with the
+    # same seed that didn't change, instead of the output cache; needs a seed
+    incremental: bool = False
+    # One of OUTPUT_FORMATS; the bitrate in kbps only applies to opus
+    format: str = "wav"
+    bitrate: Optional[int] = None
+
+class TTSStreamRequest(TTSRequest):
+    stream_format: str = "wav"
+
+class TTSJobRequest(TTSRequest):
+    priority: str = "bulk"
+
+# Most takes generated by one request
+MAX_TAKES = 8
+
+class TakesRequest(TTSRequest):
+    takes: int = 3
+    # Seed and temperature of every take; by default take i uses seed + i and the request's temperature
+    seeds: Optional[List[int]] = None
+    temperatures: Optional[List[float]] = None
+    # Includes the waveform peaks of every take in the response
+    peaks: bool = False
+
+class LongformRequest(TTSJobRequest):
+    # Long-form output is appended to a file as 16-bit PCM WAV
+    format: str = "wav16"
+
+class ScriptLine(BaseModel):
+    id: str
+    text: str
+    # "default" or the ID of a registered voice sample
+    voice: str = "default"
+    exaggeration: float = 0.5
+    temperature: float = 0.5
+    seed: Optional[int] = None
+
+# Result formats of script synthesis
+SCRIPT_OUTPUTS = ("ndjson", "zip")
+
+class ScriptRequest(BaseModel):
+    lines: List[ScriptLine]
+    output: str = "ndjson"
+    format: str = "wav"
+    bitrate: Optional[int] = None
+
+class PrecomputeRequest(BaseModel):
+    voice_ids: List[str]
+    exaggeration: float = 0.5
 
 class TTSSettings:
     def __init__(self, exaggeration: float = 0.5, temperature: float = 0.5):
         self.exaggeration = exaggeration
         self.temperature = temperature
 
-# Initialize TTS model
-model = None
+# Initialize TTS model replicas
+replica_pool = ReplicaPool(
+    create_replicas(
+        replica_devices, cpu_processes, cpu_threads, conditioning_cache_size,
+        max_batch_size=max_batch_size, max_batch_wait_ms=max_batch_wait_ms,
+        cpu_options=cpu_engine_options, stub_options=stub_options, pipeline_depth=pipeline_depth,
+        memory_options=memory_options
+    ),
+    affinity_slack
+)
+voice_registry = VoiceRegistry(voice_registry_dir)
+conditioning_store = None
+inference_worker = InferenceWorker(
+    max_queue_size=max_queue_size, concurrency=request_concurrency, max_client_jobs=max_client_jobs
+)
+line_throughput = ThroughputMeter()
+job_store = JobStore(job_ttl_seconds)
+stream_ttfb = RollingStats()
+# Running long-form jobs by output ID
+longform_jobs: Dict[str, Job] = {}
+output_cache = OutputCache(output_cache_dir, int(output_cache_max_mb * 1024 * 1024)) if output_cache_max_mb > 0 else None
+segment_store = SegmentStore(segment_store_dir, int(segment_store_max_mb * 1024 * 1024)) if segment_store_max_mb > 0 else None
+waveform_store = PeaksStore(waveform_store_size)
+audio_encoder = AudioEncoder(encode_workers)
+precompute_pool = ThreadPoolExecutor(max_workers=precompute_workers, thread_name_prefix="precompute")
 initialization_started = False
 initialization_error = None
 initialization_complete = False
+startup_started_at = None
 
 def load_model():
-    global model, initialization_error, initialization_complete
+    global conditioning_store, initialization_error, initialization_complete
     try:
         logger.info("Starting model initialization...")
         
         # Initialize CUDA first if needed
-        if device_name == 'cuda':
+        if cuda_devices:
             logger.info("Initializing CUDA...")
             if not torch.cuda.is_available():
                 logger.error("CUDA is not available on this system")
                 sys.exit(1)
             logger.info(f"CUDA is available. Device count: {torch.cuda.device_count()}")
-            logger.info(f"Current CUDA device: {torch.cuda.current_device()}")
-            logger.info(f"CUDA device name: {torch.cuda.get_device_name()}")
             
             # Clear CUDA cache before initialization
             try:
                 logger.info("Clearing CUDA cache...")
                 torch.cuda.empty_cache()
                 logger.info("CUDA cache cleared")
-                logger.info(f"CUDA memory before model load: {torch.cuda.memory_allocated() / 1024**2:.2f} MB")
-                logger.info(f"CUDA memory cached: {torch.cuda.memory_reserved() / 1024**2:.2f} MB")
+                for cuda_device in cuda_devices:
+                    logger.info(f"CUDA memory on {cuda_device} before model load: {torch.cuda.memory_allocated(cuda_device) / 1024**2:.2f} MB")
             except Exception as e:
                 logger.error(f"Error clearing CUDA cache: {str(e)}", exc_info=True)
                 raise
             
             # Set memory management for model loading
             logger.info("Setting CUDA memory management parameters...")
-            torch.cuda.empty_cache()
-            torch.cuda.set_per_process_memory_fraction(0.8)
+            for cuda_device in cuda_devices:
+                torch.cuda.set_per_process_memory_fraction(memory_options.cuda_fraction, cuda_device)
             logger.info("CUDA memory management parameters set")
         
-        device = torch.device(device_name)
-        logger.info(f"Using device: {device}")
-        
-        logger.info("Starting ChatterboxTTS model loading...")
+        logger.info(f"Memory options {json.dumps(memory_options.to_dict())}")
+
+        # CPU replicas in the server process share its thread pools
+        if any(replica.kind == "local" and replica.device == "cpu" for replica in replica_pool.replicas):
+            configure_threads(cpu_engine_options)
         
-        # Check if model directory exists
         model_dir = "data/model"
-        if not os.path.exists(model_dir):
-            raise RuntimeError(f"Model directory {model_dir} does not exist. Please run copy_models.sh first.")
+        if stub_options is not None:
+            logger.info(f"Starting stub engine on {len(replica_pool.replicas)} replicas with {json.dumps(stub_options.to_dict())}")
+        else:
+            logger.info(f"Starting ChatterboxTTS model loading on {len(replica_pool.replicas)} replicas...")
+
+            # Check if model directory exists
+            if not os.path.exists(model_dir):
+                raise RuntimeError(f"Model directory {model_dir} does not exist. Please run copy_models.sh first.")
+
+            # Convert checkpoints to safetensors once, so replicas load them memory-mapped
+            start_time = time.time()
+            converted = convert_checkpoints(model_dir)
+            if converted:
+                logger.info(f"Converted {', '.join(converted)} to safetensors in {time.time() - start_time:.2f} seconds")
+
+        # Count chunk tokens the way the model will see them
+        load_tokenizer(os.path.join(model_dir, "tokenizer.json"))
+
+        # Open precomputed conditionals of this model version
+        conditioning_store = ConditioningStore(
+            conditioning_store_dir, model_version(model_dir) if stub_options is None else "stub"
+        )
+        stored_count = conditioning_store.load_all()
+        logger.info(f"Loaded {stored_count} stored conditionals for model version {conditioning_store.version}")
         
-        # Load model from local files
-        device = torch.device(device_name)
-        model = ChatterboxTTS.from_local("data/model", device)
+        # Load model replicas from local files
+        replica_pool.load(model_dir, conditioning_store, warmup)
         
         logger.info("Restoring original torch.load...")
         torch.load = original_torch_load
         logger.info("Original torch.load restored")
         
-        if device_name == 'cuda':
+        for cuda_device in cuda_devices:
             try:
-                logger.info("Checking CUDA memory after model load...")
-                logger.info(f"CUDA memory after model load: {torch.cuda.memory_allocated() / 1024**2:.2f} MB")
-                logger.info(f"CUDA memory cached: {torch.cuda.memory_reserved() / 1024**2:.2f} MB")
+                logger.info(f"CUDA memory on {cuda_device} after model load: {torch.cuda.memory_allocated(cuda_device) / 1024**2:.2f} MB")
+                logger.info(f"CUDA memory cached on {cuda_device}: {torch.cuda.memory_reserved(cuda_device) / 1024**2:.2f} MB")
             except Exception as e:
                 logger.error(f"Error checking CUDA memory after load: {str(e)}", exc_info=True)
         
-        logger.info("TTS model initialization completed successfully")
+        if not replica_pool.ready:
+            raise RuntimeError("; ".join(f"replica {replica.index}: {replica.error}" for replica in replica_pool.replicas))
+        ready_count = sum(replica.ready for replica in replica_pool.replicas)
+        logger.info(f"TTS model initialization completed with {ready_count} of {len(replica_pool.replicas)} replicas ready")
+        stage_seconds = replica_pool.stage_seconds()
+        logger.info("Startup stages: " + ", ".join(f"{stage} after {seconds:.2f} s" for stage, seconds in stage_seconds.items()))
         initialization_complete = True
             
     except Exception as e:
@@ -162,15 +426,20 @@ def load_model():
 
 @app.on_event("startup")
 async def startup_event():
-    global initialization_started
+    global initialization_started, startup_started_at
     logger.info("Starting TTS model initialization...")
     initialization_started = True
+    startup_started_at = time.monotonic()
     
     # Start model loading in a separate thread
     thread = threading.Thread(target=load_model)
     thread.daemon = True
     thread.start()
 
+    # Start the workers that run all speech generation; every replica starts its own
+    # batch scheduler once its model is loaded
+    inference_worker.start()
+
 @app.get("/health")
 async def health_check():
     if initialization_error:
@@ -186,16 +455,30 @@ async def health_check():
     if not initialization_complete:
         return JSONResponse(
             status_code=503,
-            content={"status": "initializing", "message": "TTS model is still initializing"}
+            content={
+                "status": "initializing",
+                "message": "TTS model is still initializing",
+                "stage": replica_pool.stage,
+                "elapsed_seconds": time.monotonic() - startup_started_at,
+                "replicas": replica_pool.health()
+            }
         )
-    if model is None:
+    if not replica_pool.ready:
         return JSONResponse(
             status_code=503,
-            content={"status": "error", "message": "Model failed to initialize"}
+            content={"status": "error", "message": "No model replica is available", "replicas": replica_pool.health()}
         )
+    all_ready = all(replica.ready for replica in replica_pool.replicas)
     return JSONResponse(
         status_code=200,
-        content={"status": "healthy", "message": "TTS model is initialized and ready"}
+        content={
+            "status": "healthy" if all_ready else "degraded",
+            "message": "TTS model is initialized and ready" if all_ready else "Some model replicas are unavailable",
+            "stage": "ready",
+            "startup_seconds": replica_pool.stage_seconds(),
+            "queue_depth": inference_worker.queue_depth,
+            "replicas": replica_pool.health()
+        }
     )
 
 def create_silence(duration_ms: int, sample_rate: int) -> torch.Tensor:
@@ -203,183 +486,1327 @@ def create_silence(duration_ms: int, sample_rate: int) -> torch.Tensor:
     num_samples = int((duration_ms / 1000.0) * sample_rate)
     return torch.zeros(1, num_samples)
 
-@app.post("/tts")
-async def text_to_speech(request: TTSRequest):
-    temp_path = None
-    voice_path = None
-    try:
-        if not model:
-            raise HTTPException(status_code=503, detail="TTS model is still initializing")
+def resolve_voice(request: TTSRequest) -> Tuple[Optional[VoiceSample], Optional[str]]:
+    """
+    Resolve the voice of a request to its sample and hash.
 
-        start_time = time.time()
-        logger.info(f"Received TTS request for text length {len(request.text)} and voice {request.voice}")
-        
-        # Handle custom voice sample
-        if request.voice == "custom" and request.voice_sample:
-            try:
-                # Create a temporary file for the voice sample
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_voice:
-                    # Decode base64 and write to file
-                    voice_data = base64.b64decode(request.voice_sample)
-                    temp_voice.write(voice_data)
-                    voice_path = temp_voice.name
-                    logger.info(f"Created temporary voice file at: {voice_path}")
-            except Exception as e:
-                logger.error(f"Error creating voice sample file: {str(e)}", exc_info=True)
-                raise HTTPException(status_code=400, detail=f"Invalid voice sample: {str(e)}")
-        
-        # Create a temporary file for output
+    Returns (voice_sample, voice_hash); the sample is the path of a registered sample or
+    the decoded bytes of an inline one. Both are None for the built-in voice.
+    """
+    # Handle registered voice sample
+    if request.voice_id:
+        voice_path = voice_registry.path(request.voice_id)
+        if voice_path is None:
+            raise HTTPException(
+                status_code=404,
+                detail={
+                    "status": "voice_not_registered",
+                    "voice_id": request.voice_id,
+                    "message": "Voice is not registered with the TTS service, re-upload the sample via POST /voices"
+                }
+            )
+        return voice_path, request.voice_id
+
+    # Handle inline custom voice sample, which is conditioned straight from memory
+    if request.voice == "custom" and request.voice_sample:
         try:
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-                temp_path = temp_file.name
-                logger.info(f"Created temporary output file at: {temp_path}")
+            voice_data = base64.b64decode(request.voice_sample)
         except Exception as e:
-            logger.error(f"Error creating temporary output file: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail="Failed to create temporary file")
-        
-        # Parse text for markers and split into chunks
-        text_parts = parse_text_with_markers(request.text)
-        
-        if not text_parts:
-            raise HTTPException(status_code=400, detail="No valid text parts found after parsing")
-        
-        # Initialize settings with request defaults
-        current_settings = TTSSettings(
-            exaggeration=request.exaggeration,
-            temperature=request.temperature
+            logger.error(f"Error decoding voice sample: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=400, detail=f"Invalid voice sample: {str(e)}")
+        if not voice_data:
+            raise HTTPException(status_code=400, detail="Invalid voice sample: empty")
+        return voice_data, hash_voice_sample(voice_data)
+
+    return None, None
+
+def plan_chunks(text_parts: List[Tuple[str, Dict]], request: TTSRequest) -> Iterator[Dict]:
+    """
+    Yield the chunks of the parsed text parts as {"text", "exaggeration", "temperature",
+    "seed"} and their pauses as {"pause_ms"}, in playback order.
+    """
+    # Initialize settings with request defaults
+    current_settings = TTSSettings(
+        exaggeration=request.exaggeration,
+        temperature=request.temperature
+    )
+    chunk_index = 0
+
+    for text_part, settings in text_parts:
+        # Update settings if markers are present
+        if 'exaggeration' in settings:
+            current_settings.exaggeration = settings['exaggeration']
+            logger.debug(f"Updated exaggeration to: {current_settings.exaggeration}")
+        if 'temperature' in settings:
+            current_settings.temperature = settings['temperature']
+            logger.debug(f"Updated temperature to: {current_settings.temperature}")
+
+        if text_part and text_part.strip():  # Only generate for non-empty text parts
+            # Split text into chunks if needed
+            with timed("chunking"):
+                chunks = split_into_chunks(text_part, chunk_max_tokens, chunk_target_tokens)
+            logger.debug(f"Split text into {len(chunks)} chunks")
+
+            for chunk in chunks:
+                logger.debug(f"Generating speech for chunk: '{chunk}' with settings: {current_settings.__dict__}")
+                yield {
+                    "text": chunk,
+                    "exaggeration": current_settings.exaggeration,
+                    "temperature": current_settings.temperature,
+                    # Every chunk gets its own seed, so its audio doesn't depend on how it was batched
+                    "seed": request.seed + chunk_index if request.seed is not None else None,
+                }
+                chunk_index += 1
+
+        if 'pause_ms' in settings:  # Add silence for pause markers
+            logger.debug(f"Adding pause of {settings['pause_ms']}ms")
+            yield {"pause_ms": settings['pause_ms']}
+
+def submit_chunk(
+    chunk: Dict,
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str],
+    cancelled: Optional[threading.Event] = None
+) -> Future:
+    """
+    Hand a chunk planned by `plan_chunks` to the batch scheduler.
+    """
+    return replica_pool.submit(
+        chunk["text"],
+        voice_hash,
+        voice_sample,
+        chunk["exaggeration"],
+        chunk["temperature"],
+        PRIORITIES[request.priority],
+        chunk["seed"],
+        cancelled
+    )
+
+def submit_chunks(
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str],
+    cancelled: Optional[threading.Event] = None
+) -> List:
+    """
+    Hand every chunk of the parsed text parts to the batch scheduler.
+
+    Returns the chunks' futures and the pauses' silence tensors in playback order. All
+    chunks are submitted upfront, so they can share batches with each other and with
+    chunks of concurrent requests. Chunks not generated yet are dropped once `cancelled` is set.
+    """
+    # Futures of submitted chunks and silence tensors, in playback order
+    pending = []
+    chunk_count = 0
+    for chunk in plan_chunks(text_parts, request):
+        if "pause_ms" in chunk:
+            pending.append(create_silence(chunk["pause_ms"], replica_pool.sample_rate))
+            continue
+        pending.append(submit_chunk(chunk, request, voice_sample, voice_hash, cancelled))
+        chunk_count += 1
+
+    metrics.chunks_per_request.observe(chunk_count)
+    return pending
+
+def submit_segments(
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str],
+    job: Optional[Job] = None
+) -> Tuple[List, List[Optional[str]]]:
+    """
+    Like `submit_chunks`, but sentence by sentence, taking sentences from the segment store
+    where an earlier request synthesized them with the same voice, settings and seed. The
+    request must have a seed.
+
+    Returns the stored tensors, futures of generated sentences and silence tensors in
+    playback order, and for each entry the key to store its audio under, or None if it's
+    stored already or not a sentence. The counts of sentences reused from the store,
+    regenerated, and repeated within the request go to the job's progress.
+    """
+    current_settings = TTSSettings(
+        exaggeration=request.exaggeration,
+        temperature=request.temperature
+    )
+    priority = PRIORITIES[request.priority]
+    pending = []
+    keys = []
+    # Stored audio or future of every sentence so far, so repetitions within the request
+    # are looked up and generated once
+    sentence_audio = {}
+    reused = 0
+    regenerated = 0
+    repeated = 0
+
+    for text_part, settings in text_parts:
+        if 'exaggeration' in settings:
+            current_settings.exaggeration = settings['exaggeration']
+        if 'temperature' in settings:
+            current_settings.temperature = settings['temperature']
+
+        if text_part and text_part.strip():
+            with timed("chunking"):
+                sentences = split_into_sentences(text_part, chunk_max_tokens, chunk_target_tokens)
+            for sentence in sentences:
+                key = segment_key(
+                    sentence, voice_hash, current_settings.exaggeration, current_settings.temperature,
+                    request.seed, conditioning_store.version
+                )
+                if key in sentence_audio:
+                    repeated += 1
+                    pending.append(sentence_audio[key])
+                    keys.append(None)
+                    continue
+                audio = segment_store.get_audio(key) if segment_store is not None else None
+                if audio is not None:
+                    reused += 1
+                    sentence_audio[key] = audio
+                    pending.append(audio)
+                    keys.append(None)
+                    continue
+                regenerated += 1
+                sentence_audio[key] = replica_pool.submit(
+                    sentence,
+                    voice_hash,
+                    voice_sample,
+                    current_settings.exaggeration,
+                    current_settings.temperature,
+                    priority,
+                    segment_seed(request.seed, sentence),
+                    job.cancelled if job is not None else None
+                )
+                pending.append(sentence_audio[key])
+                keys.append(key)
+
+        if 'pause_ms' in settings:
+            pending.append(create_silence(settings['pause_ms'], replica_pool.sample_rate))
+            keys.append(None)
+
+    logger.debug(f"Reusing {reused} sentences, generating {regenerated} and repeating {repeated}")
+    metrics.chunks_per_request.observe(regenerated)
+    if job is not None:
+        job.progress = {
+            "total": reused + regenerated + repeated,
+            "reused": reused,
+            "regenerated": regenerated,
+            "repeated": repeated,
+        }
+    return pending, keys
+
+def collect_segments(
+    pending: List,
+    keys: List[Optional[str]],
+    cancelled: Optional[threading.Event] = None
+) -> Iterator[torch.Tensor]:
+    """
+    Yield the audio of submitted sentences and pauses like `collect_audio`, storing newly
+    generated sentences in the segment store.
+    """
+    audio_parts = collect_audio(pending, cancelled)
+    try:
+        for audio, key in zip(audio_parts, keys):
+            if key is not None and segment_store is not None:
+                try:
+                    segment_store.put_audio(key, audio)
+                except OSError as e:
+                    logger.warning(f"Could not store segment {key[:12]}: {str(e)}")
+            yield audio
+    finally:
+        audio_parts.close()
+
+def collect_audio(pending: List, cancelled: Optional[threading.Event] = None) -> Iterator[torch.Tensor]:
+    """
+    Yield the audio of submitted chunks and pauses in playback order as it becomes available.
+    Raises `GenerationCancelled` between chunks once `cancelled` is set.
+    """
+    try:
+        for entry in pending:
+            if cancelled is not None and cancelled.is_set():
+                raise GenerationCancelled("Request was cancelled")
+            try:
+                audio = entry.result() if isinstance(entry, Future) else entry
+            except CancelledError:
+                # Chunks are only cancelled together with their request
+                raise GenerationCancelled("Request was cancelled")
+            yield audio
+    finally:
+        # Chunks that haven't started are dropped if the caller stops early or fails
+        for entry in pending:
+            if isinstance(entry, Future):
+                entry.cancel()
+
+def synthesize(
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str],
+    job: Optional[Job] = None
+) -> Iterator[torch.Tensor]:
+    """
+    Generate speech for parsed text parts, yielding each chunk's audio and each pause's
+    silence as soon as it is available.
+
+    Incremental requests are synthesized sentence by sentence, joined with crossfades, so
+    stored and newly generated sentences meet without clicks.
+    """
+    cancelled = job.cancelled if job is not None else None
+    if request.incremental:
+        pending, keys = submit_segments(text_parts, request, voice_sample, voice_hash, job)
+        return crossfade(
+            collect_segments(pending, keys, cancelled), int(crossfade_ms / 1000.0 * replica_pool.sample_rate)
         )
-        
-        # Generate speech for each part and collect audio tensors
-        audio_parts = []
-        for text_part, settings in text_parts:
-            # Update settings if markers are present
-            if 'exaggeration' in settings:
-                current_settings.exaggeration = settings['exaggeration']
-                logger.info(f"Updated exaggeration to: {current_settings.exaggeration}")
-            if 'temperature' in settings:
-                current_settings.temperature = settings['temperature']
-                logger.info(f"Updated temperature to: {current_settings.temperature}")
-            
-            if text_part and text_part.strip():  # Only generate for non-empty text parts
-                # Split text into chunks if needed
-                chunks = split_into_chunks(text_part)
-                logger.info(f"Split text into {len(chunks)} chunks")
-                
-                for chunk in chunks:
-                    logger.info(f"Generating speech for chunk: '{chunk}' with settings: {current_settings.__dict__}")
-                    wav = model.generate(
-                        chunk,
-                        audio_prompt_path=voice_path,
-                        exaggeration=current_settings.exaggeration,
-                        temperature=current_settings.temperature
-                    )
-                    audio_parts.append(wav)
-            
-            if 'pause_ms' in settings:  # Add silence for pause markers
-                logger.info(f"Adding pause of {settings['pause_ms']}ms")
-                silence = create_silence(settings['pause_ms'], model.sr)
-                audio_parts.append(silence)
-        
-        # Concatenate all audio parts
-        if audio_parts:
-            final_audio = torch.cat(audio_parts, dim=1)
-        else:
+    return collect_audio(submit_chunks(text_parts, request, voice_sample, voice_hash, cancelled), cancelled)
+
+def observe_real_time_factor(kind: str, seconds: float, samples: int) -> None:
+    if samples > 0:
+        metrics.real_time_factor.labels(kind).observe(seconds / (samples / replica_pool.sample_rate))
+
+def concatenate(audio_parts: List[torch.Tensor]) -> torch.Tensor:
+    with timed("concatenation"):
+        return torch.cat(audio_parts, dim=1)
+
+def generate_speech(
+    job: Job,
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str]
+) -> torch.Tensor:
+    """Inference job: generate speech for the whole text and return it as one tensor."""
+    start_time = time.perf_counter()
+    # Generate speech for each part and collect audio tensors
+    audio_parts = list(synthesize(text_parts, request, voice_sample, voice_hash, job))
+    line_throughput.record()
+
+    # Concatenate all audio parts
+    if not audio_parts:
+        raise HTTPException(status_code=400, detail="No audio parts were generated")
+    audio = concatenate(audio_parts)
+    observe_real_time_factor(job.kind, time.perf_counter() - start_time, audio.shape[-1])
+    return audio
+
+def stream_speech(
+    job: Job,
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str]
+) -> None:
+    """Inference job: emit each chunk's audio as soon as it is generated."""
+    start_time = time.perf_counter()
+    samples = 0
+    for audio in synthesize(text_parts, request, voice_sample, voice_hash, job):
+        job.emit(audio)
+        samples += audio.shape[-1]
+    line_throughput.record()
+    observe_real_time_factor(job.kind, time.perf_counter() - start_time, samples)
+
+def take_requests(request: TakesRequest) -> List[TTSRequest]:
+    """
+    Return a request per take with the take's seed and temperature.
+    """
+    if not 1 <= request.takes <= MAX_TAKES:
+        raise HTTPException(status_code=400, detail=f"Number of takes must be between 1 and {MAX_TAKES}")
+    for name, values in (("seeds", request.seeds), ("temperatures", request.temperatures)):
+        if values is not None and len(values) != request.takes:
+            raise HTTPException(status_code=400, detail=f"Expected {request.takes} {name}, got {len(values)}")
+    return [
+        TTSRequest(**{
+            **request.model_dump(exclude={"takes", "seeds", "temperatures", "peaks"}),
+            "seed": request.seeds[index] if request.seeds is not None else (
+                request.seed + index if request.seed is not None else None
+            ),
+            "temperature": request.temperatures[index] if request.temperatures is not None else request.temperature,
+            # Every take is generated anew, which is the point of asking for several
+            "incremental": False,
+        })
+        for index in range(request.takes)
+    ]
+
+def generate_takes(
+    job: Job,
+    text_parts: List[Tuple[str, Dict]],
+    requests: List[TTSRequest],
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str]
+) -> List[torch.Tensor]:
+    """
+    Inference job: generate several takes of the same text and return each as one tensor.
+
+    The chunks of all takes are submitted upfront to the replica holding the voice, so the
+    voice is conditioned once and the takes share batches despite their seeds and temperatures.
+    """
+    start_time = time.perf_counter()
+    pending = [submit_chunks(text_parts, request, voice_sample, voice_hash, job.cancelled) for request in requests]
+    takes = []
+    for take_pending in pending:
+        audio_parts = list(collect_audio(take_pending, job.cancelled))
+        if not audio_parts:
             raise HTTPException(status_code=400, detail="No audio parts were generated")
-        
-        # Save to temporary file
-        ta.save(temp_path, final_audio, model.sr)
-        
-        end_time = time.time()
-        logger.info(f"Speech generation completed in {end_time - start_time:.2f} seconds")
-        
-        # Clean up voice sample temp file if it was created
-        if request.voice == "custom" and request.voice_sample:
-            os.unlink(voice_path)
-        
-        # Return the file using FileResponse
-        logger.info(f"Returning file response for {temp_path}")
-        return FileResponse(
-            temp_path,
-            media_type="audio/wav",
-            filename="generated_speech.wav",
-            background=lambda: asyncio.create_task(cleanup_file(temp_path))
+        takes.append(concatenate(audio_parts))
+        line_throughput.record()
+    observe_real_time_factor(job.kind, time.perf_counter() - start_time, sum(take.shape[-1] for take in takes))
+    return takes
+
+def synthesize_long_form(
+    job: Job,
+    text_parts: List[Tuple[str, Dict]],
+    request: TTSRequest,
+    voice_sample: Optional[VoiceSample],
+    voice_hash: Optional[str],
+    output_id: str
+) -> Dict[str, object]:
+    """
+    Inference job: append the audio of every chunk and pause to a WAV file as soon as it
+    is generated, resuming after the last complete one if an earlier run was interrupted.
+
+    Only a window of chunks is in flight at a time and each chunk's audio is dropped once
+    written, so memory doesn't grow with the length of the text.
+    """
+    start_time = time.perf_counter()
+    plan = list(plan_chunks(text_parts, request))
+    writer = LongformWriter(longform_dir, output_id, replica_pool.sample_rate)
+    completed = writer.open()
+    job.progress = {"total": len(plan), "completed": completed, "resumed_from": completed}
+    # Futures of the chunks in flight and None for pauses, starting at the next entry to write
+    in_flight = deque()
+    next_index = completed
+    samples = 0
+    try:
+        for index in range(completed, len(plan)):
+            while next_index < len(plan) and len(in_flight) < max(1, longform_window):
+                entry = plan[next_index]
+                in_flight.append(
+                    None if "pause_ms" in entry else submit_chunk(entry, request, voice_sample, voice_hash, job.cancelled)
+                )
+                next_index += 1
+            if job.cancelled.is_set():
+                raise GenerationCancelled("Long-form job was cancelled")
+            future = in_flight.popleft()
+            if future is None:
+                audio = create_silence(plan[index]["pause_ms"], replica_pool.sample_rate)
+            else:
+                try:
+                    audio = future.result()
+                except CancelledError:
+                    raise GenerationCancelled("Long-form job was cancelled")
+            writer.append(pcm16_bytes(audio))
+            samples += audio.shape[-1]
+            job.progress["completed"] = index + 1
+        if not writer.done:
+            writer.finish()
+    finally:
+        for future in in_flight:
+            if future is not None:
+                future.cancel()
+        writer.close()
+        # Outputs being written by other jobs stay, like this one
+        evicted = evict_longform_outputs(longform_dir, int(longform_max_mb * 1024 * 1024), {output_id, *longform_jobs})
+        if evicted:
+            logger.info(f"Evicted {evicted} long-form outputs to stay within {longform_max_mb:g} MB")
+    metrics.chunks_per_request.observe(sum("text" in entry for entry in plan))
+    line_throughput.record()
+    observe_real_time_factor(job.kind, time.perf_counter() - start_time, samples)
+    return {"output_id": output_id, "duration_seconds": writer.duration_seconds}
+
+def prepare_speech_job(request: TTSRequest) -> Tuple[List[Tuple[str, Dict]], Optional[VoiceSample], Optional[str]]:
+    """
+    Resolve the voice and markers of a request.
+
+    Returns (text_parts, voice_sample, voice_hash) as taken by the job functions.
+    """
+    if request.priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority {request.priority}, use one of {', '.join(PRIORITIES)}"
+        )
+
+    try:
+        check_output_format(request.format, request.bitrate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Reused sentences are only the same take if they were generated with the same seed
+    if request.incremental and request.seed is None:
+        raise HTTPException(status_code=400, detail="Incremental requests need a seed")
+
+    voice_sample, voice_hash = resolve_voice(request)
+
+    # Parse text for markers
+    with timed("parse"):
+        text_parts = parse_text_with_markers(request.text)
+    if not text_parts:
+        raise HTTPException(status_code=400, detail="No valid text parts found after parsing")
+    return text_parts, voice_sample, voice_hash
+
+def client_id(http_request: Optional[Request]) -> str:
+    """
+    Identify the client of a request for fair queueing: by the X-Client-Id header, which
+    proxies like the web app set, or else by address.
+    """
+    if http_request is None:
+        return ANONYMOUS_CLIENT
+    if http_request.headers.get("X-Client-Id"):
+        return http_request.headers["X-Client-Id"]
+    return http_request.client.host if http_request.client is not None else ANONYMOUS_CLIENT
+
+def queue_full_error(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def queue_speech_job(fn, request: TTSRequest, prepared: Tuple, kind: str = "tts", client: str = ANONYMOUS_CLIENT) -> Job:
+    """
+    Queue the inference job of a request prepared by `prepare_speech_job`.
+    """
+    text_parts, voice_sample, voice_hash = prepared
+    try:
+        return inference_worker.submit(
+            fn, text_parts, request, voice_sample, voice_hash,
+            priority=PRIORITIES[request.priority], kind=kind, client=client
         )
+    except QueueFullError as e:
+        raise queue_full_error(e)
+
+def submit_speech_job(fn, request: TTSRequest, kind: str = "tts", client: str = ANONYMOUS_CLIENT) -> Job:
+    """
+    Resolve the voice and markers of a request and queue its inference job.
+    """
+    return queue_speech_job(fn, request, prepare_speech_job(request), kind, client)
+
+async def wait_for_job(job: Job, http_request: Request):
+    """
+    Wait for the result of a job, cancelling it if the client disconnects in the meantime,
+    so its remaining chunks aren't generated for nobody.
+    """
+    result = asyncio.wrap_future(job.future)
+    while True:
+        done, _ = await asyncio.wait({result}, timeout=disconnect_poll_seconds)
+        if done:
+            return result.result()
+        if await http_request.is_disconnected():
+            logger.info(f"Client disconnected, cancelling job {job.id}")
+            inference_worker.cancel(job)
+            # Nobody reads the response, the status only shows in the access log
+            raise HTTPException(status_code=499, detail="Client disconnected")
+
+async def job_events(job: Job, http_request: Optional[Request] = None) -> AsyncIterator:
+    """
+    Yield the partial results of a job without blocking the event loop. The job is
+    cancelled if the client disconnects while waiting for the next result, or if the
+    consumer stops early, like a streaming response failing to send.
+    """
+    try:
+        while True:
+            try:
+                event = await run_in_threadpool(job.events.get, timeout=disconnect_poll_seconds)
+            except queue.Empty:
+                if http_request is not None and await http_request.is_disconnected():
+                    logger.info(f"Client disconnected, cancelling job {job.id}")
+                    return
+                continue
+            if event is END_OF_EVENTS:
+                return
+            yield event
+    finally:
+        inference_worker.cancel(job)
+
+def speech_cache_key(request: TTSRequest, text_parts: List[Tuple[str, Dict]], voice_hash: Optional[str]) -> str:
+    """
+    Return the output cache key of a seeded request.
+    """
+    return output_cache_key(
+        [(sanitize_text(text_part), settings) for text_part, settings in text_parts],
+        request.exaggeration,
+        request.temperature,
+        voice_hash,
+        request.seed,
+        conditioning_store.version,
+        request.format,
+        request.bitrate
+    )
+
+def store_output(key: str, request: TTSRequest, job_future: Future) -> None:
+    """
+    Encode the result of a seeded generation into the output cache and hand it to all
+    requests waiting for it.
+    """
+    extension = OUTPUT_FORMATS[request.format].extension
+
+    def resolve(encode_future: Future) -> None:
+        if encode_future.exception() is not None:
+            output_cache.resolve(key, error=encode_future.exception())
+        else:
+            output_cache.resolve(key, encode_future.result(), extension)
+
+    if job_future.exception() is not None:
+        output_cache.resolve(key, error=job_future.exception())
+        return
+    audio_encoder.submit(job_future.result(), replica_pool.sample_rate, request.format, request.bitrate).add_done_callback(resolve)
+
+async def cached_speech_response(request: TTSRequest, client: str = ANONYMOUS_CLIENT) -> Response:
+    """
+    Serve a seeded request from the output cache. On a miss the speech is generated once,
+    even if identical requests arrive while it is in flight. The generation isn't cancelled
+    when its client disconnects, since others may wait for it and it ends up in the cache.
+    """
+    prepared = prepare_speech_job(request)
+    text_parts, _, voice_hash = prepared
+    key = speech_cache_key(request, text_parts, voice_hash)
+
+    data = output_cache.get(key)
+    cache_status = "hit"
+    job = None
+    if data is None:
+        future, started = output_cache.claim(key)
+        if started:
+            cache_status = "miss"
+            try:
+                job = queue_speech_job(generate_speech, request, prepared, client=client)
+            except Exception as e:
+                output_cache.resolve(key, error=e)
+                raise
+            job.future.add_done_callback(lambda job_future: store_output(key, request, job_future))
+        else:
+            cache_status = "coalesced"
+        data = await asyncio.wrap_future(future)
+
+    logger.debug(f"Output cache {cache_status} for {key[:12]}")
+    # Peaks of freshly generated speech come from its samples; only stored output is decoded
+    if job is not None:
+        peaks = await run_in_threadpool(audio_peaks, job.future.result())
+    else:
+        peaks = await run_in_threadpool(encoded_peaks, data)
+    waveform_id = waveform_store.add(peaks)
+    return Response(
+        content=data,
+        media_type=OUTPUT_FORMATS[request.format].media_type,
+        headers={
+            **speech_headers(request.format),
+            "X-Cache": cache_status,
+            "X-Waveform-Id": waveform_id
+        }
+    )
+
+def audio_peaks(audio: torch.Tensor) -> WaveformPeaks:
+    """Compute waveform peaks straight from generated audio."""
+    with timed("waveform"):
+        return WaveformPeaks.from_audio(audio.detach().to("cpu", torch.float32).numpy(), replica_pool.sample_rate)
+
+def encoded_peaks(data: bytes) -> WaveformPeaks:
+    """Compute waveform peaks of encoded audio, such as cached outputs."""
+    with timed("waveform"):
+        return load_peaks(io.BytesIO(data))
+
+def speech_headers(output_format: str) -> Dict[str, str]:
+    return {"Content-Disposition": f'attachment; filename="generated_speech.{OUTPUT_FORMATS[output_format].extension}"'}
+
+async def audio_response(
+    audio: torch.Tensor,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    Encode audio on the encoder pool and return it from memory.
+
+    With spill-over configured, outputs larger than the threshold are spooled to an
+    anonymous temporary file that disappears as soon as it is closed.
+    """
+    media_type = OUTPUT_FORMATS[output_format].media_type
+    headers = {**speech_headers(output_format), **(headers or {})}
+    if spill_threshold_bytes <= 0:
+        data = await asyncio.wrap_future(audio_encoder.submit(audio, replica_pool.sample_rate, output_format, bitrate))
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=spill_threshold_bytes, dir=spill_dir)
+    try:
+        await asyncio.wrap_future(audio_encoder.submit(audio, replica_pool.sample_rate, output_format, bitrate, target=buffer))
+        buffer.seek(0)
+    except Exception:
+        buffer.close()
+        raise
+
+    def read_buffer() -> Iterator[bytes]:
+        with buffer:
+            while block := buffer.read(SPILL_READ_SIZE):
+                yield block
+
+    return StreamingResponse(read_buffer(), media_type=media_type, headers=headers)
+
+@app.post("/tts")
+async def text_to_speech(request: TTSRequest, http_request: Request):
+    try:
+        if not replica_pool.ready:
+            raise HTTPException(status_code=503, detail="TTS model is still initializing")
+
+        timings = RequestTimings("tts", timing_log_sample_rate)
+        timings.set(text_length=len(request.text), voice=request.voice, format=request.format)
+        logger.debug(f"Received TTS request for text length {len(request.text)} and voice {request.voice}")
+
+        if request.seed is not None and output_cache is not None and not request.incremental:
+            with timings.measure("cached_response"):
+                response = await cached_speech_response(request, client_id(http_request))
+            timings.set(cache=response.headers["X-Cache"])
+            timings.finish()
+            return response
+
+        # Generation runs on the inference worker, so the event loop stays responsive
+        with timings.measure("generation"):
+            job = submit_speech_job(generate_speech, request, client=client_id(http_request))
+            final_audio = await wait_for_job(job, http_request)
+        timings.set(audio_seconds=round(final_audio.shape[-1] / replica_pool.sample_rate, 3))
+
+        # Keep the peaks, so the waveform can be fetched without uploading the audio again
+        with timings.measure("waveform"):
+            waveform_id = waveform_store.add(await run_in_threadpool(audio_peaks, final_audio))
+        headers = {"X-Waveform-Id": waveform_id}
+        if request.incremental:
+            headers["X-Segments-Reused"] = str(job.progress["reused"])
+            headers["X-Segments-Regenerated"] = str(job.progress["regenerated"])
+            headers["X-Segments-Repeated"] = str(job.progress["repeated"])
+            timings.set(
+                segments_reused=job.progress["reused"],
+                segments_regenerated=job.progress["regenerated"],
+                segments_repeated=job.progress["repeated"]
+            )
+        with timings.measure("encoding"):
+            response = await audio_response(final_audio, request.format, request.bitrate, headers=headers)
+        timings.finish()
+        return response
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Unexpected error in text_to_speech: {str(e)}", exc_info=True)
-        # Clean up temp files if they exist
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except Exception as cleanup_error:
-                logger.error(f"Error cleaning up temp_path: {str(cleanup_error)}", exc_info=True)
-        if voice_path and os.path.exists(voice_path):
-            try:
-                os.unlink(voice_path)
-            except Exception as cleanup_error:
-                logger.error(f"Error cleaning up voice_path: {str(cleanup_error)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
-async def cleanup_file(file_path: str):
-    """Helper function to safely clean up temporary files with proper error handling."""
+@app.post("/tts/takes")
+async def text_to_speech_takes(request: TakesRequest, http_request: Request):
+    """
+    Generate several takes of a line in one request and return them together as JSON,
+    each encoded in the requested format and base64-encoded, optionally with its peaks.
+    """
+    if not replica_pool.ready:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+
+    requests = take_requests(request)
+    text_parts, voice_sample, voice_hash = prepare_speech_job(request)
     try:
-        if os.path.exists(file_path):
-            logger.info(f"Attempting to clean up temporary file: {file_path}")
+        job = inference_worker.submit(
+            generate_takes, text_parts, requests, voice_sample, voice_hash,
+            priority=PRIORITIES[request.priority], kind="takes", client=client_id(http_request)
+        )
+    except QueueFullError as e:
+        raise queue_full_error(e)
+    takes = await wait_for_job(job, http_request)
+
+    encoded = [audio_encoder.submit(audio, replica_pool.sample_rate, request.format, request.bitrate) for audio in takes]
+    results = []
+    for index, (take_request, audio, data) in enumerate(zip(requests, takes, encoded)):
+        peaks = await run_in_threadpool(audio_peaks, audio)
+        result = {
+            "take": index,
+            "seed": take_request.seed,
+            "temperature": take_request.temperature,
+            "duration_seconds": audio.shape[-1] / replica_pool.sample_rate,
+            "waveform_id": waveform_store.add(peaks),
+            "audio": base64.b64encode(await asyncio.wrap_future(data)).decode("ascii"),
+        }
+        if request.peaks:
+            result["peaks"] = peaks.to_dict()
+        results.append(result)
+    return JSONResponse(
+        status_code=200,
+        content={"format": request.format, "sample_rate": replica_pool.sample_rate, "takes": results}
+    )
+
+@app.post("/tts/stream")
+async def text_to_speech_stream(request: TTSStreamRequest, http_request: Request):
+    """
+    Stream speech as each chunk is synthesized, either as a WAV with open-ended sizes
+    or as raw 16-bit little-endian mono PCM.
+    """
+    if not replica_pool.ready:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+    if request.stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported stream format {request.stream_format}, use one of {', '.join(STREAM_MEDIA_TYPES)}"
+        )
+    # Streamed chunks are never compressed, so only the defaults of the /tts output options apply
+    if request.format != "wav" or request.bitrate is not None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Streams don't support format or bitrate, set stream_format to one of {', '.join(STREAM_MEDIA_TYPES)}"
+        )
+
+    start_time = time.time()
+    timings = RequestTimings("stream", timing_log_sample_rate)
+    timings.set(text_length=len(request.text), voice=request.voice, stream_format=request.stream_format)
+    logger.debug(f"Received streaming TTS request for text length {len(request.text)} and voice {request.voice}")
+
+    job = submit_speech_job(stream_speech, request, kind="stream", client=client_id(http_request))
+
+    async def stream_audio() -> AsyncIterator[bytes]:
+        first_chunk = True
+        samples = 0
+        async for audio in job_events(job, http_request):
+            data = pcm16_bytes(audio)
+            samples += audio.shape[-1]
+            if first_chunk:
+                first_chunk = False
+                time_to_first_byte = time.time() - start_time
+                stream_ttfb.add(time_to_first_byte)
+                timings.set(time_to_first_byte=round(time_to_first_byte, 4))
+                logger.debug(f"First streamed audio after {time_to_first_byte:.2f} seconds")
+                # Send the header together with the first audio so the time to first
+                # byte measures actual audio
+                if request.stream_format == "wav":
+                    data = streaming_wav_header(replica_pool.sample_rate) + data
+            yield data
+        # Headers are sent already, so the only way to signal an error is to end the stream
+        timings.set(audio_seconds=round(samples / replica_pool.sample_rate, 3))
+        if job.status == "failed":
+            logger.error(f"Streaming speech generation failed: {job.error}")
+            timings.finish("failed")
+        else:
+            logger.debug(f"Streaming speech generation completed in {time.time() - start_time:.2f} seconds")
+            timings.finish()
+
+    return StreamingResponse(
+        stream_audio(),
+        media_type=STREAM_MEDIA_TYPES[request.stream_format],
+        headers={"X-Sample-Rate": str(replica_pool.sample_rate)}
+    )
+
+def synthesize_script(
+    job: Job,
+    lines: List[ScriptLine],
+    output: str,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None
+) -> Optional[bytes]:
+    """
+    Inference job: synthesize every line of a dialogue script.
+
+    All lines are parsed upfront and identical lines are synthesized only once. Lines are
+    processed grouped by voice so conditionals are reused, with a window of lines in flight
+    so their chunks can share batches. Each finished line is encoded in the requested format
+    and emitted as an event; for zip output the job returns the archive.
+    """
+    extension = OUTPUT_FORMATS[output_format].extension
+    job.progress = {"total": len(lines), "completed": 0, "failed": 0}
+    archive_buffer = io.BytesIO() if output == "zip" else None
+    archive = zipfile.ZipFile(archive_buffer, "w") if archive_buffer is not None else None
+    manifest = []
+    archive_names = set()
+
+    def publish(
+        line_ids: List[str],
+        audio_bytes: Optional[bytes] = None,
+        peaks: Optional[WaveformPeaks] = None,
+        error: Optional[str] = None
+    ):
+        if error is None:
+            waveform_id = waveform_store.add(peaks)
+            waveform_png = peaks.render() if archive is not None else None
+        for line_id in line_ids:
+            if error is not None:
+                result = {"id": line_id, "status": "failed", "error": error}
+                job.progress["failed"] += 1
+            else:
+                result = {
+                    "id": line_id,
+                    "status": "done",
+                    "duration_seconds": peaks.length / peaks.sample_rate,
+                    "waveform_id": waveform_id
+                }
+                job.progress["completed"] += 1
+                if archive is not None:
+                    name = archive_name(line_id)
+                    while f"{name}.{extension}" in archive_names:
+                        name = f"{name}_"
+                    archive_names.add(f"{name}.{extension}")
+                    archive.writestr(f"{name}.{extension}", audio_bytes)
+                    archive.writestr(f"{name}.png", waveform_png)
+                    result["file"] = f"{name}.{extension}"
+                    result["waveform"] = f"{name}.png"
+            manifest.append(result)
+            job.emit({**result, "audio": audio_bytes} if error is None else result)
+
+    # Parse markers and resolve voices of all lines upfront
+    work = {}
+    for line in lines:
+        key = (line.text, line.voice, round(line.exaggeration, 4), round(line.temperature, 4), line.seed)
+        if key in work:
+            work[key]["ids"].append(line.id)
+            continue
+        request = TTSRequest(
+            text=line.text,
+            voice="default" if line.voice == "default" else "custom",
+            voice_id=None if line.voice == "default" else line.voice,
+            exaggeration=line.exaggeration,
+            temperature=line.temperature,
+            priority="bulk",
+            seed=line.seed,
+            format=output_format,
+            bitrate=bitrate
+        )
+        entry = {"ids": [line.id], "voice": line.voice, "request": request}
+        with timed("parse"):
+            text_parts = parse_text_with_markers(line.text)
+        if not text_parts:
+            entry["error"] = "No valid text parts found after parsing"
+        else:
             try:
-                os.unlink(file_path)
-                logger.info(f"Successfully cleaned up temporary file: {file_path}")
-            except PermissionError as pe:
-                logger.error(f"Permission error cleaning up {file_path}: {str(pe)}", exc_info=True)
-            except OSError as oe:
-                logger.error(f"OS error cleaning up {file_path}: {str(oe)}", exc_info=True)
+                voice_sample, voice_hash = resolve_voice(request)
+                entry.update(text_parts=text_parts, voice_sample=voice_sample, voice_hash=voice_hash)
+            except HTTPException as e:
+                entry["error"] = e.detail["status"] if isinstance(e.detail, dict) else str(e.detail)
+        work[key] = entry
+    logger.info(f"Script job {job.id} has {len(lines)} lines, {len(work)} of them unique")
+
+    generated_samples = 0
+
+    def finish(entry, pending):
+        nonlocal generated_samples
+        try:
+            audio = concatenate(list(collect_audio(pending, job.cancelled)))
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating script line {entry['ids'][0]}: {str(e)}", exc_info=True)
+            publish(entry["ids"], error=str(e))
+            return
+        data = audio_encoder.encode(audio, replica_pool.sample_rate, output_format, bitrate)
+        if entry.get("cache_key"):
+            output_cache.put(entry["cache_key"], data, extension)
+        publish(entry["ids"], data, audio_peaks(audio))
+        line_throughput.record(len(entry["ids"]))
+        generated_samples += audio.shape[-1]
+
+    in_flight = deque()
+    for entry in sorted(work.values(), key=lambda entry: entry["voice"]):
+        if job.cancelled.is_set():
+            raise GenerationCancelled("Script job was cancelled")
+        if "error" in entry:
+            publish(entry["ids"], error=entry["error"])
+            continue
+        # Seeded lines rendered before, e.g. by an earlier export, come from the output cache
+        if entry["request"].seed is not None and output_cache is not None:
+            entry["cache_key"] = speech_cache_key(entry["request"], entry["text_parts"], entry["voice_hash"])
+            data = output_cache.get(entry["cache_key"])
+            if data is not None:
+                publish(entry["ids"], data, encoded_peaks(data))
+                continue
+        try:
+            pending = submit_chunks(
+                entry["text_parts"], entry["request"], entry["voice_sample"], entry["voice_hash"], job.cancelled
+            )
+        except Exception as e:
+            logger.error(f"Error submitting script line {entry['ids'][0]}: {str(e)}", exc_info=True)
+            publish(entry["ids"], error=str(e))
+            continue
+        in_flight.append((entry, pending))
+        if len(in_flight) >= script_window:
+            finish(*in_flight.popleft())
+    while in_flight:
+        finish(*in_flight.popleft())
+    observe_real_time_factor(job.kind, time.time() - job.started_at, generated_samples)
+
+    if archive is None:
+        return None
+    archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    archive.close()
+    return archive_buffer.getvalue()
+
+def start_script(
+    lines: List[ScriptLine],
+    output: str,
+    output_format: str = "wav",
+    bitrate: Optional[int] = None,
+    http_request: Optional[Request] = None
+):
+    """
+    Queue a script job, then stream its per-line results as NDJSON or, for zip output,
+    return the job so the archive can be fetched once it is done.
+    """
+    if not replica_pool.ready:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+    if output not in SCRIPT_OUTPUTS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output {output}, use one of {', '.join(SCRIPT_OUTPUTS)}")
+    if not lines:
+        raise HTTPException(status_code=400, detail="Script contains no lines")
+    try:
+        check_output_format(output_format, bitrate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        job = inference_worker.submit(
+            synthesize_script, lines, output, output_format, bitrate,
+            priority=PRIORITIES["bulk"], kind="script", client=client_id(http_request)
+        )
+    except QueueFullError as e:
+        raise queue_full_error(e)
+    job_store.add(job)
+    logger.info(f"Queued script job {job.id} with {len(lines)} lines")
+
+    if output == "zip":
+        return JSONResponse(
+            status_code=202,
+            content=job.to_dict(),
+            headers={"Location": f"/jobs/{job.id}"}
+        )
+
+    async def stream_results() -> AsyncIterator[str]:
+        async for result in job_events(job, http_request):
+            if "audio" in result:
+                result = {**result, "audio": base64.b64encode(result["audio"]).decode("ascii")}
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"status": job.status, "progress": job.progress, "error": job.error}) + "\n"
+
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        headers={"X-Job-Id": job.id}
+    )
+
+@app.post("/tts/batch")
+async def text_to_speech_batch(request: ScriptRequest, http_request: Request):
+    """
+    Synthesize a list of script lines in one request.
+    """
+    return start_script(request.lines, request.output, request.format, request.bitrate, http_request)
+
+@app.post("/tts/batch/upload")
+async def text_to_speech_batch_upload(
+    http_request: Request,
+    file: UploadFile = File(...),
+    output: str = Form("ndjson"),
+    format: str = Form("wav"),
+    bitrate: Optional[int] = Form(None)
+):
+    """
+    Synthesize a script uploaded as CSV or JSONL.
+    """
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    try:
+        lines = [ScriptLine(**entry) for entry in parse_script_file(content, file.filename or "")]
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid script: {str(e)}")
+    return start_script(lines, output, format, bitrate, http_request)
+
+@app.post("/jobs")
+async def create_job(request: TTSJobRequest, http_request: Request):
+    """
+    Queue a TTS job and return its ID right away; poll GET /jobs/{id} for its status.
+    """
+    if not replica_pool.ready:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+
+    job = submit_speech_job(generate_speech, request, client=client_id(http_request))
+    job_store.add(job)
+    logger.debug(f"Queued job {job.id} for text length {len(request.text)} with priority {request.priority}")
+    return JSONResponse(
+        status_code=202,
+        content=job.to_dict(),
+        headers={"Location": f"/jobs/{job.id}"}
+    )
+
+@app.post("/tts/longform")
+async def create_long_form_job(request: LongformRequest, http_request: Request):
+    """
+    Queue a job that writes the speech of a long text to a WAV file chunk by chunk. The
+    output of a seeded request is addressed by the request's content, so submitting it
+    again after an interruption resumes the file instead of starting over. Unseeded
+    requests ask for a new take each time and get an output of their own.
+    """
+    if not replica_pool.ready:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+    if request.format != "wav16":
+        raise HTTPException(status_code=400, detail="Long-form output is always 16-bit PCM WAV, use format wav16")
+
+    prepared = prepare_speech_job(request)
+    text_parts, _, voice_hash = prepared
+    output_id = speech_cache_key(request, text_parts, voice_hash)
+    if request.seed is None:
+        output_id = hashlib.sha256(f"{output_id}:{uuid.uuid4().hex}".encode()).hexdigest()
+    # Only one job writes a file at a time; identical requests get the running job
+    job = longform_jobs.get(output_id)
+    if job is None or job.finished_at is not None:
+        text_parts, voice_sample, voice_hash = prepared
+        try:
+            job = inference_worker.submit(
+                synthesize_long_form, text_parts, request, voice_sample, voice_hash, output_id,
+                priority=PRIORITIES[request.priority], kind="longform", client=client_id(http_request)
+            )
+        except QueueFullError as e:
+            raise queue_full_error(e)
+        longform_jobs[output_id] = job
+        job.future.add_done_callback(lambda _: longform_jobs.pop(output_id, None))
+        job_store.add(job)
+        logger.info(f"Queued long-form job {job.id} for text length {len(request.text)} into {output_id[:12]}")
+    return JSONResponse(
+        status_code=202,
+        content={**job.to_dict(), "output_id": output_id},
+        headers={"Location": f"/jobs/{job.id}"}
+    )
+
+@app.get("/tts/longform/{output_id}")
+async def get_long_form_output(output_id: str):
+    """
+    Return a finished long-form output, which outlives its job and restarts of the service.
+    """
+    checkpoint = LongformWriter.read_checkpoint(longform_dir, output_id) if re.fullmatch(r"[0-9a-f]{64}", output_id) else None
+    if checkpoint is None:
+        raise HTTPException(status_code=404, detail=f"Long-form output {output_id} not found")
+    if not checkpoint.get("done"):
+        raise HTTPException(status_code=409, detail=f"Long-form output {output_id} is incomplete after {checkpoint['entries']} entries")
+    path = os.path.join(longform_dir, f"{output_id}.wav")
+    # The modification time orders outputs for eviction
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Long-form output {output_id} not found")
+    return FileResponse(
+        path,
+        media_type="audio/wav",
+        filename=f"longform-{output_id[:12]}.wav"
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(status_code=200, content=job.to_dict())
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job. Its chunks that haven't been generated are dropped.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    inference_worker.cancel(job)
+    return JSONResponse(status_code=200, content=job.to_dict())
+
+@app.get("/jobs/{job_id}/audio")
+async def get_job_audio(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Job {job_id} failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    if job.kind == "script":
+        archive = job.future.result()
+        if archive is None:
+            raise HTTPException(status_code=409, detail=f"Job {job_id} streamed its results and has no archive")
+        return Response(
+            content=archive,
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="script-{job_id}.zip"'}
+        )
+    if job.kind == "longform":
+        return await get_long_form_output(job.future.result()["output_id"])
+    # Speech jobs run with (text_parts, request, voice_sample, voice_hash)
+    request = job.args[1]
+    return await audio_response(job.future.result(), request.format, request.bitrate)
+
+@app.post("/voices")
+async def register_voice(file: UploadFile = File(...)):
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    voice_id, created = voice_registry.register(content)
+    return JSONResponse(
+        status_code=201 if created else 200,
+        content={"voice_id": voice_id, "status": "registered" if created else "exists"}
+    )
+
+@app.get("/voices")
+async def list_voices():
+    return JSONResponse(
+        status_code=200,
+        content={"voices": voice_registry.list()}
+    )
+
+@app.delete("/voices/{voice_id}")
+async def delete_voice(voice_id: str):
+    if not voice_registry.delete(voice_id):
+        raise HTTPException(status_code=404, detail=f"Voice {voice_id} is not registered")
+    replica_pool.discard(voice_id)
+    if conditioning_store is not None:
+        conditioning_store.discard(voice_id)
+    return JSONResponse(
+        status_code=200,
+        content={"voice_id": voice_id, "status": "deleted"}
+    )
+
+def precompute_voice(voice_id: str, exaggeration: float) -> str:
+    """Condition a registered voice and persist the result, returning the outcome."""
+    voice_path = voice_registry.path(voice_id)
+    if voice_path is None:
+        return "voice_not_registered"
+    if conditioning_store.contains(voice_id):
+        return "stored"
+    replica_pool.precompute(voice_id, voice_path, exaggeration)
+    return "computed"
+
+@app.post("/voices/precompute")
+async def precompute_voices(request: PrecomputeRequest):
+    if not replica_pool.ready or conditioning_store is None:
+        raise HTTPException(status_code=503, detail="TTS model is still initializing")
+
+    start_time = time.time()
+    voice_ids = list(dict.fromkeys(request.voice_ids))
+    futures = [
+        asyncio.wrap_future(precompute_pool.submit(precompute_voice, voice_id, request.exaggeration))
+        for voice_id in voice_ids
+    ]
+    outcomes = await asyncio.gather(*futures, return_exceptions=True)
+
+    results = {}
+    for voice_id, outcome in zip(voice_ids, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Error precomputing conditionals for voice {voice_id}: {str(outcome)}")
+            results[voice_id] = "error"
         else:
-            logger.warning(f"Temporary file {file_path} does not exist during cleanup")
+            results[voice_id] = outcome
+    logger.info(f"Precomputed conditionals for {len(voice_ids)} voices in {time.time() - start_time:.2f} seconds")
+    return JSONResponse(
+        status_code=200,
+        content={"results": results}
+    )
+
+@app.get("/stats")
+async def stats():
+    return JSONResponse(
+        status_code=200,
+        content={
+            "conditioning_store": conditioning_store.stats() if conditioning_store is not None else None,
+            "output_cache": output_cache.stats() if output_cache is not None else None,
+            "segment_store": segment_store.stats() if segment_store is not None else None,
+            "encoding": audio_encoder.stats(),
+            "stream_time_to_first_byte_seconds": stream_ttfb.summary(),
+            "queue_depth": inference_worker.queue_depth,
+            "inference": inference_worker.stats(),
+            "replicas": replica_pool.stats(),
+            "lines_per_second": line_throughput.rate()
+        }
+    )
+
+def metrics_snapshot() -> Dict[str, object]:
+    """
+    Current queue depths, cache counters, pipelines, memory limits and devices for the
+    Prometheus collector.
+    """
+    queue_depth = {"inference": inference_worker.queue_depth}
+    conditioning = {"hits": 0, "misses": 0, "size": 0}
+    pipelines = {}
+    memory = {}
+    for replica in replica_pool.replicas:
+        queue_depth[f"replica-{replica.index}"] = replica.scheduler.pending
+        memory[f"replica-{replica.index}"] = replica.memory_limits.stats()
+        replica_stats = replica.conditioning_stats() if replica.ready else None
+        if replica_stats is not None:
+            for name in conditioning:
+                conditioning[name] += replica_stats[name]
+        pipeline_stats = replica.pipeline_stats() if replica.ready else None
+        if pipeline_stats is not None:
+            pipelines[f"replica-{replica.index}"] = pipeline_stats
+    caches = {"conditioning": conditioning}
+    if conditioning_store is not None:
+        caches["conditioning_store"] = conditioning_store.stats()
+    if output_cache is not None:
+        caches["output"] = output_cache.stats()
+    if segment_store is not None:
+        caches["segments"] = segment_store.stats()
+    jobs = {"rejected": inference_worker.rejected, "cancelled": inference_worker.cancelled}
+    return {
+        "queue_depth": queue_depth, "jobs": jobs, "caches": caches, "pipelines": pipelines, "memory": memory,
+        "cuda_devices": cuda_devices
+    }
+
+metrics.register_collector(metrics_snapshot)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    data, content_type = metrics.render()
+    return Response(content=data, media_type=content_type)
+
+@app.get("/waveform/{waveform_id}")
+async def get_waveform(waveform_id: str, width: int = 800, height: int = 200):
+    """
+    Render the waveform of recently generated speech, identified by the X-Waveform-Id
+    header of its response.
+    """
+    peaks = waveform_store.get(waveform_id)
+    if peaks is None:
+        raise HTTPException(status_code=404, detail=f"Waveform {waveform_id} not found")
+    if not (0 < width <= 8192 and 0 < height <= 2048):
+        raise HTTPException(status_code=400, detail="Invalid waveform size")
+    return Response(content=await run_in_threadpool(peaks.render, width, height), media_type="image/png")
+
+def peaks_response(peaks: WaveformPeaks, format: str) -> Response:
+    if format == "json":
+        return JSONResponse(status_code=200, content=peaks.to_dict())
+    if format != "bin":
+        raise HTTPException(status_code=400, detail=f"Unsupported peaks format {format}, use bin or json")
+    return Response(content=peaks.to_bytes(), media_type=PEAKS_MEDIA_TYPE)
+
+@app.get("/waveform/peaks/{waveform_id}")
+async def get_waveform_peaks(waveform_id: str, format: str = "bin"):
+    """
+    Return the multi-resolution peaks of recently generated speech.
+    """
+    peaks = waveform_store.get(waveform_id)
+    if peaks is None:
+        raise HTTPException(status_code=404, detail=f"Waveform {waveform_id} not found")
+    return peaks_response(peaks, format)
+
+@app.post("/waveform/peaks")
+async def waveform_peaks_endpoint(file: UploadFile = File(...), format: str = "bin"):
+    """
+    Compute the multi-resolution peaks of an uploaded audio file.
+    """
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    try:
+        peaks = await run_in_threadpool(load_peaks, io.BytesIO(content))
     except Exception as e:
-        logger.error(f"Unexpected error cleaning up temporary file {file_path}: {str(e)}", exc_info=True)
+        logger.error(f"Error computing waveform peaks: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Invalid audio file: {str(e)}")
+    return peaks_response(peaks, format)
 
 @app.post("/generate-waveform")
 async def generate_waveform_endpoint(file: UploadFile = File(...)):
+    content = await file.read()
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+
+    # Generate waveform straight from the uploaded bytes
     try:
-        # Create a temporary file for the input
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_input:
-            content = await file.read()
-            if not content:
-                raise HTTPException(status_code=400, detail="Empty file uploaded")
-            temp_input.write(content)
-            input_path = temp_input.name
-
-        # Create a temporary file for the output
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_output:
-            output_path = temp_output.name
-
-        # Generate waveform
-        try:
-            generate_waveform(input_path, output_path)
-        except Exception as e:
-            logger.error(f"Error in waveform generation: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Error generating waveform: {str(e)}")
-
-        # Clean up input file
-        os.unlink(input_path)
-
-        # Return the waveform image
-        return FileResponse(
-            output_path,
-            media_type="image/png",
-            filename="waveform.png",
-            background=lambda: asyncio.create_task(cleanup_file(output_path))  # Delete file after sending
-        )
-    except HTTPException:
-        raise
+        peaks = await run_in_threadpool(load_peaks, io.BytesIO(content))
+        image = await run_in_threadpool(peaks.render)
     except Exception as e:
-        logger.error(f"Error in waveform endpoint: {str(e)}", exc_info=True)
-        # Clean up temp files if they exist
-        if 'input_path' in locals() and os.path.exists(input_path):
-            os.unlink(input_path)
-        if 'output_path' in locals() and os.path.exists(output_path):
-            os.unlink(output_path)
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error in waveform generation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error generating waveform: {str(e)}")
+
+    # Return the waveform image
+    return Response(
+        content=image,
+        media_type="image/png",
+        headers={"Content-Disposition": 'attachment; filename="waveform.png"'}
+    )
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
@@ -0,0 +1,88 @@
+import os
+import re
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from conditioning import hash_voice_sample
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOICE_REGISTRY_DIR = "data/tts_voices"
+
+VOICE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class VoiceRegistry:
+    """
+    Voice samples registered with the TTS service, stored by content hash.
+
+    Clients upload a sample once and refer to it by its ID afterwards. Since the ID is the
+    SHA-256 of the sample, clients can compute it themselves and only upload on a miss.
+    """
+
+    def __init__(self, directory: str = DEFAULT_VOICE_REGISTRY_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def is_valid_id(voice_id: str) -> bool:
+        return bool(voice_id) and VOICE_ID_PATTERN.match(voice_id) is not None
+
+    def _path_for(self, voice_id: str) -> str:
+        return os.path.join(self.directory, f"{voice_id}.wav")
+
+    def register(self, data: bytes) -> Tuple[str, bool]:
+        """
+        Store a voice sample and return its ID and whether it was newly created.
+        """
+        voice_id = hash_voice_sample(data)
+        path = self._path_for(voice_id)
+        with self._lock:
+            if os.path.exists(path):
+                return voice_id, False
+            # Write to a sibling file first so readers never see a partial sample
+            partial_path = f"{path}.{os.getpid()}.partial"
+            with open(partial_path, "wb") as f:
+                f.write(data)
+            os.replace(partial_path, path)
+        logger.info(f"Registered voice sample {voice_id} ({len(data)} bytes)")
+        return voice_id, True
+
+    def path(self, voice_id: str) -> Optional[str]:
+        """
+        Return the sample path for a registered voice, or None if it is unknown.
+        """
+        if not self.is_valid_id(voice_id):
+            return None
+        path = self._path_for(voice_id)
+        return path if os.path.exists(path) else None
+
+    def list(self) -> List[Dict]:
+        voices = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith(".wav"):
+                continue
+            voice_id = entry.name[:-len(".wav")]
+            if not self.is_valid_id(voice_id):
+                continue
+            stat = entry.stat()
+            voices.append({
+                "voice_id": voice_id,
+                "size": stat.st_size,
+                "registered_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(stat.st_mtime)),
+            })
+        return sorted(voices, key=lambda voice: voice["registered_at"])
+
+    def delete(self, voice_id: str) -> bool:
+        path = self.path(voice_id)
+        if path is None:
+            return False
+        with self._lock:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                return False
+        logger.info(f"Deleted voice sample {voice_id}")
+        return True